@@ -1,21 +1,181 @@
-from django import forms
 from django.conf import settings
 from django.contrib import admin
 from django.contrib.admin.sites import AlreadyRegistered
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR
+from django.core.paginator import Paginator
+from django.db.models import Count, Q
 
 from adminextensions.admin import ExtendedModelAdmin
 from adminextensions.shortcuts import model_search, model_link
 
-from securepay.models import Transaction, BankAccount
+from securepay.models import Transaction, ArchivedTransaction, BankAccount, \
+    DailySummary
+from securepay import export
+from securepay import merchants
+from securepay.utils import estimate_count
+
+#: Use the changelist for very large transaction tables. See
+#: <TransactionAdmin>.
+HIGH_VOLUME = getattr(settings, 'SECUREPAY_ADMIN_HIGH_VOLUME', False)
+
+#: The query string parameter the keyset changelist pages with
+BEFORE_VAR = 'before'
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    A paginator that uses the database's estimate of the number of rows for
+    large result sets. See <securepay.utils.estimate_count>.
+    """
+    def _get_count(self):
+        if self._count is None:
+            self._count = estimate_count(self.object_list)
+        return self._count
+    count = property(_get_count)
+
+
+class MerchantListFilter(admin.SimpleListFilter):
+    """
+    Filter by the merchants in `SECUREPAY_MERCHANTS`, rather than finding
+    every merchant in the table with a `SELECT DISTINCT`.
+    """
+    title = 'merchant'
+    parameter_name = 'merchant'
+
+    def lookups(self, request, model_admin):
+        names = sorted(merchant.name
+            for merchant in merchants.all_merchants())
+        return [(name, name) for name in names]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(merchant=self.value())
+        return queryset
+
+
+class ExactSearchChangeList(ChangeList):
+    """
+    A changelist whose search box finds exact, case sensitive matches of the
+    whole search term on any of the `search_fields`, so that the plain
+    indexes on them are used. Django's `=` prefix does a case insensitive
+    match, which PostgreSQL can not answer from those indexes.
+    """
+    def get_query_set(self, request):
+        search_fields, self.search_fields = self.search_fields, ()
+        try:
+            queryset = super(ExactSearchChangeList, self).get_query_set(
+                request)
+        finally:
+            self.search_fields = search_fields
+
+        query = self.query.strip()
+        if search_fields and query:
+            matches = Q()
+            for field_name in search_fields:
+                matches |= Q(**{field_name.lstrip('=^@'): query})
+            queryset = queryset.filter(matches)
+        return queryset
+
+
+class KeysetChangeList(ExactSearchChangeList):
+    """
+    A changelist that pages through results newest first by primary key,
+    using `?before=<pk>`, rather than with `OFFSET`. Every page costs the same
+    to load, no matter how far back it is. Result counts are estimated, and
+    searches only find exact matches.
+
+    Sorting by a column header can not be paged by primary key, so it falls
+    back to ordinary `OFFSET` paging.
+    """
+    def __init__(self, request, *args, **kwargs):
+        self.keyset = ORDER_VAR not in request.GET
+        try:
+            self.before = int(request.GET.get(BEFORE_VAR))
+        except (TypeError, ValueError):
+            self.before = None
+        super(KeysetChangeList, self).__init__(request, *args, **kwargs)
+
+    def get_query_set(self, request):
+        # Not a field lookup, so it must not be passed to the filters
+        self.params.pop(BEFORE_VAR, None)
+
+        queryset = super(KeysetChangeList, self).get_query_set(request)
+        if self.keyset and self.before is not None:
+            queryset = queryset.filter(pk__lt=self.before)
+        return queryset
+
+    def get_ordering(self, request, queryset):
+        if not self.keyset:
+            return super(KeysetChangeList, self).get_ordering(request,
+                queryset)
+        return ['-pk']
+
+    def get_results(self, request):
+        if not self.keyset:
+            return super(KeysetChangeList, self).get_results(request)
+
+        paginator = self.model_admin.get_paginator(request, self.query_set,
+            self.list_per_page)
+        self.result_count = paginator.count
+        if not self.query_set.query.where:
+            self.full_result_count = self.result_count
+        else:
+            self.full_result_count = estimate_count(self.root_query_set)
+
+        results = list(self.query_set[:self.list_per_page + 1])
+        self.result_list = results[:self.list_per_page]
+        self.next_before = None
+        if len(results) > self.list_per_page:
+            self.next_before = self.result_list[-1].pk
+
+        self.can_show_all = False
+        self.multi_page = False
+        self.paginator = paginator
+
+    def first_page_url(self):
+        return self.get_query_string(remove=[BEFORE_VAR])
+
+    def next_page_url(self):
+        if self.next_before is None:
+            return None
+        return self.get_query_string({BEFORE_VAR: self.next_before})
+
+
+def dependent_transactions(context):
+    """
+    An object tool linking to the transactions that refer to this one,
+    showing how many there are. The count comes from
+    <TransactionAdmin.get_object>.
+    """
+    obj = context['original']
+    text = 'Find dependent transactions (%d)' % obj.dependent_count
+    tool = model_search(text, Transaction,
+        lambda obj: {'reference_transaction__id': obj.pk})
+    return tool(context)
+
 
 class TransactionAdmin(ExtendedModelAdmin):
-    date_hierarchy = 'created'
+    """
+    Set `SECUREPAY_ADMIN_HIGH_VOLUME = True` for tables with millions of
+    transactions. The changelist then skips the date hierarchy, pages by
+    primary key with estimated counts, and only searches for exact matches
+    on the indexed identifiers.
+    """
+    date_hierarchy = None if HIGH_VOLUME else 'created'
 
     list_display = ('txn_type', 'amount', 'bank_message', 'success',
         'card_name', 'created', 'processed', 'status')
-    list_filter = ('txn_type', 'success', 'status', 'processed')
+    list_filter = ('txn_type', 'success', 'status', 'processed',
+        MerchantListFilter)
 
-    search_fields = ['amount', 'card_name']
+    if HIGH_VOLUME:
+        search_fields = ['=purchase_order_no', '=txn_id', '=preauth_id']
+        change_list_template = 'securepay/admin/keyset_change_list.html'
+        paginator = EstimatedCountPaginator
+    else:
+        search_fields = ['amount', 'card_name']
+
+    actions = ['export_csv', 'export_jsonl']
 
     object_tools = {
         'change': [
@@ -24,8 +184,7 @@ class TransactionAdmin(ExtendedModelAdmin):
                 lambda obj: getattr(obj.reference_transaction, 'pk', None)),
 
             # Search for dependent transactions
-            model_search('Find dependent transactions', Transaction,
-                lambda obj: {'reference_transaction__id': obj.pk}),
+            dependent_transactions,
         ],
     }
 
@@ -38,6 +197,7 @@ class TransactionAdmin(ExtendedModelAdmin):
         )}),
 
         ('Details', {'fields': (
+            'merchant',
             'purchase_order_no',
             'success',
             'reference_transaction'
@@ -50,7 +210,8 @@ class TransactionAdmin(ExtendedModelAdmin):
             'processed',
             'bank_message',
             'response_code',
-            'response_text',
+            'raw_response',
+            'raw_request',
         )}),
     )
 
@@ -68,12 +229,41 @@ class TransactionAdmin(ExtendedModelAdmin):
         'processed',
         'bank_message',
         'response_code',
-        'response_text',
+        'raw_response',
+        'raw_request',
     ]
 
     def has_add_permission(self, request):
         return False
 
+    def queryset(self, request):
+        # The raw response and extra data are big, and are never shown in the
+        # changelist
+        queryset = super(TransactionAdmin, self).queryset(request)
+        return queryset.defer('response_text', 'extra_data')
+
+    def get_changelist(self, request, **kwargs):
+        if HIGH_VOLUME:
+            return KeysetChangeList
+        return super(TransactionAdmin, self).get_changelist(request, **kwargs)
+
+    def export_csv(self, request, queryset):
+        return export.export_response(queryset, 'csv')
+    export_csv.short_description = 'Export selected transactions as CSV'
+
+    def export_jsonl(self, request, queryset):
+        return export.export_response(queryset, 'jsonl')
+    export_jsonl.short_description = \
+        'Export selected transactions as JSON lines'
+
+    def get_object(self, request, object_id):
+        queryset = self.queryset(request).annotate(
+            dependent_count=Count('referenced_by'))
+        try:
+            return queryset.get(pk=object_id)
+        except (Transaction.DoesNotExist, ValueError):
+            return None
+
 
 
 try:
@@ -81,6 +271,62 @@ try:
 except AlreadyRegistered:
     pass
 
+class ArchivedTransactionAdmin(admin.ModelAdmin):
+    """
+    Archived transactions, read only. Only exact matches on the indexed
+    identifiers are searched.
+    """
+    list_display = ('txn_type', 'amount', 'bank_message', 'success',
+        'card_name', 'created', 'archived')
+    list_filter = ('txn_type', 'success', MerchantListFilter)
+    search_fields = ['=purchase_order_no', '=txn_id', '=preauth_id']
+    readonly_fields = ('txn_type', 'amount', 'card_name', 'description',
+        'merchant', 'purchase_order_no', 'success', 'reference_transaction_id',
+        'txn_id', 'preauth_id', 'status', 'processed', 'bank_message',
+        'response_code', 'created', 'archived', 'raw_response', 'raw_request')
+    exclude = ('extra_data', 'response_log', 'request_log', 'modified',
+        'debug')
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_changelist(self, request, **kwargs):
+        return ExactSearchChangeList
+
+    def queryset(self, request):
+        queryset = super(ArchivedTransactionAdmin, self).queryset(request)
+        return queryset.defer('response_log', 'request_log', 'extra_data')
+
+try:
+    admin.site.register(ArchivedTransaction, ArchivedTransactionAdmin)
+except AlreadyRegistered:
+    pass
+
+class DailySummaryAdmin(admin.ModelAdmin):
+    """
+    Daily totals, read only from the <DailySummary> tables
+    """
+    date_hierarchy = 'date'
+    list_display = ('date', 'txn_type', 'merchant', 'debug', 'transactions',
+        'successful', 'success_percentage', 'amount', 'successful_amount')
+    list_filter = ('txn_type', MerchantListFilter, 'debug')
+    readonly_fields = ('date', 'txn_type', 'merchant', 'debug',
+        'transactions', 'successful', 'amount', 'successful_amount')
+
+    def success_percentage(self, obj):
+        if obj.success_rate is None:
+            return '-'
+        return '%.1f%%' % (obj.success_rate * 100)
+    success_percentage.short_description = 'Success rate'
+
+    def has_add_permission(self, request):
+        return False
+
+try:
+    admin.site.register(DailySummary, DailySummaryAdmin)
+except AlreadyRegistered:
+    pass
+
 try:
     admin.site.register(BankAccount)
 except AlreadyRegistered:
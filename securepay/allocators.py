@@ -0,0 +1,207 @@
+"""
+Purchase order number allocators.
+
+Purchase order numbers are allocated before a transaction is saved, so that a
+new transaction can be created with a single `INSERT`. The allocator used is
+set with the `SECUREPAY_PURCHASE_ORDER_ALLOCATOR` setting, as a dotted path to
+an <Allocator> subclass. Keyword arguments for it can be given in
+`SECUREPAY_PURCHASE_ORDER_ALLOCATOR_OPTIONS`.
+"""
+import os
+import time
+import threading
+
+from django.conf import settings
+from django.db import connection, IntegrityError
+from django.db import transaction as db_transaction
+from django.db.models import F, Max
+from django.utils.importlib import import_module
+
+from securepay import utils
+
+DEFAULT_ALLOCATOR = 'securepay.allocators.HiLoAllocator'
+
+
+class Allocator(object):
+    """
+    Hands out unique purchase order numbers
+    """
+    def allocate(self):
+        """
+        Get a new, unique number
+        """
+        raise NotImplementedError()
+
+    def allocate_many(self, count):
+        """
+        Get a list of `count` new, unique numbers
+        """
+        return [self.allocate() for i in range(count)]
+
+
+class HiLoAllocator(Allocator):
+    """
+    Reserves blocks of `block_size` numbers at a time from a
+    <PurchaseOrderSequence> row, and hands them out from memory. Each process
+    reserves its own blocks, so numbers are unique but not strictly ordered
+    between processes, and numbers left in a block when a process exits are
+    never used.
+
+    A block reserved inside a transaction is given back if the transaction
+    rolls back, so inside a transaction only the numbers asked for are
+    reserved, and none are kept for later.
+    """
+    def __init__(self, name='purchase_order_no', block_size=100):
+        self.name = name
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        self.next_value = self.limit = 0
+        self.pid = os.getpid()
+
+    def allocate(self):
+        return self.allocate_many(1)[0]
+
+    def allocate_many(self, count):
+        values = []
+        with self.lock:
+            if self.pid != os.getpid():
+                # Never share a block with the parent process
+                self.next_value = self.limit = 0
+                self.pid = os.getpid()
+
+            while len(values) < count:
+                if self.next_value >= self.limit \
+                        and db_transaction.is_managed():
+                    size = count - len(values)
+                    start = self.reserve(size)
+                    values.extend(range(start, start + size))
+                    break
+
+                if self.next_value >= self.limit:
+                    size = max(self.block_size, count - len(values))
+                    self.next_value = self.reserve(size)
+                    self.limit = self.next_value + size
+
+                take = min(count - len(values), self.limit - self.next_value)
+                values.extend(range(self.next_value, self.next_value + take))
+                self.next_value += take
+
+        return values
+
+    def reserve(self, size):
+        """
+        Reserve `size` numbers from the database, returning the first one.
+        Inside a transaction, this runs in a savepoint rather than committing
+        the caller's work, the sequence row stays locked until the caller
+        commits, and the numbers are given back if the caller rolls back.
+        """
+        from securepay.models import PurchaseOrderSequence
+
+        with utils.atomic():
+            # The UPDATE locks the row until the transaction commits, so the
+            # value read back is ours alone
+            sequences = PurchaseOrderSequence.objects.filter(name=self.name)
+            if not sequences.update(next_value=F('next_value') + size):
+                # Only the first reservation ever has to make the row
+                self.ensure_sequence()
+                sequences.update(next_value=F('next_value') + size)
+            return sequences.values_list('next_value', flat=True)[0] - size
+
+    def ensure_sequence(self):
+        """
+        Make the <PurchaseOrderSequence> row if it does not exist. It starts
+        after the largest existing transaction ID, as that is what purchase
+        order numbers used to be made from.
+        """
+        from securepay.models import PurchaseOrderSequence, Transaction
+
+        if PurchaseOrderSequence.objects.filter(name=self.name).exists():
+            return
+
+        start = (Transaction.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+        try:
+            with utils.atomic():
+                PurchaseOrderSequence.objects.create(name=self.name,
+                    next_value=start)
+        except IntegrityError:
+            # Someone else made it first
+            pass
+
+
+class SequenceAllocator(Allocator):
+    """
+    Takes numbers from a PostgreSQL sequence, one query per number. Every
+    number is used, in order, at the cost of a round trip per transaction.
+    """
+    def __init__(self, sequence='securepay_purchase_order_no_seq'):
+        self.sequence = sequence
+
+    def allocate(self):
+        cursor = connection.cursor()
+        cursor.execute('SELECT nextval(%s)', [self.sequence])
+        return cursor.fetchone()[0]
+
+    def allocate_many(self, count):
+        cursor = connection.cursor()
+        cursor.execute('SELECT nextval(%s) FROM generate_series(1, %s)',
+            [self.sequence, count])
+        return [row[0] for row in cursor.fetchall()]
+
+
+class TimeOrderedAllocator(Allocator):
+    """
+    Makes roughly time ordered numbers without touching the database, from the
+    current time in milliseconds, a node number, and a per-millisecond
+    counter. Every process must be given a different `node` (0 to 1023) for
+    the numbers to be unique; by default the process ID is used.
+    """
+    NODE_BITS = 10
+    COUNTER_BITS = 12
+
+    def __init__(self, node=None, epoch=1262304000000):
+        self.node = node
+        self.epoch = epoch
+        self.lock = threading.Lock()
+        self.last_millis = 0
+        self.counter = 0
+
+    def allocate(self):
+        node = self.node if self.node is not None else os.getpid()
+        node &= (1 << self.NODE_BITS) - 1
+
+        with self.lock:
+            millis = int(time.time() * 1000) - self.epoch
+            if millis <= self.last_millis:
+                millis = self.last_millis
+                self.counter += 1
+                if self.counter >> self.COUNTER_BITS:
+                    # Used up this millisecond, so borrow the next one
+                    millis += 1
+                    self.counter = 0
+            else:
+                self.counter = 0
+            self.last_millis = millis
+
+            return (((millis << self.NODE_BITS) | node) << self.COUNTER_BITS) \
+                | self.counter
+
+
+_allocator = None
+
+def get_allocator():
+    """
+    Get the configured <Allocator>
+    """
+    global _allocator
+
+    if _allocator is None:
+        path = getattr(settings, 'SECUREPAY_PURCHASE_ORDER_ALLOCATOR',
+            DEFAULT_ALLOCATOR)
+        options = getattr(settings,
+            'SECUREPAY_PURCHASE_ORDER_ALLOCATOR_OPTIONS', {})
+
+        module_name, class_name = path.rsplit('.', 1)
+        allocator_class = getattr(import_module(module_name), class_name)
+        _allocator = allocator_class(**options)
+
+    return _allocator
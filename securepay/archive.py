@@ -0,0 +1,158 @@
+"""
+Archival of old transactions.
+
+Completed transactions older than `SECUREPAY_ARCHIVE_AFTER` days are moved,
+in batches, from the live <Transaction> table to <ArchivedTransaction>,
+along with their logs. Run `manage.py securepay_archive` regularly to keep
+the live table, and its indexes, small.
+
+Transactions keep their IDs when archived, so references between them still
+resolve: <ArchivedTransaction.reference_transaction> looks in both tables. A
+transaction is never archived while a transaction staying in the live table
+refers to it. Batches are archived newest first, so refunds and the like
+leave the live table before the transactions they refer to. Refunding,
+reversing or completing an archived transaction <restore>s it to the live
+table first.
+
+<TransactionManager.find> looks transactions up in both tables.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.utils import timezone
+
+from securepay import utils
+from securepay.models import ArchivedTransaction, Transaction, \
+    TransactionData, TransactionLog
+
+#: Days after which completed transactions are archived
+ARCHIVE_AFTER = getattr(settings, 'SECUREPAY_ARCHIVE_AFTER', 365)
+
+#: Transactions moved in each database transaction
+BATCH_SIZE = getattr(settings, 'SECUREPAY_ARCHIVE_BATCH_SIZE', 1000)
+
+#: Fields copied as is between the live and archive tables
+FIELDS = ['created', 'modified', 'purchase_order_no', 'merchant',
+    'card_name', 'txn_type', 'amount', 'description', 'extra_data', 'status',
+    'processed', 'success', 'response_code', 'bank_message',
+    'reference_transaction_id', 'txn_id', 'preauth_id', 'debug']
+
+
+def eligible(older_than=ARCHIVE_AFTER):
+    """
+    Get the transactions that can be archived: completed ones older than
+    `older_than` days, that no transaction staying live refers to
+    """
+    cutoff = timezone.now() - datetime.timedelta(days=older_than)
+    staying = Transaction.objects \
+        .filter(reference_transaction__isnull=False) \
+        .exclude(status='completed', created__lt=cutoff)
+    return Transaction.objects \
+        .filter(status='completed', created__lt=cutoff) \
+        .exclude(pk__in=staying.values('reference_transaction'))
+
+def archive(older_than=ARCHIVE_AFTER, batch_size=BATCH_SIZE, limit=None):
+    """
+    Archive eligible transactions, newest first, `batch_size` at a time, until
+    there are none left or `limit` have been archived. Returns the number
+    archived.
+    """
+    archived = 0
+    before = None
+    while limit is None or archived < limit:
+        size = batch_size if limit is None \
+            else min(batch_size, limit - archived)
+        candidates = eligible(older_than).order_by('-pk')
+        if before is not None:
+            candidates = candidates.filter(pk__lt=before)
+
+        pks = list(candidates.values_list('pk', flat=True)[:size])
+        if not pks:
+            break
+        before = pks[-1]
+        archived += _archive_batch(pks)
+
+    return archived
+
+@db_transaction.commit_on_success
+def _archive_batch(pks):
+    transactions = list(Transaction.objects.select_for_update()
+        .filter(pk__in=pks, status='completed'))
+
+    # Anything that started referring to these since they were picked keeps
+    # them live
+    pks = [transaction.pk for transaction in transactions]
+    referenced = set(Transaction.objects
+        .filter(reference_transaction__in=pks).exclude(pk__in=pks)
+        .values_list('reference_transaction', flat=True))
+    transactions = [transaction for transaction in transactions
+        if transaction.pk not in referenced]
+    pks = [transaction.pk for transaction in transactions]
+    if not pks:
+        return 0
+
+    logs = dict(((log.transaction_id, log.kind), log.data)
+        for log in TransactionLog.objects.filter(transaction__in=pks))
+
+    ArchivedTransaction.objects.bulk_create([
+        _archived_copy(transaction, logs) for transaction in transactions])
+    Transaction.objects.filter(pk__in=pks).delete()
+    return len(pks)
+
+def _archived_copy(transaction, logs):
+    response_log = logs.get((transaction.pk, 'response'), '')
+    if not response_log and transaction.response_text:
+        response_log = utils.compress_text(transaction.response_text)
+
+    return ArchivedTransaction(id=transaction.pk,
+        response_log=response_log,
+        request_log=logs.get((transaction.pk, 'request'), ''),
+        **dict((name, getattr(transaction, name)) for name in FIELDS))
+
+def restore(archived):
+    """
+    Move an <ArchivedTransaction> back to the live table, along with any
+    archived transactions it refers to, and return the live <Transaction>.
+    Inside a transaction this runs in a savepoint, and the caller commits.
+    The archived row is locked first, so if two processes restore the same
+    transaction, the second gets the one the first restored.
+    """
+    with utils.atomic():
+        return _restore(archived.pk)
+
+def _restore(pk):
+    # Returns `None` if the transaction is in neither table
+    archived = list(ArchivedTransaction.objects.select_for_update()
+        .filter(pk=pk))
+    live = Transaction.objects.filter(pk=pk)
+    if not archived:
+        # Restored by someone else while we waited for the lock
+        return live[0] if live else None
+    archived = archived[0]
+    if live:
+        archived.delete()
+        return live[0]
+
+    reference_id = archived.reference_transaction_id
+    if reference_id is not None \
+            and not Transaction.objects.filter(pk=reference_id).exists():
+        if _restore(reference_id) is None:
+            reference_id = None
+
+    fields = dict((name, getattr(archived, name)) for name in FIELDS)
+    fields['reference_transaction_id'] = reference_id
+    Transaction.objects.bulk_create([Transaction(id=archived.pk, **fields)])
+    # Inserting sets the automatic timestamps, so put the originals back
+    Transaction.objects.filter(pk=archived.pk).update(
+        created=archived.created, modified=archived.modified)
+
+    transaction = Transaction.objects.get(pk=archived.pk)
+    TransactionData.objects.index([transaction])
+    TransactionLog.objects.bulk_create([
+        TransactionLog(transaction=transaction, kind=kind, data=data)
+        for kind, data in [('response', archived.response_log),
+            ('request', archived.request_log)] if data])
+
+    archived.delete()
+    return transaction
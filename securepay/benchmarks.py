@@ -0,0 +1,255 @@
+"""
+Microbenchmarks for each stage of making a transaction: building the request,
+serialising it, parsing the response, redacting it for the logs, and saving
+the results. The database stages send requests to a stub transport rather
+than to SecurePay.
+
+Run these with `manage.py securepay_benchmark`. The database stages write
+thousands of fake transactions, so the command runs them against a throwaway
+test database unless it is given `--use-configured-db`.
+"""
+import gc
+import sys
+import time
+import platform
+from decimal import Decimal
+from xml.etree import ElementTree
+
+from requests.adapters import BaseAdapter
+from requests.models import Response
+
+from securepay import client
+from securepay import decoder
+from securepay import encoder
+from securepay.utils import RedactedXML, sample_credit_card_data
+
+merchant = {'merchant_id': 'ABC0001', 'password': 'abc123'}
+
+sample_bank_account = {
+    'bsb': '123456',
+    'account_number': '12345678',
+    'name': 'Test Account',
+}
+
+RESPONSE_TEMPLATE = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="no"?>'
+    '<SecurePayMessage><MessageInfo>'
+    '<messageID>8af793f9af34bea0cf40f5fb5c630c</messageID>'
+    '<messageTimestamp>20041803161316316000+660</messageTimestamp>'
+    '<apiVersion>xml-4.2</apiVersion></MessageInfo>'
+    '<RequestType>Payment</RequestType>'
+    '<MerchantInfo><merchantID>ABC0001</merchantID></MerchantInfo>'
+    '<Status><statusCode>000</statusCode>'
+    '<statusDescription>Normal</statusDescription></Status>'
+    '<Payment><TxnList count="%(count)d">%(txns)s</TxnList></Payment>'
+    '</SecurePayMessage>')
+
+TXN_TEMPLATE = (
+    '<Txn ID="%(id)d"><txnType>0</txnType><txnSource>0</txnSource>'
+    '<amount>1000</amount><currency>AUD</currency>'
+    '<purchaseOrderNo>test</purchaseOrderNo><approved>Yes</approved>'
+    '<responseCode>00</responseCode><responseText>Approved</responseText>'
+    '<thinlinkResponseCode>100</thinlinkResponseCode>'
+    '<thinlinkResponseText>000</thinlinkResponseText>'
+    '<thinlinkEventStatusCode>000</thinlinkEventStatusCode>'
+    '<thinlinkEventStatusText>Normal</thinlinkEventStatusText>'
+    '<settlementDate>20040318</settlementDate><txnID>009844</txnID>'
+    '<CreditCardInfo><pan>444433...111</pan><expiryDate>08/04</expiryDate>'
+    '<cardType>6</cardType><cardDescription>Visa</cardDescription>'
+    '</CreditCardInfo></Txn>')
+
+def make_response(count=1):
+    """
+    Make an approved SecurePay response with `count` transactions in it
+    """
+    txns = ''.join(TXN_TEMPLATE % {'id': i} for i in range(1, count + 1))
+    return RESPONSE_TEMPLATE % {'count': count, 'txns': txns}
+
+
+class StubAdapter(BaseAdapter):
+    """
+    A transport adapter that approves every transaction instantly, without
+    touching the network
+    """
+    def send(self, request, **kwargs):
+        body = request.body
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+
+        response = Response()
+        response.status_code = 200
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        response._content = make_response(body.count(b'<Txn ')) \
+            .encode('utf-8')
+        return response
+
+    def close(self):
+        pass
+
+
+def make_transaction(txn_type='pay', **kwargs):
+    from securepay.models import Transaction
+    return Transaction(amount=Decimal('10.00'), txn_type=txn_type,
+        purchase_order_no='Transaction-1', card_name='Test', **kwargs)
+
+
+#: name: (needs the database, setup function returning the function to time)
+BENCHMARKS = {}
+
+def benchmark(name, database=False):
+    def decorator(setup):
+        BENCHMARKS[name] = (database, setup)
+        return setup
+    return decorator
+
+@benchmark('build.pay.element')
+def build_pay_element():
+    transaction = make_transaction()
+    return lambda: client.make_pay_request(merchant, transaction,
+        sample_credit_card_data)
+
+@benchmark('build.pay.encoded')
+def build_pay_encoded():
+    transaction = make_transaction()
+    return lambda: encoder.encode_pay_request(merchant, transaction,
+        sample_credit_card_data)
+
+@benchmark('build.direct_credit.element')
+def build_direct_credit_element():
+    transaction = make_transaction('credit')
+    return lambda: client.make_direct_credit_request(merchant, transaction,
+        sample_bank_account)
+
+@benchmark('build.direct_credit.encoded')
+def build_direct_credit_encoded():
+    transaction = make_transaction('credit')
+    return lambda: encoder.encode_direct_credit_request(merchant,
+        transaction, sample_bank_account)
+
+@benchmark('serialize.element')
+def serialize_element():
+    request = client.make_pay_request(merchant, make_transaction(),
+        sample_credit_card_data)
+    return lambda: ElementTree.tostring(request)
+
+@benchmark('parse.tree')
+def parse_tree():
+    response = make_response()
+    return lambda: ElementTree.fromstring(response)
+
+@benchmark('parse.stream')
+def parse_stream():
+    response = make_response()
+    return lambda: decoder.decode_response(response)
+
+@benchmark('log.redact')
+def log_redact():
+    request = client.make_pay_request(merchant, make_transaction(),
+        sample_credit_card_data)
+    return lambda: str(RedactedXML(request, censor=True))
+
+@benchmark('persist.send', database=True)
+def persist_send():
+    from securepay import models
+
+    def send():
+        transaction = make_transaction()
+        transaction.save()
+        models._send(transaction, encoder.encode_pay_request(merchant,
+            transaction, sample_credit_card_data))
+    return send
+
+@benchmark('end_to_end.pay', database=True)
+def end_to_end_pay():
+    from securepay.models import Transaction
+    return lambda: Transaction.objects.pay(Decimal('10.00'),
+        sample_credit_card_data)
+
+@benchmark('end_to_end.direct_credit_many', database=True)
+def end_to_end_direct_credit_many():
+    from securepay.models import Transaction
+    transfers = [(sample_bank_account, Decimal('10.00'))] * 10
+    return lambda: Transaction.objects.direct_credit_many(transfers)
+
+
+def time_function(func, repeat=5, min_time=0.2):
+    """
+    Time `func`, calling it enough times in each of `repeat` runs for the run
+    to take at least `min_time` seconds. Returns the time per call of each
+    run, in seconds.
+    """
+    loops = 1
+    while True:
+        start = time.time()
+        for i in range(loops):
+            func()
+        elapsed = time.time() - start
+        if elapsed >= min_time:
+            break
+        loops *= 10 if elapsed < min_time / 10 else 2
+
+    timings = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for i in range(repeat):
+            start = time.time()
+            for j in range(loops):
+                func()
+            timings.append((time.time() - start) / loops)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    return loops, timings
+
+def run(names=None, database=True, repeat=5, min_time=0.2):
+    """
+    Run the benchmarks whose names start with any of `names` (or all of
+    them), and return the results as a JSON serialisable dict
+    """
+    results = {}
+    client.set_transport_adapter(StubAdapter)
+    try:
+        for name in sorted(BENCHMARKS):
+            needs_database, setup = BENCHMARKS[name]
+            if names and not any(name.startswith(n) for n in names):
+                continue
+            if needs_database and not database:
+                continue
+
+            loops, timings = time_function(setup(), repeat, min_time)
+            timings.sort()
+            results[name] = {
+                'loops': loops,
+                'min': timings[0],
+                'median': timings[len(timings) // 2],
+                'mean': sum(timings) / len(timings),
+            }
+    finally:
+        client.set_transport_adapter(None)
+
+    return {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'time': time.time(),
+        'results': results,
+    }
+
+def compare(baseline, current, threshold=10.0):
+    """
+    Compare the median timings of two runs. Returns a list of
+    `(name, baseline, current, percent change, regressed)` tuples, where a
+    benchmark has regressed if it is more than `threshold` percent slower.
+    """
+    rows = []
+    for name in sorted(current['results']):
+        if name not in baseline['results']:
+            continue
+        old = baseline['results'][name]['median']
+        new = current['results'][name]['median']
+        change = (new - old) / old * 100 if old else 0.0
+        rows.append((name, old, new, change, change > threshold))
+    return rows
@@ -0,0 +1,102 @@
+"""
+A circuit breaker for calls to SecurePay.
+
+When SecurePay is down or timing out, every request would otherwise hold a
+worker for the whole timeout before failing. After
+`SECUREPAY_CIRCUIT_FAILURES` consecutive failures the circuit opens, and
+requests fail straight away with <CircuitOpen> for
+`SECUREPAY_CIRCUIT_RESET` seconds. After that one request is let through as
+a trial: if it succeeds the circuit closes again, and if it fails the circuit
+stays open for another `SECUREPAY_CIRCUIT_RESET` seconds.
+
+One breaker is kept per endpoint, and is shared by every thread in the
+process.
+"""
+import os
+import time
+import threading
+
+from django.conf import settings
+
+from securepay.exceptions import CircuitOpen
+
+#: Consecutive failures before the circuit opens. Set to 0 to disable.
+FAILURES = getattr(settings, 'SECUREPAY_CIRCUIT_FAILURES', 5)
+#: Seconds the circuit stays open before a trial request is allowed
+RESET = getattr(settings, 'SECUREPAY_CIRCUIT_RESET', 30)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker(object):
+    def __init__(self, name, failures=FAILURES, reset=RESET):
+        self.name = name
+        self.max_failures = failures
+        self.reset = reset
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+
+    def before_call(self):
+        """
+        Call before sending a request. Raises <CircuitOpen> if the request
+        should not be sent.
+        """
+        if not self.max_failures:
+            return
+
+        with self.lock:
+            if self.state == CLOSED:
+                return
+
+            retry_in = self.opened_at + self.reset - time.time()
+            if self.state == OPEN and retry_in <= 0:
+                # Let this one request through to see if things are better
+                self.state = HALF_OPEN
+                return
+
+        raise CircuitOpen(self.name, max(retry_in, 0))
+
+    def success(self):
+        with self.lock:
+            self.state = CLOSED
+            self.failures = 0
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (
+                    self.max_failures and self.failures >= self.max_failures):
+                self.state = OPEN
+                self.opened_at = time.time()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+_breakers_pid = os.getpid()
+
+def get_breaker(endpoint):
+    """
+    Get the shared <CircuitBreaker> for an endpoint
+    """
+    global _breakers_pid
+
+    with _breakers_lock:
+        if _breakers_pid != os.getpid():
+            _breakers.clear()
+            _breakers_pid = os.getpid()
+
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = _breakers[endpoint] = CircuitBreaker(endpoint)
+    return breaker
+
+def reset_breakers():
+    """
+    Close every circuit
+    """
+    with _breakers_lock:
+        _breakers.clear()
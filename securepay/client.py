@@ -1,22 +1,76 @@
-import sys
+import os
+import re
+import time
 import datetime
 import requests
+from requests.adapters import HTTPAdapter
+import threading
 import uuid
 import pytz
 import logging
+from collections import namedtuple
+from contextlib import contextmanager
 
 from xml.etree import ElementTree
 
 from django.conf import settings
+from django.utils.importlib import import_module
 
-from securepay.utils import remove_sensitive_info
+from securepay import circuit
+from securepay.utils import ELEMENT_CLASS, RedactedXML
 
 API_VERSION = 'xml-4.2'
 
+XML_DECLARATION = b'<?xml version="1.0" encoding="UTF-8"?>'
+
 LOCAL_TIMEZONE = pytz.timezone(settings.TIME_ZONE)
 
 logger = logging.getLogger(__name__)
 
+#: Number of endpoints to keep connection pools for, per session
+POOL_CONNECTIONS = getattr(settings, 'SECUREPAY_POOL_CONNECTIONS', 2)
+#: Maximum number of keep-alive connections held open per host
+POOL_MAXSIZE = getattr(settings, 'SECUREPAY_POOL_MAXSIZE', 10)
+#: Block, rather than opening extra throwaway connections, when the pool is
+#: exhausted
+POOL_BLOCK = getattr(settings, 'SECUREPAY_POOL_BLOCK', False)
+#: Seconds a pooled session may sit idle before it is discarded. SecurePay
+#: closes idle connections on its side, so reusing stale ones just costs a
+#: failed write and a reconnect.
+POOL_KEEPALIVE = getattr(settings, 'SECUREPAY_POOL_KEEPALIVE', 60)
+
+#: Dotted path to a transport adapter class to send requests through instead
+#: of the network. See <set_transport_adapter>.
+TRANSPORT_ADAPTER = getattr(settings, 'SECUREPAY_TRANSPORT_ADAPTER', None)
+
+#: SecurePay `<statusCode>`s that mean the gateway, rather than the request,
+#: failed: it could not reach the bank, timed out, hit a database or other
+#: system error, or is down for maintenance. These count towards opening the
+#: circuit breaker.
+GATEWAY_FAILURE_CODES = ['510', '511', '512', '513', '514', '515', '524',
+    '545']
+
+_STATUS_CODE = re.compile(r'<statusCode>\s*(\d+)\s*</statusCode>')
+
+#: Maximum number of `<Txn>` elements sent in a single `<TxnList>`
+MAX_BATCH_SIZE = getattr(settings, 'SECUREPAY_MAX_BATCH_SIZE', 100)
+
+#: Timeouts for a request, in seconds. `connect` and `read` are the socket
+#: timeouts used by `requests`, and `deadline` is sent to SecurePay as
+#: `<timeoutValue>`, the longest it should spend on the request. `read` should
+#: be a bit longer than `deadline`, so that SecurePay gets a chance to respond
+#: with its own timeout error.
+Timeout = namedtuple('Timeout', ['connect', 'read', 'deadline'])
+
+DEFAULT_TIMEOUT = Timeout(
+    connect=getattr(settings, 'SECUREPAY_CONNECT_TIMEOUT', 5),
+    read=getattr(settings, 'SECUREPAY_READ_TIMEOUT', 65),
+    deadline=getattr(settings, 'SECUREPAY_DEADLINE', 60))
+
+#: Overrides for <DEFAULT_TIMEOUT> per <Transaction.txn_type>, as dicts.
+#: For example, `{'refund': {'deadline': 120, 'read': 125}}`
+TIMEOUTS = getattr(settings, 'SECUREPAY_TIMEOUTS', {})
+
 #: Maps from <Payment.txn_type> values to SecurePay <txnType> numbers
 TYPE_MAP = {
     'pay': 0,
@@ -28,30 +82,203 @@ TYPE_MAP = {
     'debit': 17,
 }
 
-def send_request(endpoint, xml):
+_adapter_factory = None
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_sessions_pid = os.getpid()
+
+def get_timeout(txn_type=None):
     """
-    Send an XML request to SecurePay, and return the response
+    Get the <Timeout> for a type of transaction
     """
-    xml_string = "\n".join([
-        '<?xml version="1.0" encoding="UTF-8"?>',
-        ElementTree.tostring(xml),
-    ])
-    logger.info("Sending payment request %s", xml)
+    overrides = TIMEOUTS.get(txn_type)
+    if not overrides:
+        return DEFAULT_TIMEOUT
+    return DEFAULT_TIMEOUT._replace(**overrides)
+
+def get_session(endpoint, merchant=None):
+    """
+    Get the pooled, keep-alive <requests.Session> for an endpoint. One session
+    is kept per endpoint and merchant, and is shared between threads.
+    Sessions that have been idle for longer than `SECUREPAY_POOL_KEEPALIVE`
+    seconds are replaced, and all sessions are dropped when the process
+    forks, so that worker processes never share sockets with their parent.
+    Use <pooled_session> to send requests, so that a session is never
+    replaced while a request is using it.
+    """
+    with _sessions_lock:
+        entry = _session_entry(endpoint, merchant)
+        entry[1] = time.time()
+    return entry[0]
+
+@contextmanager
+def pooled_session(endpoint, merchant=None):
+    """
+    Use the pooled session for an endpoint, as <get_session>, for the length
+    of the block. The session is not replaced while the block runs, and it
+    counts as idle only from when the block finishes.
+    """
+    with _sessions_lock:
+        entry = _session_entry(endpoint, merchant)
+        entry[2] += 1
+    try:
+        yield entry[0]
+    finally:
+        with _sessions_lock:
+            entry[1] = time.time()
+            entry[2] -= 1
+
+def _session_entry(endpoint, merchant):
+    # Gets the [session, last used, requests in flight] for an endpoint,
+    # replacing idle sessions. Call with the lock held.
+    global _sessions_pid
+
+    if _sessions_pid != os.getpid():
+        _sessions.clear()
+        _sessions_pid = os.getpid()
+
+    key = (endpoint, merchant.name if merchant is not None else None)
+    now = time.time()
+    entry = _sessions.get(key)
+    if entry is not None and not entry[2] \
+            and now - entry[1] > POOL_KEEPALIVE:
+        entry[0].close()
+        entry = None
+
+    if entry is None:
+        entry = _sessions[key] = [make_session(
+            merchant.pool_maxsize if merchant is not None else None), now, 0]
+    return entry
+
+def make_session(pool_maxsize=None):
+    """
+    Make a new <requests.Session> with a connection pool sized according to
+    the `SECUREPAY_POOL_*` settings, or holding `pool_maxsize` connections
+    """
+    factory = _adapter_factory
+    if factory is None and TRANSPORT_ADAPTER:
+        module_name, class_name = TRANSPORT_ADAPTER.rsplit('.', 1)
+        factory = getattr(import_module(module_name), class_name)
+
+    session = requests.Session()
+    if factory is not None:
+        adapter = factory()
+    else:
+        adapter = HTTPAdapter(
+            pool_connections=POOL_CONNECTIONS,
+            pool_maxsize=pool_maxsize or POOL_MAXSIZE,
+            pool_block=POOL_BLOCK)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def set_transport_adapter(factory):
+    """
+    Make the transport adapters for new sessions by calling `factory()`,
+    instead of using a pooled <HTTPAdapter>. This is used to send requests
+    to a stub or simulated gateway. Pass `None` to go back to the real
+    gateway. Existing sessions are reset.
+
+    This can also be set with the `SECUREPAY_TRANSPORT_ADAPTER` setting, as
+    a dotted path to an adapter class.
+    """
+    global _adapter_factory
+
+    _adapter_factory = factory
+    reset_sessions()
 
+def reset_sessions():
+    """
+    Close and discard all pooled sessions. Sessions are reset automatically
+    after a fork, but this can be called from a `post_fork` hook as well.
+    """
+    with _sessions_lock:
+        for session, last_used, in_flight in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+def post_request(endpoint, xml, timeout=None, merchant=None):
+    """
+    Send an XML request to SecurePay, and return the raw response text
+    without parsing it. The request can either be an
+    <ElementTree.Element>, or a byte string as made by <securepay.encoder>.
+    See <post>.
+    """
+    return post(endpoint, xml, timeout, merchant).text
+
+def post(endpoint, xml, timeout=None, merchant=None):
+    """
+    Send an XML request to SecurePay, and return the <requests.Response>.
+    Its `elapsed` is the time from sending the request to getting the
+    response headers, without any time spent waiting for the rate limit or
+    logging.
+
+    `timeout` is a <Timeout>, defaulting to <DEFAULT_TIMEOUT>; its `deadline`
+    should match the `<timeoutValue>` in the request. Timeouts, connection
+    errors, server errors and the <GATEWAY_FAILURE_CODES> count towards
+    opening the endpoint's circuit breaker, and <CircuitOpen> is raised
+    without sending anything while it is open. See <securepay.circuit>.
+
+    If the request is for a <utils.Merchant>, it is sent through that
+    merchant's connection pool, and waits for its rate limit.
+    """
+    if timeout is None:
+        timeout = DEFAULT_TIMEOUT
+
+    if isinstance(xml, ELEMENT_CLASS):
+        body = ElementTree.tostring(xml)
+    else:
+        # Already serialised by <securepay.encoder>
+        body = xml
 
-    response = requests.post(endpoint, data=xml_string)
-    response_text = response.text
+    xml_string = b"\n".join([XML_DECLARATION, body])
+    logger.info("Sending payment request %s", RedactedXML(body))
+
+
+    if merchant is not None:
+        merchant.throttle()
+
+    breaker = circuit.get_breaker(endpoint)
+    breaker.before_call()
+    # Anything that goes wrong counts as a failure, so that a trial request
+    # always closes or reopens the circuit
+    failed = True
+    try:
+        with pooled_session(endpoint, merchant) as session:
+            response = session.post(endpoint, data=xml_string,
+                timeout=(timeout.connect, timeout.read))
+        response_text = response.text
+        status_code = _STATUS_CODE.search(response_text)
+        failed = response.status_code >= 500 or (status_code is not None
+            and status_code.group(1) in GATEWAY_FAILURE_CODES)
+    finally:
+        if failed:
+            breaker.failure()
+        else:
+            breaker.success()
+
+    logger.info("Got payment response %s", RedactedXML(response_text))
+
+    return response
+
+def send_request(endpoint, xml, timeout=None):
+    """
+    Send an XML request to SecurePay, and return the response text and the
+    parsed response. The parsed response is `None` if SecurePay sent back
+    something that was not XML.
+    """
+    response_text = post_request(endpoint, xml, timeout)
 
     response_xml = None
     try:
         response_xml = ElementTree.fromstring(response_text)
-        logger.info("Got payment response %s", response_xml)
     except SyntaxError:
-        logger.info("Got bad response from SecurePay: %s", response_text)
+        pass
 
     return (response_text, response_xml)
 
-def make_request(merchant, request_type, request_data=[]):
+def make_request(merchant, request_type, request_data=[], timeout=None):
     """
     Make a request XML document. This is called by the make_X_request functions.
     This wraps the request_data in a `<SecurePayMessage>` element, and makes
@@ -59,19 +286,20 @@ def make_request(merchant, request_type, request_data=[]):
 
     Parameters:
         merchant - The merchant credentials
-        request_type - 'Payment' or 'Echo', as appropriate
+        request_type - 'Payment', 'Echo' or 'Query', as appropriate
         request_data - A list of extra elements to append to the request data.
+        timeout - The <Timeout> whose `deadline` is sent as `<timeoutValue>`
 
     Returns:
     The root `<SecurePayMessage>` element for the whole request.
     """
-    valid_request_types = ['Payment', 'Echo']
+    valid_request_types = ['Payment', 'Echo', 'Query']
     if request_type not in valid_request_types:
         raise ValueError('Invalid request_type %s. Must be one of %s' % (
             request_type, ', '.join(valid_request_types)))
 
     children = [
-        make_message_info(),
+        make_message_info(timeout=timeout),
         make_merchant_info(merchant),
         make_element('RequestType', text=request_type),
     ]
@@ -81,18 +309,21 @@ def make_request(merchant, request_type, request_data=[]):
     return root
 
 
-def make_message_info(message_id=None):
+def make_message_info(message_id=None, timeout=None):
     """
-    Make a `<MessageInfo>` element for a request. Currently uses hardcoded
-    values for timeout and api version. A UUID v4 is used for the message ID.
+    Make a `<MessageInfo>` element for a request. The `<timeoutValue>` is the
+    `deadline` of `timeout`, or of <DEFAULT_TIMEOUT>. A UUID v4 is used for
+    the message ID.
     """
     if message_id is None:
         message_id = uuid.uuid4()
+    if timeout is None:
+        timeout = DEFAULT_TIMEOUT
 
     message_info = make_element('MessageInfo', children=[
         make_element('messageID', text=message_id),
         make_element('messageTimestamp', text=make_message_timestamp()),
-        make_element('timeoutValue', text='60'),
+        make_element('timeoutValue', text=int(timeout.deadline)),
         make_element('apiVersion', text=API_VERSION),
     ])
     return message_info
@@ -154,13 +385,13 @@ def make_direct_entry_info(bank_account):
 
     return direct_entry_info
 
-def make_basic_txn(transaction):
+def make_basic_txn(transaction, txn_id=1):
     """
     Make a `<Txn>` element with the required elements. `<txnType>` is taken
     from <Transaction.txn_type>, and is what ultimately decides what type of
     transaction this is
     """
-    txn = make_element('Txn', attrib={'ID': '1'}, children=[
+    txn = make_element('Txn', attrib={'ID': str(txn_id)}, children=[
         make_element('txnType', text=TYPE_MAP[transaction.txn_type]),
         make_element('txnSource', text='0'), # Hardcoded to 0, as per docs
         make_element('amount', text=int(transaction.amount * 100)),
@@ -174,7 +405,20 @@ def wrap_txn(txn):
     Wrap a `<Txn>` element in a suitable `<Payment><TxnList>` wrapper,
     and return it
     """
-    txn_list = make_element('TxnList', attrib={'count': '1'}, children=[txn])
+    return wrap_txns([txn])
+
+def wrap_txns(txns):
+    """
+    Wrap a list of `<Txn>` elements in a `<Payment><TxnList>` wrapper, and
+    return it. The `ID` attribute of each `<Txn>` is renumbered sequentially,
+    starting from 1, so that responses can be matched back up to their
+    requests.
+    """
+    for txn_id, txn in enumerate(txns, 1):
+        txn.set('ID', str(txn_id))
+
+    txn_list = make_element('TxnList', attrib={'count': str(len(txns))},
+        children=txns)
     payment = make_element('Payment', children=[txn_list])
     return payment
 
@@ -190,36 +434,111 @@ def make_element(name, text='', attrib={}, children=[]):
 
 
     
-def _make_payment_request(merchant, transaction, credit_card):
+def _make_payment_txn(transaction, credit_card, txn_id=1):
     """
-    Make an XML request for payment using a credit card
+    Make a `<Txn>` for a payment using a credit card
     """
-    txn = make_basic_txn(transaction)
+    txn = make_basic_txn(transaction, txn_id)
     txn.append(make_credit_card_info(credit_card))
-    return make_request(merchant, 'Payment', [wrap_txn(txn)])
+    return txn
 
-def _make_referenced_transaction_request(merchant, transaction):
+def _make_referenced_transaction_txn(transaction, txn_id=1):
     """
-    Make an XML request that references another request
+    Make a `<Txn>` that references another transaction
     """
-    txn = make_basic_txn(transaction)
+    txn = make_basic_txn(transaction, txn_id)
 
     if transaction.txn_type == 'complete':
         txn.append(make_element('preauthID', text=transaction.reference_transaction.preauth_id))
     else:
         txn.append(make_element('txnID', text=transaction.reference_transaction.txn_id))
 
-    return make_request(merchant, 'Payment', [wrap_txn(txn)])
+    return txn
+
+def _make_direct_transfer_txn(transaction, bank_account, txn_id=1):
+    """
+    Make a `<Txn>` for a direct transfer
+    """
+    txn = make_basic_txn(transaction, txn_id)
+    txn.append(make_direct_entry_info(bank_account))
+    return txn
+
+def _make_payment_request(merchant, transaction, credit_card):
+    """
+    Make an XML request for payment using a credit card
+    """
+    txn = _make_payment_txn(transaction, credit_card)
+    return make_request(merchant, 'Payment', [wrap_txn(txn)],
+        get_timeout(transaction.txn_type))
+
+def _make_referenced_transaction_request(merchant, transaction):
+    """
+    Make an XML request that references another request
+    """
+    txn = _make_referenced_transaction_txn(transaction)
+    return make_request(merchant, 'Payment', [wrap_txn(txn)],
+        get_timeout(transaction.txn_type))
 
 def _make_direct_transfer_request(merchant, transaction, bank_account):
     """
     Make a direct transfer request
     """
-    txn = make_basic_txn(transaction)
-    txn.append(make_direct_entry_info(bank_account))
-    return make_request(merchant, 'Payment', [wrap_txn(txn)])
+    txn = _make_direct_transfer_txn(transaction, bank_account)
+    return make_request(merchant, 'Payment', [wrap_txn(txn)],
+        get_timeout(transaction.txn_type))
+
+def make_batch_request(merchant, txns, timeout=None):
+    """
+    Make a single XML request containing many `<Txn>` elements, as made by
+    the make_X_txn functions. All the transactions must be sent to the same
+    endpoint. At most `MAX_BATCH_SIZE` transactions can be sent at once.
+    """
+    if not txns:
+        raise ValueError('A batch must contain at least one transaction')
+    if len(txns) > MAX_BATCH_SIZE:
+        raise ValueError('A batch can contain at most %d transactions, got %d'
+            % (MAX_BATCH_SIZE, len(txns)))
+
+    return make_request(merchant, 'Payment', [wrap_txns(list(txns))],
+        timeout)
+
+def make_query_txn(transaction, txn_id=1):
+    """
+    Make a `<Txn>` asking for the outcome of an earlier transaction. It
+    identifies the transaction the same way the original request did, by its
+    type, amount, purchase order number and any referenced transaction, but
+    carries no card or bank account details.
+    """
+    if transaction.reference_transaction_id is not None:
+        return _make_referenced_transaction_txn(transaction, txn_id)
+    return make_basic_txn(transaction, txn_id)
+
+def make_query_request(merchant, transactions):
+    """
+    Make a `Query` request for the outcome of some transactions, for example
+    those left in flight by a process that died. The response has the same
+    shape as a `Payment` response, and transactions that were never received
+    come back with no `<responseCode>`.
+
+    `Query` is not part of SecurePay's XML API. Only <securepay.simulator>
+    answers it; see `SECUREPAY_RECONCILE_QUERY`.
+    """
+    return make_request(merchant, 'Query',
+        [wrap_txns([make_query_txn(transaction)
+            for transaction in transactions])],
+        get_timeout('query'))
 
 # Alias these functions, as they all act the same
+make_preauth_txn = _make_payment_txn
+make_pay_txn = _make_payment_txn
+
+make_void_txn = _make_referenced_transaction_txn
+make_refund_txn = _make_referenced_transaction_txn
+make_complete_txn = _make_referenced_transaction_txn
+
+make_direct_credit_txn = _make_direct_transfer_txn
+make_direct_debit_txn = _make_direct_transfer_txn
+
 make_preauth_request = _make_payment_request
 make_pay_request = _make_payment_request
 
@@ -0,0 +1,113 @@
+"""
+Fast decoding of SecurePay responses.
+
+Only a handful of fields are needed from each response, so rather than
+building a full tree, the response is pull-parsed and the parse stops as soon
+as the `<TxnList>` has been read. Responses that do not have the expected
+shape are decoded from a full tree instead.
+"""
+import io
+from collections import namedtuple
+from xml.etree import ElementTree
+
+from securepay.exceptions import ResponseError
+
+#: The result of a single `<Txn>` in a response
+TxnResult = namedtuple('TxnResult', ['id', 'approved', 'response_code',
+    'response_text', 'txn_id', 'preauth_id', 'purchase_order_no'])
+# Not every response echoes the purchase order number
+TxnResult.__new__.__defaults__ = (None,)
+
+#: A whole decoded response. `txns` is a list of <TxnResult>s
+Response = namedtuple('Response', ['status_code', 'status_description',
+    'txns'])
+
+#: Maps from `<Txn>` child elements to <TxnResult> fields
+TXN_FIELDS = {
+    'approved': 'approved',
+    'responseCode': 'response_code',
+    'responseText': 'response_text',
+    'txnID': 'txn_id',
+    'preauthID': 'preauth_id',
+    'purchaseOrderNo': 'purchase_order_no',
+}
+
+#: Maps from `<Status>` child elements to <Response> fields
+STATUS_FIELDS = {
+    'statusCode': 'status_code',
+    'statusDescription': 'status_description',
+}
+
+class UnknownShape(Exception):
+    pass
+
+def decode_response(response_text):
+    """
+    Decode a SecurePay response. Raises <ResponseError> if the response is
+    not well formed XML.
+    """
+    if not isinstance(response_text, bytes):
+        response_text = response_text.encode('utf-8')
+
+    try:
+        try:
+            return _decode_stream(response_text)
+        except UnknownShape:
+            return _decode_tree(ElementTree.fromstring(response_text))
+    except SyntaxError as e:
+        # <ElementTree.ParseError> is a subclass of <SyntaxError>
+        raise ResponseError('Could not parse response from SecurePay: %s' % e,
+            response_text)
+
+def _decode_stream(response_text):
+    status = dict.fromkeys(STATUS_FIELDS.values())
+    txns = []
+    txn = None
+    path = []
+
+    events = ElementTree.iterparse(io.BytesIO(response_text),
+        events=('start', 'end'))
+    for event, element in events:
+        if event == 'start':
+            path.append(element.tag)
+            if path == ['SecurePayMessage', 'Payment', 'TxnList', 'Txn']:
+                txn = dict.fromkeys(TXN_FIELDS.values())
+                txn['id'] = element.get('ID')
+            elif len(path) == 1 and element.tag != 'SecurePayMessage':
+                raise UnknownShape()
+            continue
+
+        path.pop()
+        depth = len(path)
+
+        if txn is not None and depth == 4 and element.tag in TXN_FIELDS:
+            txn[TXN_FIELDS[element.tag]] = element.text
+        elif depth == 3 and element.tag == 'Txn':
+            if txn['approved'] is None:
+                raise UnknownShape()
+            txns.append(TxnResult(**txn))
+            txn = None
+            element.clear()
+        elif depth == 2 and path[1] == 'Status' \
+                and element.tag in STATUS_FIELDS:
+            status[STATUS_FIELDS[element.tag]] = element.text
+        elif depth == 2 and element.tag == 'TxnList':
+            # Nothing of interest comes after the <TxnList>
+            break
+
+    return Response(txns=txns, **status)
+
+def _decode_tree(root):
+    txns = []
+    for element in root.iter('Txn'):
+        txn = dict((field, element.findtext(tag))
+            for tag, field in TXN_FIELDS.items())
+        txns.append(TxnResult(id=element.get('ID'), **txn))
+
+    status = root.find('.//Status')
+    return Response(
+        status_code=status.findtext('statusCode') if status is not None
+            else None,
+        status_description=status.findtext('statusDescription')
+            if status is not None else None,
+        txns=txns)
@@ -0,0 +1,198 @@
+"""
+Non-blocking dispatch of transactions.
+
+    handle = Transaction.objects.dispatched().pay(amount, credit_card)
+
+persists the transaction straight away, but sends it to SecurePay on a
+bounded thread pool rather than in the calling thread, and returns a
+<Handle>. The caller can poll the handle, wait on it, or pass a `callback`
+that is run in the worker once the transaction has completed.
+
+At most `SECUREPAY_DISPATCH_WORKERS` transactions are sent at once, and at
+most `SECUREPAY_DISPATCH_QUEUE` more wait for a worker. When the queue is
+full, dispatching waits up to `SECUREPAY_DISPATCH_WAIT` seconds for room and
+then raises <PoolSaturated>, before anything is saved.
+
+The worker must be able to see the saved transaction, so do not dispatch from
+inside a database transaction that has not been committed.
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection
+
+from securepay.exceptions import PoolSaturated
+
+logger = logging.getLogger(__name__)
+
+#: Transactions sent at once
+WORKERS = getattr(settings, 'SECUREPAY_DISPATCH_WORKERS', 10)
+#: Transactions waiting for a worker before dispatching has to wait
+QUEUE = getattr(settings, 'SECUREPAY_DISPATCH_QUEUE', 100)
+#: Seconds to wait for room in the queue before giving up
+WAIT = getattr(settings, 'SECUREPAY_DISPATCH_WAIT', 0)
+
+#: <TransactionManager> methods that can be dispatched
+DISPATCHABLE = ['pay', 'reversal', 'refund', 'preauth', 'complete',
+    'direct_credit', 'direct_debit']
+
+_local = threading.local()
+
+
+class Slots(object):
+    """
+    A counter of free places in the pool. Unlike a semaphore, acquiring can
+    time out on Python 2 as well.
+    """
+    def __init__(self, size):
+        self.free = size
+        self.condition = threading.Condition()
+
+    def acquire(self, wait):
+        with self.condition:
+            if self.free <= 0 and wait:
+                self.condition.wait(wait)
+            if self.free <= 0:
+                return False
+            self.free -= 1
+            return True
+
+    def release(self):
+        with self.condition:
+            self.free += 1
+            self.condition.notify()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """
+    Get the `(executor, slots)` pair transactions are dispatched on, creating
+    it if needed
+    """
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _pool = (ThreadPoolExecutor(max_workers=WORKERS),
+                Slots(WORKERS + QUEUE))
+    return _pool
+
+
+class Handle(object):
+    """
+    A dispatched transaction. `transaction` is updated in place by the worker
+    once SecurePay has responded.
+    """
+    def __init__(self, transaction, future):
+        self.transaction = transaction
+        self.future = future
+
+    def done(self):
+        return self.future.done()
+
+    def status(self):
+        """
+        Get the current `(status, success)` of the transaction from the
+        database
+        """
+        return self.transaction.__class__._default_manager \
+            .filter(pk=self.transaction.pk) \
+            .values_list('status', 'success')[0]
+
+    def result(self, timeout=None):
+        """
+        Wait for the transaction to complete, and return it. Raises whatever
+        sending the transaction raised.
+        """
+        self.future.result(timeout)
+        return self.transaction
+
+    def add_done_callback(self, func):
+        """
+        Call `func(handle)` once the transaction is done, in the worker
+        """
+        self.future.add_done_callback(lambda future: func(self))
+
+
+class Dispatcher(object):
+    """
+    Wraps a <TransactionManager> so that its methods dispatch, and return a
+    <Handle> instead of the completed transaction. Made by
+    <TransactionManager.dispatched>.
+    """
+    def __init__(self, manager, callback=None, wait=WAIT):
+        self.manager = manager
+        self.callback = callback
+        self.wait = wait
+
+    def __getattr__(self, name):
+        if name not in DISPATCHABLE:
+            raise AttributeError(name)
+        method = getattr(self.manager, name)
+
+        def dispatch(*args, **kwargs):
+            executor, slots = get_pool()
+            if not slots.acquire(self.wait):
+                raise PoolSaturated(WORKERS + QUEUE)
+
+            _local.dispatch = (executor, slots, self.callback)
+            try:
+                method(*args, **kwargs)
+                handle = _local.handle
+            except Exception:
+                if getattr(_local, 'handle', None) is None:
+                    slots.release()
+                raise
+            finally:
+                _local.dispatch = None
+                _local.handle = None
+            return handle
+
+        dispatch.__name__ = name
+        return dispatch
+
+
+def active():
+    """
+    If the current call should be dispatched rather than sent
+    """
+    return getattr(_local, 'dispatch', None) is not None
+
+def submit(transaction, send, *args):
+    """
+    Run `send(*args)` on the pool for `transaction`, in place of sending it
+    now. Only called when <active>.
+    """
+    executor, slots, callback = _local.dispatch
+
+    def run():
+        try:
+            send(*args)
+            if callback is not None:
+                _run_callback(callback, transaction)
+        finally:
+            slots.release()
+            connection.close()
+
+    _local.handle = Handle(transaction, executor.submit(run))
+    return _local.handle
+
+def _run_callback(callback, transaction):
+    """
+    Call `callback(transaction)`. If it returns `True` or `False`, that is
+    saved as <Transaction.processed>.
+    """
+    try:
+        processed = callback(transaction)
+    except Exception:
+        logger.exception("Callback for transaction %s failed", transaction.pk)
+        return
+
+    if processed is not None:
+        transaction.processed = processed
+        transaction.__class__._default_manager \
+            .filter(pk=transaction.pk).update(processed=processed)
@@ -0,0 +1,248 @@
+"""
+Fast serialisation of SecurePay requests straight to bytes.
+
+The structure of every request is fixed, so rather than building a tree of
+<ElementTree.Element>s and serialising it, the static parts of each request
+are compiled to byte strings once, and only the variable field values are
+escaped and spliced in. The output is byte-for-byte identical to
+`ElementTree.tostring` on the equivalent request from <securepay.client>,
+which remains the reference implementation.
+"""
+import uuid
+
+from securepay import client
+
+try:
+    text_type = unicode
+except NameError:
+    text_type = str
+
+def escape(value):
+    """
+    Escape a field value for use as element text, and encode it as ASCII in
+    the same way as `ElementTree.tostring`
+    """
+    if not isinstance(value, text_type):
+        value = str(value)
+
+    value = value.replace('&', '&amp;').replace('<', '&lt;') \
+        .replace('>', '&gt;')
+
+    if isinstance(value, bytes):
+        return value
+    return value.encode('ascii', 'xmlcharrefreplace')
+
+def compile_leaf(tag):
+    """
+    Compile the opening, closing and empty forms of a leaf element
+    """
+    return (
+        ('<%s>' % tag).encode('ascii'),
+        ('</%s>' % tag).encode('ascii'),
+        ('<%s />' % tag).encode('ascii'),
+    )
+
+_LEAVES = dict((tag, compile_leaf(tag)) for tag in [
+    'messageID', 'messageTimestamp', 'merchantID', 'password', 'RequestType',
+    'txnType', 'amount', 'purchaseOrderNo', 'cardNumber', 'cvv',
+    'expiryDate', 'bsbNumber', 'accountNumber', 'accountName', 'preauthID',
+    'txnID', 'timeoutValue',
+])
+
+def leaf(tag, value):
+    """
+    Encode a `<tag>value</tag>` element
+    """
+    open_tag, close_tag, empty_tag = _LEAVES[tag]
+    text = escape(value)
+    if not text:
+        return empty_tag
+    return open_tag + text + close_tag
+
+
+MESSAGE_INFO_START = b'<SecurePayMessage><MessageInfo>'
+MESSAGE_INFO_END = (
+    '<apiVersion>%s</apiVersion></MessageInfo>' % client.API_VERSION
+    ).encode('ascii')
+MESSAGE_END = b'</SecurePayMessage>'
+
+TXN_LIST_END = b'</TxnList></Payment>'
+TXN_SOURCE = b'<txnSource>0</txnSource>'
+TXN_END = b'</Txn>'
+
+_merchant_info_cache = {}
+
+def encode_merchant_info(merchant):
+    """
+    Encode the `<MerchantInfo>` element for a merchant. This never changes
+    for a given merchant, so it is only encoded once.
+    """
+    key = (merchant['merchant_id'], merchant['password'])
+    merchant_info = _merchant_info_cache.get(key)
+    if merchant_info is None:
+        merchant_info = b''.join([
+            b'<MerchantInfo>',
+            leaf('merchantID', merchant['merchant_id']),
+            leaf('password', merchant['password']),
+            b'</MerchantInfo>',
+        ])
+        _merchant_info_cache[key] = merchant_info
+    return merchant_info
+
+def encode_request(merchant, request_type, request_data=[], message_id=None,
+    timestamp=None, timeout=None):
+    """
+    Encode a whole `<SecurePayMessage>`. See <securepay.client.make_request>.
+    `request_data` is a list of already encoded byte strings.
+    """
+    if timeout is None:
+        timeout = client.DEFAULT_TIMEOUT
+    if message_id is None:
+        message_id = uuid.uuid4()
+    if timestamp is None:
+        timestamp = client.make_message_timestamp()
+
+    buf = [
+        MESSAGE_INFO_START,
+        leaf('messageID', message_id),
+        leaf('messageTimestamp', timestamp),
+        leaf('timeoutValue', int(timeout.deadline)),
+        MESSAGE_INFO_END,
+        encode_merchant_info(merchant),
+        leaf('RequestType', request_type),
+    ]
+    buf.extend(request_data)
+    buf.append(MESSAGE_END)
+    return b''.join(buf)
+
+def encode_txns(txns):
+    """
+    Wrap a list of encoded `<Txn>` elements in a `<Payment><TxnList>`
+    """
+    buf = [('<Payment><TxnList count="%d">' % len(txns)).encode('ascii')]
+    buf.extend(txns)
+    buf.append(TXN_LIST_END)
+    return b''.join(buf)
+
+def _basic_txn(buf, transaction, txn_id):
+    buf.extend([
+        ('<Txn ID="%d">' % txn_id).encode('ascii'),
+        leaf('txnType', client.TYPE_MAP[transaction.txn_type]),
+        TXN_SOURCE,
+        leaf('amount', int(transaction.amount * 100)),
+        leaf('purchaseOrderNo', transaction.purchase_order_no),
+    ])
+
+def _encode_payment_txn(transaction, credit_card, txn_id=1):
+    buf = []
+    _basic_txn(buf, transaction, txn_id)
+    buf.extend([
+        b'<CreditCardInfo>',
+        leaf('cardNumber', credit_card['number']),
+        leaf('cvv', '%03d' % credit_card['cvv']),
+        leaf('expiryDate', '%02d/%02d' % (
+            credit_card['expiry'][0], credit_card['expiry'][1])),
+        b'</CreditCardInfo>',
+        TXN_END,
+    ])
+    return b''.join(buf)
+
+def _encode_referenced_transaction_txn(transaction, txn_id=1):
+    buf = []
+    _basic_txn(buf, transaction, txn_id)
+    if transaction.txn_type == 'complete':
+        buf.append(leaf('preauthID',
+            transaction.reference_transaction.preauth_id))
+    else:
+        buf.append(leaf('txnID', transaction.reference_transaction.txn_id))
+    buf.append(TXN_END)
+    return b''.join(buf)
+
+def _encode_direct_transfer_txn(transaction, bank_account, txn_id=1):
+    buf = []
+    _basic_txn(buf, transaction, txn_id)
+    buf.extend([
+        b'<DirectEntryInfo>',
+        leaf('bsbNumber', bank_account['bsb']),
+        leaf('accountNumber', bank_account['account_number']),
+        leaf('accountName', bank_account['name']),
+        b'</DirectEntryInfo>',
+        TXN_END,
+    ])
+    return b''.join(buf)
+
+def _with_timeout(transaction, kwargs):
+    kwargs.setdefault('timeout', client.get_timeout(transaction.txn_type))
+    return kwargs
+
+def _encode_payment_request(merchant, transaction, credit_card, **kwargs):
+    txn = _encode_payment_txn(transaction, credit_card)
+    return encode_request(merchant, 'Payment', [encode_txns([txn])],
+        **_with_timeout(transaction, kwargs))
+
+def _encode_referenced_transaction_request(merchant, transaction, **kwargs):
+    txn = _encode_referenced_transaction_txn(transaction)
+    return encode_request(merchant, 'Payment', [encode_txns([txn])],
+        **_with_timeout(transaction, kwargs))
+
+def _encode_direct_transfer_request(merchant, transaction, bank_account,
+    **kwargs):
+    txn = _encode_direct_transfer_txn(transaction, bank_account)
+    return encode_request(merchant, 'Payment', [encode_txns([txn])],
+        **_with_timeout(transaction, kwargs))
+
+def encode_batch_request(merchant, txns, **kwargs):
+    """
+    Encode a request containing many encoded `<Txn>` elements. See
+    <securepay.client.make_batch_request>. The `<Txn>` elements must already
+    be numbered sequentially from 1.
+    """
+    if not txns:
+        raise ValueError('A batch must contain at least one transaction')
+    if len(txns) > client.MAX_BATCH_SIZE:
+        raise ValueError('A batch can contain at most %d transactions, got %d'
+            % (client.MAX_BATCH_SIZE, len(txns)))
+
+    return encode_request(merchant, 'Payment', [encode_txns(list(txns))],
+        **kwargs)
+
+def encode_query_txn(transaction, txn_id=1):
+    """
+    Encode a `<Txn>` for a `Query`. See <securepay.client.make_query_txn>.
+    """
+    if transaction.reference_transaction_id is not None:
+        return _encode_referenced_transaction_txn(transaction, txn_id)
+    buf = []
+    _basic_txn(buf, transaction, txn_id)
+    buf.append(TXN_END)
+    return b''.join(buf)
+
+def encode_query_request(merchant, transactions, **kwargs):
+    """
+    Encode a `Query` request. See <securepay.client.make_query_request>.
+    """
+    txns = [encode_query_txn(transaction, txn_id)
+        for txn_id, transaction in enumerate(transactions, 1)]
+    kwargs.setdefault('timeout', client.get_timeout('query'))
+    return encode_request(merchant, 'Query', [encode_txns(txns)], **kwargs)
+
+# Alias these functions, as they all act the same
+encode_preauth_txn = _encode_payment_txn
+encode_pay_txn = _encode_payment_txn
+
+encode_void_txn = _encode_referenced_transaction_txn
+encode_refund_txn = _encode_referenced_transaction_txn
+encode_complete_txn = _encode_referenced_transaction_txn
+
+encode_direct_credit_txn = _encode_direct_transfer_txn
+encode_direct_debit_txn = _encode_direct_transfer_txn
+
+encode_preauth_request = _encode_payment_request
+encode_pay_request = _encode_payment_request
+
+encode_void_request = _encode_referenced_transaction_request
+encode_refund_request = _encode_referenced_transaction_request
+encode_complete_request = _encode_referenced_transaction_request
+
+encode_direct_credit_request = _encode_direct_transfer_request
+encode_direct_debit_request = _encode_direct_transfer_request
@@ -0,0 +1,53 @@
+class SecurePayError(Exception):
+    """
+    Base class for all errors raised while talking to SecurePay
+    """
+
+
+class ResponseError(SecurePayError):
+    """
+    SecurePay sent back a response that could not be understood. The
+    transaction may or may not have gone through.
+    """
+    def __init__(self, message, response_text=None):
+        super(ResponseError, self).__init__(message)
+        self.response_text = response_text
+
+
+class StatusConflict(SecurePayError):
+    """
+    A transaction was not in the status it was expected to be in, most likely
+    because something else is processing it at the same time.
+    """
+
+
+class CircuitOpen(SecurePayError):
+    """
+    SecurePay has been failing, so the request was not sent at all. See
+    <securepay.circuit>. `retry_in` is roughly how many seconds until a
+    request will be tried again.
+    """
+    def __init__(self, endpoint, retry_in):
+        super(CircuitOpen, self).__init__(
+            'SecurePay circuit for %s is open, retry in %ds' % (
+                endpoint, retry_in))
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+class PoolSaturated(SecurePayError):
+    """
+    Too many transactions are already waiting to be sent, so this one was not
+    dispatched. See <securepay.dispatch>.
+    """
+    def __init__(self, size):
+        super(PoolSaturated, self).__init__(
+            'All %d places in the SecurePay dispatch pool are taken' % size)
+        self.size = size
+
+
+class UnknownMerchant(SecurePayError):
+    """
+    No merchant is registered with the given name. See
+    <securepay.merchants>.
+    """
@@ -0,0 +1,139 @@
+"""
+Streaming exports of transactions, as CSV or JSON lines.
+
+Rows are read in chunks of `SECUREPAY_EXPORT_CHUNK_SIZE`, in primary key
+order using `WHERE id > <last id>` rather than `OFFSET`, and only the chosen
+columns are selected. No model instances are built, and memory use stays the
+same no matter how many rows are exported. Leave `response_text` and
+`extra_data` out of the columns unless they are needed, as they are big.
+
+Exports are available as the "Export" actions on the transaction admin, the
+`securepay_export` management command, and, for staff users, the
+<securepay.views.export_transactions> view included by `securepay.urls`. Any
+queryset of <Transaction>s or <ArchivedTransaction>s can be exported with
+<export> or <export_response>.
+"""
+import csv
+import json
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.http import HttpResponse
+
+from securepay.fields import JSONField
+
+#: Columns exported when none are chosen
+COLUMNS = getattr(settings, 'SECUREPAY_EXPORT_COLUMNS', [
+    'id', 'created', 'merchant', 'purchase_order_no', 'txn_type', 'amount',
+    'status', 'success', 'response_code', 'bank_message', 'txn_id',
+    'preauth_id', 'reference_transaction_id'])
+
+#: Rows read from the database at a time
+CHUNK_SIZE = getattr(settings, 'SECUREPAY_EXPORT_CHUNK_SIZE', 2000)
+
+#: Content types for each export format
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+
+def rows(queryset, columns=None, chunk_size=CHUNK_SIZE):
+    """
+    Iterate over the `columns` of every row in `queryset`, as tuples, in
+    primary key order. Columns are field names, and foreign keys can be given
+    as either `reference_transaction` or `reference_transaction_id`.
+    """
+    columns = columns or COLUMNS
+    fields = _fields(queryset.model, columns)
+    names = [field.name for field in fields]
+    json_columns = [i for i, field in enumerate(fields)
+        if isinstance(field, JSONField)]
+    # Some databases hand back decimals as stored, e.g. 1 rather than 1.00
+    decimal_columns = [(i, Decimal(10) ** -field.decimal_places)
+        for i, field in enumerate(fields)
+        if isinstance(field, models.DecimalField)]
+
+    queryset = queryset.order_by('pk')
+    last = None
+    while True:
+        chunk = queryset if last is None else queryset.filter(pk__gt=last)
+        chunk = list(chunk.values_list('pk', *names)[:chunk_size])
+        if not chunk:
+            break
+        last = chunk[-1][0]
+
+        for row in chunk:
+            row = list(row[1:])
+            for i in json_columns:
+                row[i] = fields[i].to_python(row[i])
+            for i, places in decimal_columns:
+                if row[i] is not None:
+                    row[i] = Decimal(row[i]).quantize(places)
+            yield tuple(row)
+
+def export(queryset, format='csv', columns=None, chunk_size=CHUNK_SIZE):
+    """
+    Export `queryset` as `csv` or `jsonl`, as an iterator of UTF-8 encoded
+    lines. CSV exports start with a header line of the column names.
+    """
+    if format not in CONTENT_TYPES:
+        raise ValueError('Export format must be one of %s, not %s' % (
+            ', '.join(sorted(CONTENT_TYPES)), format))
+    columns = columns or COLUMNS
+    # Check the columns now, rather than once the export has started
+    _fields(queryset.model, columns)
+    lines = _csv_lines if format == 'csv' else _jsonl_lines
+    return lines(columns, rows(queryset, columns, chunk_size))
+
+def export_response(queryset, format='csv', columns=None, filename=None):
+    """
+    Get an <HttpResponse> that streams an <export> of `queryset` as an
+    attachment. The response must not pass through middleware that reads the
+    whole content, such as `GZipMiddleware` or `ConditionalGetMiddleware`,
+    or it will no longer stream.
+    """
+    response = HttpResponse(export(queryset, format, columns),
+        content_type=CONTENT_TYPES.get(format))
+    response['Content-Disposition'] = 'attachment; filename=%s.%s' % (
+        filename or queryset.model._meta.module_name, format)
+    return response
+
+def _fields(model, columns):
+    fields = {}
+    for field in model._meta.fields:
+        fields[field.name] = fields[field.attname] = field
+
+    unknown = [column for column in columns if column not in fields]
+    if unknown:
+        raise ValueError('Unknown export columns for %s: %s' % (
+            model.__name__, ', '.join(unknown)))
+    return [fields[column] for column in columns]
+
+class _Line(object):
+    # Lets a csv writer hand back each line rather than writing it anywhere
+    def write(self, line):
+        return line
+
+def _csv_lines(columns, rows):
+    writer = csv.writer(_Line())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow([_csv_value(value) for value in row])
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, cls=DjangoJSONEncoder, sort_keys=True)
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+def _jsonl_lines(columns, rows):
+    for row in rows:
+        yield json.dumps(OrderedDict(zip(columns, row)),
+            cls=DjangoJSONEncoder) + '\n'
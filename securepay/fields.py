@@ -0,0 +1,86 @@
+import json
+import threading
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.db.models import signals
+
+_loading = threading.local()
+
+
+class JSONField(models.TextField):
+    """
+    Store any JSON serialisable value as JSON text. Dates, times and decimals
+    are stored as strings, and come back as strings.
+
+    Only the text a model is loaded with from the database is decoded. A
+    value assigned to the field is kept as it is, so assigning the string
+    `'123'` does not turn it in to the number `123`.
+    """
+    description = "JSON encoded data"
+
+    def contribute_to_class(self, cls, name):
+        super(JSONField, self).contribute_to_class(cls, name)
+        setattr(cls, self.name, JSONDescriptor(self))
+
+    def to_python(self, value):
+        """
+        Decode JSON text from the database
+        """
+        if not isinstance(value, basestring):
+            return value
+        if value == '':
+            return None
+
+        try:
+            return json.loads(value)
+        except ValueError:
+            # Saved by something other than this field
+            return value
+
+    def get_prep_value(self, value):
+        if value is None:
+            return None
+        return json.dumps(value, cls=DjangoJSONEncoder, sort_keys=True)
+
+    def value_to_string(self, obj):
+        return self.get_prep_value(self._get_val_from_obj(obj))
+
+
+class JSONDescriptor(object):
+    """
+    Decodes the value of a <JSONField> while a model is being loaded from the
+    database, and leaves values assigned any other way alone
+    """
+    def __init__(self, field):
+        self.field = field
+
+    def __get__(self, obj, type=None):
+        if obj is None:
+            return self
+        return obj.__dict__[self.field.name]
+
+    def __set__(self, obj, value):
+        if getattr(_loading, 'value', False):
+            value = self.field.to_python(value)
+        obj.__dict__[self.field.name] = value
+
+
+def _pre_init(sender, args, kwargs, **extra):
+    # Django only makes models with positional arguments, or makes deferred
+    # models, when loading them from the database
+    _loading.value = bool(args) or getattr(sender, '_deferred', False)
+
+def _post_init(sender, instance, **kwargs):
+    _loading.value = False
+
+signals.pre_init.connect(_pre_init, dispatch_uid='securepay.fields')
+signals.post_init.connect(_post_init, dispatch_uid='securepay.fields')
+
+
+try:
+    from south.modelsinspector import add_introspection_rules
+except ImportError:
+    pass
+else:
+    add_introspection_rules([], [r'^securepay\.fields\.JSONField'])
@@ -0,0 +1,27 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from securepay import archive
+
+
+class Command(BaseCommand):
+    help = ('Move old completed transactions from the transaction table to '
+        'the archive table')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--older-than', dest='older_than', type='int',
+            default=archive.ARCHIVE_AFTER,
+            help='Archive completed transactions older than this many days'),
+        make_option('--batch-size', dest='batch_size', type='int',
+            default=archive.BATCH_SIZE),
+        make_option('--limit', dest='limit', type='int', default=None,
+            help='Stop after archiving this many transactions'),
+    )
+
+    def handle(self, *args, **options):
+        count = archive.archive(
+            older_than=options['older_than'],
+            batch_size=options['batch_size'],
+            limit=options['limit'])
+        self.stdout.write('%d transactions archived\n' % count)
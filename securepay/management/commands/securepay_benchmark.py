@@ -0,0 +1,84 @@
+import json
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from securepay import benchmarks
+
+
+class Command(BaseCommand):
+    args = '[benchmark name prefix ...]'
+    help = ('Time each stage of building, sending, parsing and saving '
+        'SecurePay transactions, against a stub gateway')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--json', dest='json', default=None,
+            help='Write the results to this file as JSON'),
+        make_option('--compare', dest='compare', default=None,
+            help='Compare the results against a JSON file from an earlier '
+                'run, and fail if any benchmark has regressed'),
+        make_option('--threshold', dest='threshold', type='float',
+            default=10.0,
+            help='Percentage slowdown that counts as a regression'),
+        make_option('--repeat', dest='repeat', type='int', default=5),
+        make_option('--min-time', dest='min_time', type='float',
+            default=0.2,
+            help='Minimum number of seconds for each timed run'),
+        make_option('--no-db', dest='database', action='store_false',
+            default=True, help='Skip the benchmarks that use the database'),
+        make_option('--use-configured-db', dest='test_db',
+            action='store_false', default=True,
+            help='Run the database benchmarks against the configured '
+                'database, rather than a throwaway test database. They '
+                'write thousands of fake transactions, so never use this '
+                'against real data.'),
+    )
+
+    def handle(self, *names, **options):
+        verbosity = int(options.get('verbosity', 1))
+
+        if options['database'] and options['test_db']:
+            try:
+                from south.management.commands import \
+                    patch_for_test_db_setup
+            except ImportError:
+                pass
+            else:
+                # Otherwise South's syncdb skips the migrated apps, and the
+                # test database has no securepay tables
+                patch_for_test_db_setup()
+            old_name = connection.creation.create_test_db(verbosity,
+                autoclobber=True)
+        try:
+            results = benchmarks.run(names, database=options['database'],
+                repeat=options['repeat'], min_time=options['min_time'])
+        finally:
+            if options['database'] and options['test_db']:
+                connection.creation.destroy_test_db(old_name, verbosity)
+
+        for name, result in sorted(results['results'].items()):
+            self.stdout.write('%-36s %10.1f us  (%d loops)\n' % (
+                name, result['median'] * 1e6, result['loops']))
+
+        if options['json']:
+            with open(options['json'], 'w') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+
+        if options['compare']:
+            with open(options['compare']) as baseline_file:
+                baseline = json.load(baseline_file)
+
+            regressions = []
+            self.stdout.write('\n')
+            for name, old, new, change, regressed in benchmarks.compare(
+                    baseline, results, options['threshold']):
+                self.stdout.write('%-36s %10.1f -> %10.1f us  %+6.1f%%%s\n' % (
+                    name, old * 1e6, new * 1e6, change,
+                    '  REGRESSED' if regressed else ''))
+                if regressed:
+                    regressions.append(name)
+
+            if regressions:
+                raise CommandError('%d benchmarks regressed: %s' % (
+                    len(regressions), ', '.join(regressions)))
@@ -0,0 +1,68 @@
+import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from securepay import export
+from securepay.models import ArchivedTransaction, Transaction, _day_start
+
+
+def parse_date(value):
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError('Dates must be YYYY-MM-DD, not %s' % value)
+
+
+class Command(BaseCommand):
+    help = ('Export transactions as CSV or JSON lines, streaming them so '
+        'exports of any size use the same memory')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', default='csv',
+            choices=sorted(export.CONTENT_TYPES)),
+        make_option('--columns', dest='columns', default=None,
+            help='Comma separated fields to export. Defaults to '
+                'SECUREPAY_EXPORT_COLUMNS.'),
+        make_option('--since', dest='since', default=None,
+            help='First day to export, as YYYY-MM-DD'),
+        make_option('--until', dest='until', default=None,
+            help='Last day to export, as YYYY-MM-DD'),
+        make_option('--status', dest='status', default=None),
+        make_option('--merchant', dest='merchant', default=None),
+        make_option('--archived', dest='archived', action='store_true',
+            default=False, help='Export archived transactions instead'),
+        make_option('--output', dest='output', default=None,
+            help='File to write to. Defaults to standard output.'),
+    )
+
+    def handle(self, *args, **options):
+        model = ArchivedTransaction if options['archived'] else Transaction
+        queryset = model.objects.all()
+        if options['since']:
+            queryset = queryset.filter(
+                created__gte=_day_start(parse_date(options['since'])))
+        if options['until']:
+            until = parse_date(options['until']) + datetime.timedelta(days=1)
+            queryset = queryset.filter(created__lt=_day_start(until))
+        for name in ['status', 'merchant']:
+            if options[name]:
+                queryset = queryset.filter(**{name: options[name]})
+
+        columns = None
+        if options['columns']:
+            columns = [column.strip()
+                for column in options['columns'].split(',')]
+
+        try:
+            lines = export.export(queryset, options['format'], columns)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line)
+            return
+        with open(options['output'], 'wb') as output:
+            for line in lines:
+                output.write(line)
@@ -0,0 +1,40 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from securepay import probe
+
+
+class Command(BaseCommand):
+    help = ('Send Echo requests to every SecurePay endpoint and report the '
+        'gateway round trip times')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--interval', dest='interval', type='int',
+            default=probe.PROBE_INTERVAL,
+            help='Seconds between probes'),
+        make_option('--connections', dest='connections', type='int',
+            default=1, help='Echoes sent to each endpoint at once'),
+        make_option('--once', dest='once', action='store_true',
+            default=False, help='Probe once and exit'),
+    )
+
+    def handle(self, *args, **options):
+        while True:
+            results = probe.warm_up(options['connections'])
+            for (endpoint, merchant), rtts in sorted(results.items()):
+                summary = probe.get_histogram(endpoint).snapshot()
+                self.stdout.write('%s (%s): %s, p50 %s, p99 %s over %d\n' % (
+                    endpoint, merchant,
+                    ', '.join('%.0fms' % (rtt * 1000) for rtt in rtts)
+                        or 'failed',
+                    _ms(summary.get('p50')), _ms(summary.get('p99')),
+                    summary['count']))
+
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+
+def _ms(value):
+    return 'n/a' if value is None else '%.0fms' % value
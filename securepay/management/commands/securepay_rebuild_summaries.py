@@ -0,0 +1,47 @@
+import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+
+from securepay.models import DailySummary, Transaction, _local_date
+
+
+def parse_date(value):
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError('Dates must be YYYY-MM-DD, not %s' % value)
+
+
+class Command(BaseCommand):
+    help = ('Recalculate the daily transaction summaries from the '
+        'transaction table, one day at a time')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--since', dest='since', default=None,
+            help='First day to rebuild, as YYYY-MM-DD. Defaults to the day '
+                'of the first transaction.'),
+        make_option('--until', dest='until', default=None,
+            help='Last day to rebuild, as YYYY-MM-DD. Defaults to today.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['since']:
+            day = parse_date(options['since'])
+        else:
+            first = Transaction.objects.aggregate(Min('created'))
+            if first['created__min'] is None:
+                return
+            day = _local_date(first['created__min'])
+
+        if options['until']:
+            until = parse_date(options['until'])
+        else:
+            until = datetime.date.today()
+
+        while day <= until:
+            DailySummary.objects.rebuild(day)
+            if int(options.get('verbosity', 1)) > 1:
+                self.stdout.write('Rebuilt %s\n' % day)
+            day += datetime.timedelta(days=1)
@@ -0,0 +1,42 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from securepay import reconciler
+
+
+class Command(BaseCommand):
+    help = ('Resolve transactions left in sending or receiving from the '
+        'responses saved against them. Safe to run on several nodes.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--older-than', dest='stale_after', type='int',
+            default=reconciler.STALE_AFTER,
+            help='Only reconcile transactions untouched for this many '
+                'seconds'),
+        make_option('--batch-size', dest='batch_size', type='int',
+            default=reconciler.BATCH_SIZE),
+        make_option('--limit', dest='limit', type='int', default=None,
+            help='Stop after looking at this many transactions'),
+        make_option('--loop', dest='interval', type='int', default=None,
+            help='Keep running, reconciling every this many seconds'),
+        make_option('--query', dest='query', action='store_true',
+            default=reconciler.QUERY,
+            help='Send a Query for transactions with no saved response. '
+                'Only the simulator answers these.'),
+    )
+
+    def handle(self, *args, **options):
+        while True:
+            counts = reconciler.reconcile(
+                stale_after=options['stale_after'],
+                batch_size=options['batch_size'],
+                limit=options['limit'], query=options['query'])
+            self.stdout.write('%(resolved)d resolved, %(not_received)d not '
+                'received, %(released)d released, %(skipped)d skipped\n'
+                % counts)
+
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,46 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from securepay.simulator import Simulator, make_server
+
+
+class Command(BaseCommand):
+    help = ('Run a local SecurePay gateway simulator. Point the client at it '
+        'by setting SECUREPAY_URL_TEMPLATE to http://HOST:PORT/%s/xmlapi/%s')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--host', dest='host', default='127.0.0.1'),
+        make_option('--port', dest='port', type='int', default=8001),
+        make_option('--latency', dest='latency', default=None,
+            help='Response latency, e.g. fixed:200, uniform:100:400, '
+                'normal:250:50, lognormal:200:0.5 or exponential:250 '
+                '(milliseconds)'),
+        make_option('--error-rate', dest='error_rate', type='float',
+            default=0.0, help='Fraction of requests answered with HTTP 500'),
+        make_option('--malformed-rate', dest='malformed_rate',
+            type='float', default=0.0,
+            help='Fraction of requests answered with truncated XML'),
+        make_option('--drop-rate', dest='drop_rate', type='float',
+            default=0.0,
+            help='Fraction of connections dropped without a response'),
+        make_option('--seed', dest='seed', type='int', default=None),
+        make_option('--remember', dest='remember', type='int',
+            default=100000,
+            help='How many transaction IDs and outcomes to keep'),
+    )
+
+    def handle(self, *args, **options):
+        simulator = Simulator(latency=options['latency'],
+            error_rate=options['error_rate'],
+            malformed_rate=options['malformed_rate'],
+            drop_rate=options['drop_rate'], seed=options['seed'],
+            remember=options['remember'])
+        server = make_server(simulator, options['host'], options['port'])
+
+        self.stdout.write('SecurePay simulator listening on http://%s:%d/\n'
+            % (options['host'], options['port']))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
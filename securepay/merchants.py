@@ -0,0 +1,80 @@
+"""
+The SecurePay merchant accounts transactions can be made with.
+
+Merchants are configured with the `SECUREPAY_MERCHANTS` setting, a dict
+from a name to the arguments for a <utils.Merchant>:
+
+    SECUREPAY_MERCHANTS = {
+        'default': {'merchant_id': 'ABC0001', 'password': 'abc123'},
+        'events': {'merchant_id': 'ABC0002', 'password': 'def456',
+            'rate_limit': 10, 'pool_maxsize': 4},
+    }
+
+If it is not set, the merchant from `SECUREPAY_MERCHANT_ID` and
+`SECUREPAY_PASSWORD` is registered as `'default'`. Merchants can also be
+added at run time with <register>. Transactions are made with
+`SECUREPAY_DEFAULT_MERCHANT` unless a `merchant` is given, and remember which
+merchant they were made with, so that refunds and the like go to the same
+account.
+
+Each merchant has its own connection pool, rate limit and cached
+`<MerchantInfo>`.
+"""
+import threading
+
+from django.conf import settings
+
+from securepay.exceptions import UnknownMerchant
+from securepay.utils import Merchant
+
+#: The merchant used when none is given
+DEFAULT_MERCHANT = getattr(settings, 'SECUREPAY_DEFAULT_MERCHANT', 'default')
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def _load():
+    global _registry
+
+    with _registry_lock:
+        if _registry is not None:
+            return
+        configured = getattr(settings, 'SECUREPAY_MERCHANTS', None)
+        if configured is None:
+            configured = {DEFAULT_MERCHANT: {
+                'merchant_id': settings.SECUREPAY_MERCHANT_ID,
+                'password': settings.SECUREPAY_PASSWORD,
+            }}
+        _registry = dict((name, Merchant(name=name, **options))
+            for name, options in configured.items())
+
+def register(name, merchant_id, password, **options):
+    """
+    Add or replace a merchant. Takes the same arguments as <utils.Merchant>.
+    """
+    _load()
+    merchant = Merchant(merchant_id, password, name=name, **options)
+    with _registry_lock:
+        _registry[name] = merchant
+    return merchant
+
+def get_merchant(merchant=None):
+    """
+    Get a registered <utils.Merchant> by name. `None` gets the default
+    merchant, and a <utils.Merchant> is returned as is. Raises
+    <UnknownMerchant> for names that are not registered.
+    """
+    if isinstance(merchant, Merchant):
+        return merchant
+    if merchant is None:
+        merchant = DEFAULT_MERCHANT
+
+    _load()
+    try:
+        return _registry[merchant]
+    except KeyError:
+        raise UnknownMerchant(merchant)
+
+def all_merchants():
+    _load()
+    return list(_registry.values())
@@ -0,0 +1,226 @@
+"""
+Per-transaction timing and size metrics.
+
+Every request sent to SecurePay can report how long was spent building the
+request, sending it, parsing the response and saving the results, along with
+the request and response sizes and the response codes. These are passed to
+each configured sink as a dict:
+
+    {
+        'txn_type': 'pay',
+        'count': 1,  # Transactions in the request
+        'phases': {'build': 0.0002, 'send': 0.41, 'parse': 0.0001,
+                   'persist': 0.004},
+        'total': 0.4143,
+        'request_bytes': 712,
+        'response_bytes': 1204,
+        'status_code': '000',
+        'response_codes': ['00'],
+        'error': None,  # Or the name of the exception raised
+    }
+
+Sinks are callables taking that dict, and are set with the
+`SECUREPAY_METRICS_SINKS` setting as a list of dotted paths, or added with
+<add_sink>. When there are no sinks nothing is timed at all.
+"""
+import time
+import socket
+import logging
+import threading
+
+from django.conf import settings
+from django.dispatch import Signal
+from django.utils.importlib import import_module
+
+logger = logging.getLogger(__name__)
+
+#: Sent with the `metrics` dict for each request, by <signal_sink>
+request_timed = Signal(providing_args=['metrics'])
+
+_sinks = []
+_sinks_lock = threading.Lock()
+
+
+def _import(path):
+    module_name, name = path.rsplit('.', 1)
+    return getattr(import_module(module_name), name)
+
+def add_sink(sink):
+    """
+    Start sending metrics to `sink`, a callable or a dotted path to one
+    """
+    if isinstance(sink, basestring):
+        sink = _import(sink)
+    with _sinks_lock:
+        _sinks.append(sink)
+
+def remove_sink(sink):
+    with _sinks_lock:
+        _sinks.remove(sink)
+
+def start(txn_type, count=1):
+    """
+    Start timing a request for `count` transactions of type `txn_type`.
+    Returns a <Timings>, or a do-nothing <NullTimings> if there are no sinks.
+    """
+    if not _sinks:
+        return NULL_TIMINGS
+    return Timings(txn_type, count)
+
+
+class Timings(object):
+    """
+    Times the phases of a single request. Call <lap> at the end of each
+    phase, and <finish> once the request is done.
+    """
+    def __init__(self, txn_type, count):
+        self.metrics = {
+            'txn_type': txn_type,
+            'count': count,
+            'phases': {},
+            'request_bytes': None,
+            'response_bytes': None,
+            'status_code': None,
+            'response_codes': [],
+            'error': None,
+        }
+        self.start = self.last = time.time()
+
+    def lap(self, phase):
+        """
+        Add the time since the last lap to `phase`
+        """
+        now = time.time()
+        phases = self.metrics['phases']
+        phases[phase] = phases.get(phase, 0.0) + (now - self.last)
+        self.last = now
+
+    def record(self, **kwargs):
+        self.metrics.update(kwargs)
+
+    def finish(self, **kwargs):
+        """
+        Record any final values, and send the metrics to every sink. Sinks
+        that raise errors are logged and ignored.
+        """
+        self.metrics.update(kwargs)
+        self.metrics['total'] = time.time() - self.start
+        for sink in list(_sinks):
+            try:
+                sink(self.metrics)
+            except Exception:
+                logger.exception("Metrics sink %r failed", sink)
+
+
+class NullTimings(object):
+    """
+    Used in place of <Timings> when metrics are disabled
+    """
+    def lap(self, phase):
+        pass
+
+    def record(self, **kwargs):
+        pass
+
+    def finish(self, **kwargs):
+        pass
+
+NULL_TIMINGS = NullTimings()
+
+
+def signal_sink(metrics):
+    """
+    Send the <request_timed> signal
+    """
+    request_timed.send(sender=None, metrics=metrics)
+
+def logging_sink(metrics):
+    """
+    Log the metrics at INFO level
+    """
+    logger.info("SecurePay %(txn_type)s x%(count)d took %(total).3fs",
+        metrics, extra={'securepay_metrics': metrics})
+
+
+class StatsdSink(object):
+    """
+    Send metrics to statsd over UDP: a timer per phase, and counters for
+    response codes and errors, all prefixed with `prefix` and the transaction
+    type. Configure with `SECUREPAY_STATSD = {'host': ..., 'port': ...,
+    'prefix': ...}` and add `'securepay.metrics.statsd_sink'` to the sinks.
+    """
+    def __init__(self, host='localhost', port=8125, prefix='securepay'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def __call__(self, metrics):
+        prefix = '%s.%s' % (self.prefix, metrics['txn_type'])
+        lines = ['%s.%s:%d|ms' % (prefix, phase, seconds * 1000)
+            for phase, seconds in metrics['phases'].items()]
+        lines.append('%s.total:%d|ms' % (prefix, metrics['total'] * 1000))
+        for code in metrics['response_codes']:
+            lines.append('%s.response.%s:1|c' % (prefix, code or 'none'))
+        if metrics['error']:
+            lines.append('%s.error.%s:1|c' % (prefix, metrics['error']))
+
+        try:
+            self.socket.sendto('\n'.join(lines).encode('ascii'), self.address)
+        except socket.error:
+            pass
+
+
+class PrometheusSink(object):
+    """
+    Record metrics with `prometheus_client`, as a histogram of phase
+    durations and counters of response codes and errors, labelled with the
+    transaction type. Add `'securepay.metrics.prometheus_sink'` to the sinks.
+    """
+    def __init__(self):
+        from prometheus_client import Counter, Histogram
+
+        self.durations = Histogram('securepay_request_phase_seconds',
+            'Time spent in each phase of a SecurePay request',
+            ['txn_type', 'phase'])
+        self.responses = Counter('securepay_responses_total',
+            'SecurePay bank response codes', ['txn_type', 'response_code'])
+        self.errors = Counter('securepay_errors_total',
+            'Errors raised while talking to SecurePay', ['txn_type', 'error'])
+
+    def __call__(self, metrics):
+        txn_type = metrics['txn_type']
+        for phase, seconds in metrics['phases'].items():
+            self.durations.labels(txn_type, phase).observe(seconds)
+        self.durations.labels(txn_type, 'total').observe(metrics['total'])
+        for code in metrics['response_codes']:
+            self.responses.labels(txn_type, code or 'none').inc()
+        if metrics['error']:
+            self.errors.labels(txn_type, metrics['error']).inc()
+
+
+class _LazySink(object):
+    """
+    Makes the real sink on first use, so that optional dependencies are only
+    imported when the sink is configured
+    """
+    def __init__(self, factory):
+        self.factory = factory
+        self.sink = None
+        self.lock = threading.Lock()
+
+    def __call__(self, metrics):
+        if self.sink is None:
+            with self.lock:
+                # Prometheus refuses to register the same metrics twice, so
+                # only one thread may make the sink
+                if self.sink is None:
+                    self.sink = self.factory()
+        return self.sink(metrics)
+
+statsd_sink = _LazySink(
+    lambda: StatsdSink(**getattr(settings, 'SECUREPAY_STATSD', {})))
+prometheus_sink = _LazySink(PrometheusSink)
+
+
+for _sink in getattr(settings, 'SECUREPAY_METRICS_SINKS', []):
+    add_sink(_sink)
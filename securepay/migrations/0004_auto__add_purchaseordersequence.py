@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'PurchaseOrderSequence'
+        db.create_table('securepay_purchaseordersequence', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('name', self.gf('django.db.models.fields.CharField')(unique=True, max_length=50)),
+            ('next_value', self.gf('django.db.models.fields.BigIntegerField')(default=1)),
+        ))
+        db.send_create_signal('securepay', ['PurchaseOrderSequence'])
+
+        # Sequence for <allocators.SequenceAllocator>, starting after the
+        # existing transaction IDs that purchase order numbers were made from
+        if db.backend_name == 'postgres' and not db.dry_run:
+            start = db.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM securepay_transaction')[0][0]
+            db.execute('CREATE SEQUENCE securepay_purchase_order_no_seq START %d' % start)
+
+    def backwards(self, orm):
+        # Deleting model 'PurchaseOrderSequence'
+        db.delete_table('securepay_purchaseordersequence')
+
+        if db.backend_name == 'postgres':
+            db.execute('DROP SEQUENCE IF EXISTS securepay_purchase_order_no_seq')
+
+    models = {
+        'securepay.bankaccount': {
+            'Meta': {'ordering': "['name', 'bsb', 'account_number']", 'object_name': 'BankAccount'},
+            'account_number': ('django.db.models.fields.CharField', [], {'max_length': '9'}),
+            'bsb': ('django.db.models.fields.CharField', [], {'max_length': '6'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '32'})
+        },
+        'securepay.purchaseordersequence': {
+            'Meta': {'object_name': 'PurchaseOrderSequence'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '50'}),
+            'next_value': ('django.db.models.fields.BigIntegerField', [], {'default': '1'})
+        },
+        'securepay.transaction': {
+            'Meta': {'ordering': "['-created']", 'object_name': 'Transaction'},
+            'amount': ('django.db.models.fields.DecimalField', [], {'max_digits': '10', 'decimal_places': '2'}),
+            'bank_message': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'card_name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'debug': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'description': ('django.db.models.fields.CharField', [], {'max_length': '25'}),
+            'extra_data': ('picklefield.fields.PickledObjectField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'preauth_id': ('django.db.models.fields.CharField', [], {'max_length': '10', 'null': 'True', 'blank': 'True'}),
+            'processed': ('django.db.models.fields.NullBooleanField', [], {'null': 'True', 'blank': 'True'}),
+            'purchase_order_no': ('django.db.models.fields.CharField', [], {'max_length': '60', 'db_index': 'True'}),
+            'reference_transaction': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'referenced_by'", 'null': 'True', 'on_delete': 'models.SET_NULL', 'to': "orm['securepay.Transaction']"}),
+            'response_code': ('django.db.models.fields.CharField', [], {'max_length': '3', 'blank': 'True'}),
+            'response_text': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'status': ('django.db.models.fields.CharField', [], {'default': "'init'", 'max_length': '10'}),
+            'success': ('django.db.models.fields.NullBooleanField', [], {'null': 'True', 'blank': 'True'}),
+            'txn_id': ('django.db.models.fields.CharField', [], {'max_length': '10', 'null': 'True', 'blank': 'True'}),
+            'txn_type': ('django.db.models.fields.CharField', [], {'max_length': '10'})
+        }
+    }
+
+    complete_apps = ['securepay']
\ No newline at end of file
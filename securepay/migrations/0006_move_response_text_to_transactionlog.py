@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import zlib
+import base64
+import datetime
+from south.db import db
+from south.v2 import DataMigration
+from django.db import models
+
+BATCH_SIZE = 1000
+
+
+def compress_text(text):
+    compressed = zlib.compress(text.encode('utf-8'))
+    return base64.b64encode(compressed).decode('ascii')
+
+def decompress_text(data):
+    return zlib.decompress(base64.b64decode(data)).decode('utf-8')
+
+
+class Migration(DataMigration):
+
+    def forwards(self, orm):
+        """
+        Move raw responses out of the transaction table and in to
+        TransactionLogs, a batch at a time. Moved responses are blanked, so
+        this can be interrupted and run again.
+        """
+        Transaction = orm['securepay.Transaction']
+        TransactionLog = orm['securepay.TransactionLog']
+
+        last_pk = 0
+        while True:
+            batch = list(Transaction.objects
+                .filter(pk__gt=last_pk)
+                .exclude(response_text='')
+                .order_by('pk')
+                .values_list('pk', 'response_text')[:BATCH_SIZE])
+            if not batch:
+                break
+
+            pks = [pk for pk, response_text in batch]
+            logged = set(TransactionLog.objects
+                .filter(transaction__in=pks, kind='response')
+                .values_list('transaction_id', flat=True))
+
+            TransactionLog.objects.bulk_create([
+                TransactionLog(transaction_id=pk, kind='response',
+                    data=compress_text(response_text),
+                    created=datetime.datetime.now())
+                for pk, response_text in batch if pk not in logged])
+            Transaction.objects.filter(pk__in=pks).update(response_text='')
+
+            db.commit_transaction()
+            db.start_transaction()
+            last_pk = pks[-1]
+
+    def backwards(self, orm):
+        """
+        Move the raw responses back on to their transactions, a batch at a
+        time. Moved logs are deleted, so this can be interrupted and run
+        again.
+        """
+        Transaction = orm['securepay.Transaction']
+        TransactionLog = orm['securepay.TransactionLog']
+
+        logs = TransactionLog.objects.filter(kind='response').order_by('pk')
+        while True:
+            batch = list(logs.values_list('pk', 'transaction_id', 'data')
+                [:BATCH_SIZE])
+            if not batch:
+                break
+
+            for pk, transaction_id, data in batch:
+                Transaction.objects.filter(pk=transaction_id).update(
+                    response_text=decompress_text(data))
+            TransactionLog.objects.filter(
+                pk__in=[pk for pk, transaction_id, data in batch]).delete()
+
+            db.commit_transaction()
+            db.start_transaction()
+
+    models = {
+        'securepay.bankaccount': {
+            'Meta': {'ordering': "['name', 'bsb', 'account_number']", 'object_name': 'BankAccount'},
+            'account_number': ('django.db.models.fields.CharField', [], {'max_length': '9'}),
+            'bsb': ('django.db.models.fields.CharField', [], {'max_length': '6'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '32'})
+        },
+        'securepay.purchaseordersequence': {
+            'Meta': {'object_name': 'PurchaseOrderSequence'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '50'}),
+            'next_value': ('django.db.models.fields.BigIntegerField', [], {'default': '1'})
+        },
+        'securepay.transaction': {
+            'Meta': {'ordering': "['-created']", 'object_name': 'Transaction'},
+            'amount': ('django.db.models.fields.DecimalField', [], {'max_digits': '10', 'decimal_places': '2'}),
+            'bank_message': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'card_name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'debug': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'description': ('django.db.models.fields.CharField', [], {'max_length': '25'}),
+            'extra_data': ('picklefield.fields.PickledObjectField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'preauth_id': ('django.db.models.fields.CharField', [], {'max_length': '10', 'null': 'True', 'blank': 'True'}),
+            'processed': ('django.db.models.fields.NullBooleanField', [], {'null': 'True', 'blank': 'True'}),
+            'purchase_order_no': ('django.db.models.fields.CharField', [], {'max_length': '60', 'db_index': 'True'}),
+            'reference_transaction': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'referenced_by'", 'null': 'True', 'on_delete': 'models.SET_NULL', 'to': "orm['securepay.Transaction']"}),
+            'response_code': ('django.db.models.fields.CharField', [], {'max_length': '3', 'blank': 'True'}),
+            'response_text': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'status': ('django.db.models.fields.CharField', [], {'default': "'init'", 'max_length': '10'}),
+            'success': ('django.db.models.fields.NullBooleanField', [], {'null': 'True', 'blank': 'True'}),
+            'txn_id': ('django.db.models.fields.CharField', [], {'max_length': '10', 'null': 'True', 'blank': 'True'}),
+            'txn_type': ('django.db.models.fields.CharField', [], {'max_length': '10'})
+        },
+        'securepay.transactionlog': {
+            'Meta': {'unique_together': "[('transaction', 'kind')]", 'object_name': 'TransactionLog'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'data': ('django.db.models.fields.TextField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'kind': ('django.db.models.fields.CharField', [], {'max_length': '10'}),
+            'transaction': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'logs'", 'to': "orm['securepay.Transaction']"})
+        }
+    }
+
+    complete_apps = ['securepay']
+    symmetrical = True
\ No newline at end of file
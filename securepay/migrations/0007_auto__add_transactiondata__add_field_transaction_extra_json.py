@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'TransactionData'
+        db.create_table('securepay_transactiondata', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('transaction', self.gf('django.db.models.fields.related.ForeignKey')(related_name='data_keys', to=orm['securepay.Transaction'])),
+            ('key', self.gf('django.db.models.fields.CharField')(max_length=50)),
+            ('value', self.gf('django.db.models.fields.CharField')(max_length=255, db_index=True)),
+        ))
+        db.send_create_signal('securepay', ['TransactionData'])
+
+        # Adding unique constraint on 'TransactionData', fields ['transaction', 'key']
+        db.create_unique('securepay_transactiondata', ['transaction_id', 'key'])
+
+        # Adding field 'Transaction.extra_json'
+        db.add_column('securepay_transaction', 'extra_json',
+                      self.gf('securepay.fields.JSONField')(null=True),
+                      keep_default=False)
+
+    def backwards(self, orm):
+        # Removing unique constraint on 'TransactionData', fields ['transaction', 'key']
+        db.delete_unique('securepay_transactiondata', ['transaction_id', 'key'])
+
+        # Deleting model 'TransactionData'
+        db.delete_table('securepay_transactiondata')
+
+        # Deleting field 'Transaction.extra_json'
+        db.delete_column('securepay_transaction', 'extra_json')
+
+    models = {
+        'securepay.bankaccount': {
+            'Meta': {'ordering': "['name', 'bsb', 'account_number']", 'object_name': 'BankAccount'},
+            'account_number': ('django.db.models.fields.CharField', [], {'max_length': '9'}),
+            'bsb': ('django.db.models.fields.CharField', [], {'max_length': '6'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '32'})
+        },
+        'securepay.purchaseordersequence': {
+            'Meta': {'object_name': 'PurchaseOrderSequence'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '50'}),
+            'next_value': ('django.db.models.fields.BigIntegerField', [], {'default': '1'})
+        },
+        'securepay.transaction': {
+            'Meta': {'ordering': "['-created']", 'object_name': 'Transaction'},
+            'amount': ('django.db.models.fields.DecimalField', [], {'max_digits': '10', 'decimal_places': '2'}),
+            'bank_message': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'card_name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'debug': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'description': ('django.db.models.fields.CharField', [], {'max_length': '25'}),
+            'extra_data': ('picklefield.fields.PickledObjectField', [], {}),
+            'extra_json': ('securepay.fields.JSONField', [], {'null': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'preauth_id': ('django.db.models.fields.CharField', [], {'max_length': '10', 'null': 'True', 'blank': 'True'}),
+            'processed': ('django.db.models.fields.NullBooleanField', [], {'null': 'True', 'blank': 'True'}),
+            'purchase_order_no': ('django.db.models.fields.CharField', [], {'max_length': '60', 'db_index': 'True'}),
+            'reference_transaction': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'referenced_by'", 'null': 'True', 'on_delete': 'models.SET_NULL', 'to': "orm['securepay.Transaction']"}),
+            'response_code': ('django.db.models.fields.CharField', [], {'max_length': '3', 'blank': 'True'}),
+            'response_text': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'status': ('django.db.models.fields.CharField', [], {'default': "'init'", 'max_length': '10'}),
+            'success': ('django.db.models.fields.NullBooleanField', [], {'null': 'True', 'blank': 'True'}),
+            'txn_id': ('django.db.models.fields.CharField', [], {'max_length': '10', 'null': 'True', 'blank': 'True'}),
+            'txn_type': ('django.db.models.fields.CharField', [], {'max_length': '10'})
+        },
+        'securepay.transactiondata': {
+            'Meta': {'unique_together': "[('transaction', 'key')]", 'object_name': 'TransactionData'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'key': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            'transaction': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'data_keys'", 'to': "orm['securepay.Transaction']"}),
+            'value': ('django.db.models.fields.CharField', [], {'max_length': '255', 'db_index': 'True'})
+        },
+        'securepay.transactionlog': {
+            'Meta': {'unique_together': "[('transaction', 'kind')]", 'object_name': 'TransactionLog'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'data': ('django.db.models.fields.TextField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'kind': ('django.db.models.fields.CharField', [], {'max_length': '10'}),
+            'transaction': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'logs'", 'to': "orm['securepay.Transaction']"})
+        }
+    }
+
+    complete_apps = ['securepay']
\ No newline at end of file
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import DataMigration
+from django.conf import settings
+from django.db import models
+
+BATCH_SIZE = 500
+
+
+def update_each(model, column, values):
+    """
+    Set `column` to a different value on each row with a single `UPDATE`.
+    `values` is a list of `(pk, value)` pairs, with the values already
+    prepared for the database.
+    """
+    pk_column = db.quote_name(model._meta.pk.column)
+    # Primary keys are integers, so are safe to put in the SQL, and leave
+    # room for more rows under the limit on parameters
+    pks = [int(pk) for pk, value in values]
+    db.execute('UPDATE %s SET %s = CASE %s %s END WHERE %s IN (%s)' % (
+        db.quote_name(model._meta.db_table), db.quote_name(column),
+        pk_column, ' '.join(['WHEN %d THEN %%s' % pk for pk in pks]),
+        pk_column, ', '.join(str(pk) for pk in pks)),
+        [value for pk, value in values])
+
+
+class Migration(DataMigration):
+
+    def forwards(self, orm):
+        """
+        Copy the pickled extra_data of every transaction in to extra_json, a
+        batch at a time. Only rows without extra_json are touched, so this can
+        be interrupted and run again.
+        """
+        Transaction = orm['securepay.Transaction']
+        TransactionData = orm['securepay.TransactionData']
+        indexed_keys = getattr(settings, 'SECUREPAY_INDEXED_DATA_KEYS', [])
+
+        last_pk = 0
+        while True:
+            batch = list(Transaction.objects
+                .filter(pk__gt=last_pk, extra_json__isnull=True)
+                .order_by('pk')
+                .only('pk', 'extra_data')[:BATCH_SIZE])
+            if not batch:
+                break
+
+            extra_json = Transaction._meta.get_field('extra_json')
+            values = []
+            data_keys = []
+            for transaction in batch:
+                data = transaction.extra_data
+                if data is None:
+                    data = {}
+
+                try:
+                    text = extra_json.get_prep_value(data)
+                except TypeError:
+                    # Not JSON serialisable. Keep what we can see of it
+                    data = {'unconverted': repr(data)}
+                    text = extra_json.get_prep_value(data)
+                values.append((transaction.pk, text))
+
+                if isinstance(data, dict):
+                    data_keys.extend(
+                        TransactionData(transaction_id=transaction.pk,
+                            key=key, value=unicode(data[key])[:255])
+                        for key in indexed_keys if data.get(key) is not None)
+
+            update_each(Transaction, 'extra_json', values)
+            TransactionData.objects.bulk_create(data_keys)
+
+            db.commit_transaction()
+            db.start_transaction()
+            last_pk = batch[-1].pk
+
+    def backwards(self, orm):
+        Transaction = orm['securepay.Transaction']
+
+        last_pk = 0
+        while True:
+            batch = list(Transaction.objects
+                .filter(pk__gt=last_pk, extra_json__isnull=False)
+                .order_by('pk')
+                .only('pk', 'extra_json')[:BATCH_SIZE])
+            if not batch:
+                break
+
+            extra_data = Transaction._meta.get_field('extra_data')
+            update_each(Transaction, 'extra_data', [(transaction.pk,
+                extra_data.get_db_prep_save(transaction.extra_json,
+                    connection=db._get_connection()))
+                for transaction in batch])
+            Transaction.objects.filter(pk__in=[t.pk for t in batch]) \
+                .update(extra_json=None)
+
+            db.commit_transaction()
+            db.start_transaction()
+            last_pk = batch[-1].pk
+
+        orm['securepay.TransactionData'].objects.all().delete()
+
+    models = {
+        'securepay.bankaccount': {
+            'Meta': {'ordering': "['name', 'bsb', 'account_number']", 'object_name': 'BankAccount'},
+            'account_number': ('django.db.models.fields.CharField', [], {'max_length': '9'}),
+            'bsb': ('django.db.models.fields.CharField', [], {'max_length': '6'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '32'})
+        },
+        'securepay.purchaseordersequence': {
+            'Meta': {'object_name': 'PurchaseOrderSequence'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '50'}),
+            'next_value': ('django.db.models.fields.BigIntegerField', [], {'default': '1'})
+        },
+        'securepay.transaction': {
+            'Meta': {'ordering': "['-created']", 'object_name': 'Transaction'},
+            'amount': ('django.db.models.fields.DecimalField', [], {'max_digits': '10', 'decimal_places': '2'}),
+            'bank_message': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'card_name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'debug': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'description': ('django.db.models.fields.CharField', [], {'max_length': '25'}),
+            'extra_data': ('picklefield.fields.PickledObjectField', [], {}),
+            'extra_json': ('securepay.fields.JSONField', [], {'null': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'preauth_id': ('django.db.models.fields.CharField', [], {'max_length': '10', 'null': 'True', 'blank': 'True'}),
+            'processed': ('django.db.models.fields.NullBooleanField', [], {'null': 'True', 'blank': 'True'}),
+            'purchase_order_no': ('django.db.models.fields.CharField', [], {'max_length': '60', 'db_index': 'True'}),
+            'reference_transaction': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'referenced_by'", 'null': 'True', 'on_delete': 'models.SET_NULL', 'to': "orm['securepay.Transaction']"}),
+            'response_code': ('django.db.models.fields.CharField', [], {'max_length': '3', 'blank': 'True'}),
+            'response_text': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'status': ('django.db.models.fields.CharField', [], {'default': "'init'", 'max_length': '10'}),
+            'success': ('django.db.models.fields.NullBooleanField', [], {'null': 'True', 'blank': 'True'}),
+            'txn_id': ('django.db.models.fields.CharField', [], {'max_length': '10', 'null': 'True', 'blank': 'True'}),
+            'txn_type': ('django.db.models.fields.CharField', [], {'max_length': '10'})
+        },
+        'securepay.transactiondata': {
+            'Meta': {'unique_together': "[('transaction', 'key')]", 'object_name': 'TransactionData'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'key': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            'transaction': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'data_keys'", 'to': "orm['securepay.Transaction']"}),
+            'value': ('django.db.models.fields.CharField', [], {'max_length': '255', 'db_index': 'True'})
+        },
+        'securepay.transactionlog': {
+            'Meta': {'unique_together': "[('transaction', 'kind')]", 'object_name': 'TransactionLog'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'data': ('django.db.models.fields.TextField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'kind': ('django.db.models.fields.CharField', [], {'max_length': '10'}),
+            'transaction': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'logs'", 'to': "orm['securepay.Transaction']"})
+        }
+    }
+
+    complete_apps = ['securepay']
+    symmetrical = True
\ No newline at end of file
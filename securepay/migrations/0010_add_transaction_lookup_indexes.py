@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+TABLE = 'securepay_transaction'
+
+#: (name, columns, partial index condition)
+INDEXES = [
+    (None, ['created'], None),
+    (None, ['txn_id'], None),
+    (None, ['preauth_id'], None),
+    ('securepay_transaction_type_success_created',
+        ['txn_type', 'success', 'created'], None),
+    ('securepay_transaction_reference_type',
+        ['reference_transaction_id', 'txn_type'], None),
+    ('securepay_transaction_in_flight',
+        ['status', 'modified'], "status <> 'completed'"),
+]
+
+
+class Migration(SchemaMigration):
+    """
+    Add the indexes that transaction lookups need. On PostgreSQL the indexes
+    are built with `CREATE INDEX CONCURRENTLY`, so the table is not locked
+    while they build. That can not be done in a transaction, so this
+    migration commits what came before it and builds the indexes in
+    autocommit mode.
+    """
+
+    def forwards(self, orm):
+        concurrently = db.backend_name == 'postgres' and not db.dry_run
+        partial = db.backend_name in ('postgres', 'sqlite3')
+
+        if concurrently:
+            db.commit_transaction()
+            # Django 1.4 never puts psycopg2 in autocommit mode, so without
+            # this the next statement opens a transaction again
+            connection = db._get_connection()
+            connection.cursor()
+            isolation_level = connection.connection.isolation_level
+            connection.connection.set_isolation_level(0)
+
+        try:
+            for name, columns, condition in INDEXES:
+                if name is None:
+                    # Named as South would name it, so that a later migration
+                    # can drop it with db.delete_index
+                    name = db.create_index_name(TABLE, columns)
+
+                sql = 'CREATE INDEX %s%s ON %s (%s)' % (
+                    'CONCURRENTLY ' if concurrently else '',
+                    db.quote_name(name), db.quote_name(TABLE),
+                    ', '.join(db.quote_name(column) for column in columns))
+                if condition and partial:
+                    sql += ' WHERE ' + condition
+
+                db.execute(sql)
+        finally:
+            if concurrently:
+                connection.connection.set_isolation_level(isolation_level)
+                db.start_transaction()
+
+    def backwards(self, orm):
+        for name, columns, condition in reversed(INDEXES):
+            if name is None:
+                db.delete_index(TABLE, columns)
+            elif db.backend_name == 'mysql':
+                db.execute('DROP INDEX %s ON %s' % (
+                    db.quote_name(name), db.quote_name(TABLE)))
+            else:
+                db.execute('DROP INDEX %s' % db.quote_name(name))
+
+    models = {
+        'securepay.bankaccount': {
+            'Meta': {'ordering': "['name', 'bsb', 'account_number']", 'object_name': 'BankAccount'},
+            'account_number': ('django.db.models.fields.CharField', [], {'max_length': '9'}),
+            'bsb': ('django.db.models.fields.CharField', [], {'max_length': '6'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '32'})
+        },
+        'securepay.purchaseordersequence': {
+            'Meta': {'object_name': 'PurchaseOrderSequence'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '50'}),
+            'next_value': ('django.db.models.fields.BigIntegerField', [], {'default': '1'})
+        },
+        'securepay.transaction': {
+            'Meta': {'ordering': "['-created']", 'object_name': 'Transaction'},
+            'amount': ('django.db.models.fields.DecimalField', [], {'max_digits': '10', 'decimal_places': '2'}),
+            'bank_message': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'card_name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'debug': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'description': ('django.db.models.fields.CharField', [], {'max_length': '25'}),
+            'extra_data': ('securepay.fields.JSONField', [], {'default': '{}'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'preauth_id': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '10', 'null': 'True', 'blank': 'True'}),
+            'processed': ('django.db.models.fields.NullBooleanField', [], {'null': 'True', 'blank': 'True'}),
+            'purchase_order_no': ('django.db.models.fields.CharField', [], {'max_length': '60', 'db_index': 'True'}),
+            'reference_transaction': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'referenced_by'", 'null': 'True', 'on_delete': 'models.SET_NULL', 'to': "orm['securepay.Transaction']"}),
+            'response_code': ('django.db.models.fields.CharField', [], {'max_length': '3', 'blank': 'True'}),
+            'response_text': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'status': ('django.db.models.fields.CharField', [], {'default': "'init'", 'max_length': '10'}),
+            'success': ('django.db.models.fields.NullBooleanField', [], {'null': 'True', 'blank': 'True'}),
+            'txn_id': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '10', 'null': 'True', 'blank': 'True'}),
+            'txn_type': ('django.db.models.fields.CharField', [], {'max_length': '10'})
+        },
+        'securepay.transactiondata': {
+            'Meta': {'unique_together': "[('transaction', 'key')]", 'object_name': 'TransactionData'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'key': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            'transaction': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'data_keys'", 'to': "orm['securepay.Transaction']"}),
+            'value': ('django.db.models.fields.CharField', [], {'max_length': '255', 'db_index': 'True'})
+        },
+        'securepay.transactionlog': {
+            'Meta': {'unique_together': "[('transaction', 'kind')]", 'object_name': 'TransactionLog'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'data': ('django.db.models.fields.TextField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'kind': ('django.db.models.fields.CharField', [], {'max_length': '10'}),
+            'transaction': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'logs'", 'to': "orm['securepay.Transaction']"})
+        }
+    }
+
+    complete_apps = ['securepay']
\ No newline at end of file
@@ -1,13 +1,32 @@
 import datetime
+import functools
+import logging
+from decimal import Decimal
 
-from django.db import models
+from django.db import connection, models, IntegrityError
+from django.db import transaction as db_transaction
 from django.conf import settings
-from picklefield.fields import PickledObjectField
+from django.db.models import F, Sum, Count
+from django.utils import timezone
 
+from securepay import allocators
 from securepay import utils
+from securepay.fields import JSONField
 from securepay import client
-
-URL_TEMPLATE = 'https://%s.securepay.com.au/xmlapi/%s'
+from securepay import decoder
+from securepay import dispatch
+from securepay import encoder
+from securepay import merchants
+from securepay import metrics
+from securepay.exceptions import CircuitOpen, ResponseError, StatusConflict
+
+logger = logging.getLogger(__name__)
+
+#: Where requests are sent. The first `%s` is `'test'` or `'api'`, and the
+#: second the endpoint. Point this at `manage.py securepay_simulator` for load
+#: testing.
+URL_TEMPLATE = getattr(settings, 'SECUREPAY_URL_TEMPLATE',
+    'https://%s.securepay.com.au/xmlapi/%s')
 URL_TYPE_MAP = {
     'pay': 'payment',
     'refund': 'payment',
@@ -18,39 +37,266 @@ URL_TYPE_MAP = {
     'debit': 'directentry',
 }
 
-merchant = {
-    'merchant_id': settings.SECUREPAY_MERCHANT_ID,
-    'password': settings.SECUREPAY_PASSWORD,
-}
+#: Statuses of a transaction that is waiting on SecurePay. `'resolving'`
+#: transactions have been claimed by <securepay.reconciler>.
+IN_FLIGHT = ['sending', 'receiving', 'resolving']
 
-def _send(transaction, request):
-    transaction.status = 'sending'
-    transaction.save()
+#: Save the raw response along with the results, rather than in a separate
+#: write as soon as it arrives
+SKIP_RECEIVING_STATE = getattr(settings, 'SECUREPAY_SKIP_RECEIVING_STATE',
+    False)
 
-    endpoint = URL_TEMPLATE % (
+#: Keys from `extra_data` to copy in to <TransactionData>, for searching on
+INDEXED_DATA_KEYS = getattr(settings, 'SECUREPAY_INDEXED_DATA_KEYS', [])
+
+#: Save a redacted copy of every request sent, along with the responses
+LOG_REQUESTS = getattr(settings, 'SECUREPAY_LOG_REQUESTS', False)
+
+def get_endpoint(txn_type):
+    """
+    Get the SecurePay URL that transactions of type `txn_type` are sent to
+    """
+    return URL_TEMPLATE % (
         'test' if settings.SECUREPAY_DEBUG else 'api',
-        URL_TYPE_MAP[transaction.txn_type],
+        URL_TYPE_MAP[txn_type],
     )
 
-    (response_text, response_xml) = client.send_request(endpoint, request)
+def _transition(transactions, from_statuses, to_status, **fields):
+    """
+    Move some transactions from one of `from_statuses` to `to_status`, setting
+    `fields` on them as well. This is done with a single `UPDATE` of only the
+    changed columns, guarded on the current status, so a transaction that has
+    been moved on by someone else is never clobbered. If any of the
+    transactions were not in `from_statuses`, none of them are moved, and
+    <StatusConflict> is raised.
+    """
+    fields['status'] = to_status
+    fields['modified'] = timezone.now()
+
+    pks = [transaction.pk for transaction in transactions]
+    with utils.atomic():
+        updated = Transaction.objects \
+            .filter(pk__in=pks, status__in=from_statuses) \
+            .update(**fields)
+        if updated != len(pks):
+            raise StatusConflict('Expected %d transactions to be in %s, but '
+                '%d were' % (len(pks), '/'.join(from_statuses), updated))
+
+    for transaction in transactions:
+        for name, value in fields.items():
+            setattr(transaction, name, value)
+
+    if to_status == 'completed':
+        _summarise(transactions)
+
+def _summarise(transactions):
+    """
+    Add newly completed transactions to the <DailySummary> tables. Failures
+    are only logged, as the transactions themselves are already saved, and
+    `manage.py securepay_rebuild_summaries` can fix the totals later.
+    """
+    try:
+        DailySummary.objects.record(transactions)
+    except Exception:
+        logger.exception("Could not add %d transactions to the daily "
+            "summaries", len(transactions))
 
-    transaction.status = 'receiving'
-    transaction.response_text = response_text
-    transaction.save()
+def _transition_each(results, from_statuses, to_status):
+    """
+    Like <_transition>, but setting different fields on each transaction.
+    `results` is a list of `(transaction, fields)` pairs, all with the same
+    field names. Django has no bulk update, so this is done with a single
+    `UPDATE` of `CASE` expressions on the primary key.
+    """
+    if len(results) == 1:
+        transaction, fields = results[0]
+        return _transition([transaction], from_statuses, to_status, **fields)
+
+    opts = Transaction._meta
+    qn = connection.ops.quote_name
+    pk_column = qn(opts.pk.column)
+    now = timezone.now()
+
+    assignments = []
+    params = []
+    for name in sorted(results[0][1]):
+        field = opts.get_field(name)
+        assignments.append('%s = CASE %s %s END' % (qn(field.column),
+            pk_column, ' '.join(['WHEN %s THEN %s'] * len(results))))
+        for transaction, fields in results:
+            params.extend([transaction.pk, field.get_db_prep_save(
+                fields[name], connection=connection)])
+    for name, value in [('status', to_status), ('modified', now)]:
+        field = opts.get_field(name)
+        assignments.append('%s = %%s' % qn(field.column))
+        params.append(field.get_db_prep_save(value, connection=connection))
+
+    pks = [transaction.pk for transaction, fields in results]
+    params.extend(pks)
+    params.extend(from_statuses)
+    sql = 'UPDATE %s SET %s WHERE %s IN (%s) AND %s IN (%s)' % (
+        qn(opts.db_table), ', '.join(assignments), pk_column,
+        ', '.join(['%s'] * len(pks)), qn(opts.get_field('status').column),
+        ', '.join(['%s'] * len(from_statuses)))
+
+    with utils.atomic():
+        cursor = connection.cursor()
+        cursor.execute(sql, params)
+        db_transaction.set_dirty()
+        if cursor.rowcount != len(pks):
+            raise StatusConflict('Expected %d transactions to be in %s, but '
+                '%d were' % (len(pks), '/'.join(from_statuses),
+                    cursor.rowcount))
+
+    for transaction, fields in results:
+        for name, value in fields.items():
+            setattr(transaction, name, value)
+        transaction.status = to_status
+        transaction.modified = now
+
+    if to_status == 'completed':
+        _summarise([transaction for transaction, fields in results])
 
-    transaction_response = response_xml.find('Payment/TxnList/Txn')
-    # The docs say that this is always 'Yes'. They lie. Sometimes it is 'YES'.
-    transaction.success = transaction_response.find('approved').text.lower() == 'yes'
-    transaction.response_code = transaction_response.findtext('responseCode')
-    transaction.bank_message = transaction_response.findtext('responseText')
+def _send(transaction, request):
+    if dispatch.active():
+        return dispatch.submit(transaction, _send_batch, [transaction],
+            request)
+    return _send_batch([transaction], request)
 
-    transaction.txn_id = transaction_response.findtext('txnID')
-    transaction.preauth_id = transaction_response.findtext('preauthID')
+def _send_batch(transactions, request):
+    """
+    Send a request containing one `<Txn>` per transaction, and update each
+    transaction from its matching `<Txn>` in the response. The `<Txn>`
+    elements are matched up by their `ID` attribute, which is the (1-based)
+    position of the transaction in `transactions`. `request` can also be a
+    function that builds the request, so that building it can be timed.
+
+    The raw response, and the redacted request if `SECUREPAY_LOG_REQUESTS` is
+    set, are saved as <TransactionLog>s rather than on the transaction itself.
+    If `SECUREPAY_SKIP_RECEIVING_STATE` is set, the `'receiving'` status is
+    only written if the response could not be used.
+
+    Timings for each phase are sent to any <metrics> sinks. If the circuit
+    breaker is open nothing is sent, the transactions go back to `'init'`
+    and <CircuitOpen> is raised.
+    """
+    timings = metrics.start(transactions[0].txn_type, len(transactions))
+    try:
+        response = _send_batch_timed(transactions, request, timings)
+    except Exception as e:
+        timings.finish(error=e.__class__.__name__)
+        raise
+
+    timings.finish(status_code=response.status_code,
+        response_codes=[txn.response_code for txn in response.txns])
+    return response
+
+def _send_batch_timed(transactions, request, timings):
+    if callable(request):
+        request = request()
+        timings.lap('build')
+    if isinstance(request, bytes):
+        timings.record(request_bytes=len(request))
+
+    _transition(transactions, ['', 'init'], 'sending')
+
+    if LOG_REQUESTS:
+        TransactionLog.objects.log(transactions, 'request',
+            utils.redact_request(request))
+
+    endpoint = get_endpoint(transactions[0].txn_type)
+    merchant = merchants.get_merchant(transactions[0].merchant)
+    timings.lap('persist')
+
+    try:
+        response_text = client.post_request(endpoint, request,
+            client.get_timeout(transactions[0].txn_type), merchant)
+    except CircuitOpen:
+        # Nothing was sent, so the transactions can safely be tried again
+        _transition(transactions, ['sending'], 'init')
+        raise
+    timings.lap('send')
+    timings.record(response_bytes=len(response_text))
+
+    TransactionLog.objects.log(transactions, 'response', response_text)
+    if not SKIP_RECEIVING_STATE:
+        _transition(transactions, ['sending'], 'receiving')
+    timings.lap('persist')
+
+    try:
+        response = decoder.decode_response(response_text)
+    except ResponseError:
+        # There is no way of knowing if the transactions went through, so
+        # they are left in 'receiving'
+        if SKIP_RECEIVING_STATE:
+            _transition(transactions, ['sending'], 'receiving')
+        raise
+    timings.lap('parse')
+
+    if not response.txns and response.status_code not in (None, '000'):
+        # The whole request was rejected, e.g. for bad merchant details
+        _transition(transactions, IN_FLIGHT, 'completed', success=False,
+            bank_message=response.status_description or '')
+        timings.lap('persist')
+        return response
+
+    if len(transactions) == 1 and len(response.txns) == 1:
+        by_id = {'1': response.txns[0]}
+    else:
+        by_id = dict((txn.id, txn) for txn in response.txns)
+
+    results = []
+    missing = []
+    for txn_id, transaction in enumerate(transactions, 1):
+        txn = by_id.get(str(txn_id))
+        if txn is None:
+            missing.append(transaction)
+        else:
+            results.append((transaction, _response_fields(txn)))
+
+    if missing and SKIP_RECEIVING_STATE:
+        # Left in 'receiving', so they can be looked at by hand
+        _transition(missing, ['sending'], 'receiving')
+    if results:
+        _transition_each(results, IN_FLIGHT, 'completed')
+    timings.lap('persist')
+
+    return response
+
+def _response_fields(txn):
+    """
+    Get the <Transaction> fields to update from a <decoder.TxnResult>
+    """
+    return {
+        # The docs say that this is always 'Yes'. They lie. Sometimes it is
+        # 'YES'.
+        'success': (txn.approved or '').lower() == 'yes',
+        'response_code': txn.response_code or '',
+        'bank_message': txn.response_text or '',
+        'txn_id': txn.txn_id,
+        'preauth_id': txn.preauth_id,
+    }
+
+def allocate():
+    """
+    Allocate a new purchase order number, using the configured
+    <allocators.Allocator>
+    """
+    return allocators.get_allocator().allocate()
 
-    transaction.status = 'completed'
-    transaction.save()
+def _live(transaction):
+    """
+    Get a live <Transaction> to refer to, restoring it from the archive if
+    needed
+    """
+    if transaction.is_archived:
+        from securepay import archive
+        return archive.restore(transaction)
+    return transaction
 
-    return response_xml
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
 
 class TransactionManager(models.Manager):
     """
@@ -58,7 +304,8 @@ class TransactionManager(models.Manager):
     """
 
 
-    def pay(self, amount, credit_card, purchase_order_no='Transaction-%d', data={}):
+    def pay(self, amount, credit_card, purchase_order_no='Transaction-%d', data={},
+        merchant=None):
         """
         Make a payment through SecurePay
 
@@ -67,26 +314,28 @@ class TransactionManager(models.Manager):
             credit_card - A dict of credit card details, usually generated by
                 <securepay.forms.CreditCardForm>.
             data - Any extra data to store with this transaction
+            merchant - The name of the merchant to use. See <merchants>.
 
         Returns:
         A Transaction
         """
+        merchant = merchants.get_merchant(merchant)
         transaction = Transaction(amount=amount,
             txn_type='pay',
+            merchant=merchant.name,
             card_name=credit_card['name'],
             description=data.get('description', ''),
+            purchase_order_no=purchase_order_no % allocate(),
             extra_data=data)
         transaction.save()
 
-        transaction.purchase_order_no=purchase_order_no % transaction.id
-        transaction.save()
-
-        request = client.make_pay_request(merchant, transaction, credit_card)
-        response = _send(transaction, request)
+        _send(transaction, functools.partial(
+            encoder.encode_pay_request, merchant, transaction, credit_card))
 
         return transaction
 
-    def reversal(self, amount=None, data={}):
+    def reversal(self, reference_transaction, amount=None, data={},
+        merchant=None):
         """
         Void a previous transaction in SecurePay
 
@@ -95,15 +344,21 @@ class TransactionManager(models.Manager):
             amount - The amount to void. Defaults to the amount of the
                 reference_transaction
             data - Any extra data to store with this transaction
+            merchant - The name of the merchant to use. Defaults to the
+                merchant of the reference_transaction.
 
         Returns:
         A Transaction
         """
+        reference_transaction = _live(reference_transaction)
         if amount is None:
             amount = reference_transaction.amount
+        merchant = merchants.get_merchant(
+            merchant or reference_transaction.merchant)
 
         transaction = Transaction(amount=amount,
             txn_type='reversal',
+            merchant=merchant.name,
             card_name=reference_transaction.card_name,
             description=data.get('description', ''),
             reference_transaction=reference_transaction,
@@ -111,13 +366,14 @@ class TransactionManager(models.Manager):
             extra_data=data)
         transaction.save()
 
-        request = client.make_void_request(merchant, transaction)
-        response = _send(transaction, request)
+        _send(transaction, functools.partial(
+            encoder.encode_void_request, merchant, transaction))
 
         return transaction
 
 
-    def refund(self, reference_transaction, amount=None, data={}):
+    def refund(self, reference_transaction, amount=None, data={},
+        merchant=None):
         """
         Refund a previous transaction in SecurePay
 
@@ -126,15 +382,21 @@ class TransactionManager(models.Manager):
             amount - The amount to refund. Defaults to the amount of the
                 reference_transaction
             data - Any extra data to store with this transaction
+            merchant - The name of the merchant to use. Defaults to the
+                merchant of the reference_transaction.
 
         Returns:
         A Transaction
         """
+        reference_transaction = _live(reference_transaction)
         if amount is None:
             amount = reference_transaction.amount
+        merchant = merchants.get_merchant(
+            merchant or reference_transaction.merchant)
 
         transaction = Transaction(amount=amount,
             txn_type='refund',
+            merchant=merchant.name,
             card_name=reference_transaction.card_name,
             description=data.get('description', ''),
             reference_transaction=reference_transaction,
@@ -142,12 +404,13 @@ class TransactionManager(models.Manager):
             extra_data=data)
         transaction.save()
 
-        request = client.make_refund_request(merchant, transaction)
-        response = _send(transaction, request)
+        _send(transaction, functools.partial(
+            encoder.encode_refund_request, merchant, transaction))
 
         return transaction
 
-    def preauth(self, amount, credit_card, purchase_order_no='Transaction-%d', data={}):
+    def preauth(self, amount, credit_card, purchase_order_no='Transaction-%d',
+        data={}, merchant=None):
         """
         Preauthorise a payment on a credit card, but do not actually take any
         money. Money is taken in the <complete> method, below
@@ -157,26 +420,28 @@ class TransactionManager(models.Manager):
             credit_card - A dict of credit card details, usually generated by
                 <securepay.forms.CreditCardForm>.
             data - Any extra data to store with this transaction
+            merchant - The name of the merchant to use. See <merchants>.
 
         Returns:
         A Transaction
         """
+        merchant = merchants.get_merchant(merchant)
         transaction = Transaction(amount=amount,
             txn_type='preauth',
+            merchant=merchant.name,
             card_name=credit_card['name'],
             description=data.get('description', ''),
+            purchase_order_no=purchase_order_no % allocate(),
             extra_data=data)
         transaction.save()
 
-        transaction.purchase_order_no=purchase_order_no % transaction.id
-        transaction.save()
-
-        request = client.make_preauth_request(merchant, transaction, credit_card)
-        response = _send(transaction, request)
+        _send(transaction, functools.partial(
+            encoder.encode_preauth_request, merchant, transaction, credit_card))
 
         return transaction
 
-    def complete(self, reference_transaction, amount=None, data={}):
+    def complete(self, reference_transaction, amount=None, data={},
+        merchant=None):
         """
         Complete a previous preauthorize transaction, taking the reserved money
 
@@ -188,15 +453,21 @@ class TransactionManager(models.Manager):
                 to the customers card.  Defaults to the amount of the
                 reference_transaction.
             data - Any extra data to store with this transaction
+            merchant - The name of the merchant to use. Defaults to the
+                merchant of the reference_transaction.
 
         Returns:
         A Transaction
         """
+        reference_transaction = _live(reference_transaction)
         if amount is None:
             amount = reference_transaction.amount
+        merchant = merchants.get_merchant(
+            merchant or reference_transaction.merchant)
 
         transaction = Transaction(amount=amount,
             txn_type='complete',
+            merchant=merchant.name,
             card_name=reference_transaction.card_name,
             description=data.get('description', ''),
             reference_transaction=reference_transaction,
@@ -204,14 +475,14 @@ class TransactionManager(models.Manager):
             extra_data=data)
         transaction.save()
 
-        request = client.make_complete_request(merchant, transaction)
-        response = _send(transaction, request)
+        _send(transaction, functools.partial(
+            encoder.encode_complete_request, merchant, transaction))
 
         return transaction
 
 
     def direct_credit(self, amount, bank_details, data={},
-        purchase_order_no='Transfer %s'):
+        purchase_order_no='Transfer %s', merchant=None):
         """
         Credit another bank account, transferring money directly out of our
         linked account.
@@ -221,28 +492,28 @@ class TransactionManager(models.Manager):
             bank_details - A dict of bank account details, usually generated by
                 <securepay.forms.BankAccountForm> or <BankAccount>.
             data - Any extra data to store with this direct transfer
+            merchant - The name of the merchant to use. See <merchants>.
 
         Returns:
         A Transaction
         """
+        merchant = merchants.get_merchant(merchant)
         transaction = Transaction(amount=amount,
             txn_type='credit',
+            merchant=merchant.name,
             card_name=bank_details['name'],
             description=data.get('description', ''),
+            purchase_order_no=purchase_order_no % allocate(),
             extra_data=data)
         transaction.save()
 
-        transaction.purchase_order_no=purchase_order_no % transaction.id
-        transaction.save()
-
-        request = client.make_direct_credit_request(merchant, transaction,
-            bank_details)
-        response = _send(transaction, request)
+        _send(transaction, functools.partial(
+            encoder.encode_direct_credit_request, merchant, transaction, bank_details))
 
         return transaction
 
     def direct_debit(self, amount, bank_details, data={},
-        purchase_order_no='Transfer %s'):
+        purchase_order_no='Transfer %s', merchant=None):
         """
         Take money from another bank account, transferring the money directly in
         to out linked account.
@@ -252,26 +523,178 @@ class TransactionManager(models.Manager):
             bank_details - A dict of bank account details, usually generated by
                 <securepay.forms.BankAccountForm> or <BankAccount>.
             data - Any extra data to store with this direct transfer
+            merchant - The name of the merchant to use. See <merchants>.
 
         Returns:
         A Transaction
         """
+        merchant = merchants.get_merchant(merchant)
         transaction = Transaction(amount=amount,
             txn_type='debit',
+            merchant=merchant.name,
             card_name=bank_details['name'],
             description=data.get('description', ''),
+            purchase_order_no=purchase_order_no % allocate(),
             extra_data=data)
         transaction.save()
 
-        transaction.purchase_order_no=purchase_order_no % transaction.id
-        transaction.save()
-
-        request = client.make_direct_debit_request(merchant, transaction,
-            bank_details)
-        response = _send(transaction, request)
+        _send(transaction, functools.partial(
+            encoder.encode_direct_debit_request, merchant, transaction, bank_details))
 
         return transaction
 
+    def find(self, **kwargs):
+        """
+        Find transactions by exact field values, such as `purchase_order_no`
+        or `txn_id`, in both the live and archive tables. Returns a list of
+        <Transaction>s followed by any <ArchivedTransaction>s.
+        """
+        return list(self.filter(**kwargs)) \
+            + list(ArchivedTransaction.objects.filter(**kwargs))
+
+    def dispatched(self, callback=None, wait=dispatch.WAIT):
+        """
+        Get a version of this manager whose <pay>, <refund> and other single
+        transaction methods save the transaction and return straight away
+        with a <dispatch.Handle>, sending it to SecurePay on a thread pool.
+
+        Parameters:
+            callback - Called with the completed transaction, in the worker.
+                If it returns `True` or `False`, that is saved as
+                <Transaction.processed>.
+            wait - Seconds to wait for room in the pool before raising
+                <PoolSaturated>.
+        """
+        return dispatch.Dispatcher(self, callback, wait)
+
+    def with_data(self, **kwargs):
+        """
+        Find transactions by the values in their `extra_data`. Only keys listed
+        in `SECUREPAY_INDEXED_DATA_KEYS` can be searched on.
+
+            Transaction.objects.with_data(order_id=1234)
+        """
+        queryset = self.get_query_set()
+        for key, value in kwargs.items():
+            if key not in INDEXED_DATA_KEYS:
+                raise ValueError("%s is not in SECUREPAY_INDEXED_DATA_KEYS"
+                    % key)
+            matching = TransactionData.objects.filter(key=key,
+                value=unicode(value))
+            queryset = queryset.filter(
+                pk__in=matching.values('transaction_id'))
+        return queryset
+
+    def refund_many(self, reference_transactions, data={}, merchant=None):
+        """
+        Refund many previous transactions in full, packing up to
+        `SECUREPAY_MAX_BATCH_SIZE` refunds in to each request to SecurePay.
+
+        Parameters:
+            reference_transactions - The transactions to refund.
+            data - Any extra data to store with each refund
+            merchant - The name of the merchant to use. Defaults to the
+                merchant of each reference transaction.
+
+        Returns:
+        A list of Transactions
+        """
+        return self._referenced_many('refund', reference_transactions,
+            encoder.encode_refund_txn, data, merchant)
+
+    def reversal_many(self, reference_transactions, data={}, merchant=None):
+        """
+        Void many previous transactions in full. See <refund_many>.
+        """
+        return self._referenced_many('reversal', reference_transactions,
+            encoder.encode_void_txn, data, merchant)
+
+    def direct_credit_many(self, transfers, data={},
+        purchase_order_no='Transfer %s', merchant=None):
+        """
+        Credit many bank accounts, packing up to `SECUREPAY_MAX_BATCH_SIZE`
+        transfers in to each request to SecurePay.
+
+        Parameters:
+            transfers - An iterable of `(bank_details, amount)` pairs.
+            data - Any extra data to store with each direct transfer
+            merchant - The name of the merchant to use. See <merchants>.
+
+        Returns:
+        A list of Transactions
+        """
+        return self._direct_many('credit', transfers,
+            encoder.encode_direct_credit_txn, data, purchase_order_no, merchant)
+
+    def direct_debit_many(self, transfers, data={},
+        purchase_order_no='Transfer %s', merchant=None):
+        """
+        Debit many bank accounts. See <direct_credit_many>.
+        """
+        return self._direct_many('debit', transfers,
+            encoder.encode_direct_debit_txn, data, purchase_order_no, merchant)
+
+    def _referenced_many(self, txn_type, reference_transactions, make_txn,
+        data, merchant):
+        transactions = []
+        for reference_transaction in reference_transactions:
+            reference_transaction = _live(reference_transaction)
+            transaction = Transaction(amount=reference_transaction.amount,
+                txn_type=txn_type,
+                merchant=merchants.get_merchant(
+                    merchant or reference_transaction.merchant).name,
+                card_name=reference_transaction.card_name,
+                description=data.get('description', ''),
+                reference_transaction=reference_transaction,
+                purchase_order_no=reference_transaction.purchase_order_no,
+                extra_data=data)
+            transaction.save()
+            transactions.append(transaction)
+
+        self._send_many(transactions, lambda transaction, txn_id:
+            make_txn(transaction, txn_id))
+        return transactions
+
+    def _direct_many(self, txn_type, transfers, make_txn, data,
+        purchase_order_no, merchant):
+        merchant = merchants.get_merchant(merchant)
+        transfers = list(transfers)
+        numbers = allocators.get_allocator().allocate_many(len(transfers))
+
+        transactions = []
+        bank_details = {}
+        for (details, amount), number in zip(transfers, numbers):
+            transaction = Transaction(amount=amount,
+                txn_type=txn_type,
+                merchant=merchant.name,
+                card_name=details['name'],
+                description=data.get('description', ''),
+                purchase_order_no=purchase_order_no % number,
+                extra_data=data)
+            transaction.save()
+
+            transactions.append(transaction)
+            bank_details[transaction.id] = details
+
+        self._send_many(transactions, lambda transaction, txn_id:
+            make_txn(transaction, bank_details[transaction.id], txn_id))
+        return transactions
+
+    def _send_many(self, transactions, make_txn):
+        by_merchant = {}
+        for transaction in transactions:
+            by_merchant.setdefault(transaction.merchant, []) \
+                .append(transaction)
+
+        for name, transactions in by_merchant.items():
+            merchant = merchants.get_merchant(name)
+            for batch in _chunks(transactions, client.MAX_BATCH_SIZE):
+                txns = [make_txn(transaction, txn_id)
+                    for txn_id, transaction in enumerate(batch, 1)]
+                _send_batch(batch, functools.partial(
+                    encoder.encode_batch_request, merchant, txns,
+                    timeout=client.get_timeout(batch[0].txn_type)))
+
 
 class Transaction(models.Model):
     """
@@ -290,7 +713,9 @@ class Transaction(models.Model):
         description - The description of the transaction as it appears on a bank
             statement.
 
-        extra_data - Any extra data associated with the transaction.
+        extra_data - Any extra data associated with the transaction, stored
+            as JSON. Keys listed in `SECUREPAY_INDEXED_DATA_KEYS` are also
+            saved as <TransactionData>, so they can be searched on.
 
         status - Current status of the transaction. This is only used while a
             transaction is currently being processed. All transactions which
@@ -304,6 +729,10 @@ class Transaction(models.Model):
         success - If the SecurePay indicated that the transaction was
             successful.
 
+        response_text - Legacy storage for the raw response from SecurePay.
+            Responses are now stored as <TransactionLog>s, and are available
+            through <raw_response>.
+
         response_code - The response code from the bank. See the documentation
             for possible values.
 
@@ -312,17 +741,23 @@ class Transaction(models.Model):
         reference_transaction - The transaction that refund, void or complete
             transactions refer to. Not used by pay and preauth transactions.
 
+        merchant - The name of the merchant account the transaction was
+            made with. See <securepay.merchants>.
+
         txn_id - The transaction ID from the bank.
 
         preauth_id - The preauth ID from the bank, used in complete
             transactions. Only used in preauth transactions.
     """
 
-    created = models.DateTimeField(auto_now_add=True)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
     modified = models.DateTimeField(auto_now=True)
 
     purchase_order_no = models.CharField(max_length=60, db_index=True)
 
+    merchant = models.CharField(max_length=50,
+        default=merchants.DEFAULT_MERCHANT, db_index=True)
+
     card_name = models.CharField(max_length=255)
 
     txn_type = models.CharField(max_length=10, choices=[
@@ -338,12 +773,13 @@ class Transaction(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     description = models.CharField(max_length=25)
 
-    extra_data = PickledObjectField()
+    extra_data = JSONField(default=dict)
 
-    status = models.CharField(max_length=10, choices=[
+    status = models.CharField(max_length=10, default='init', choices=[
         ('init', 'Initializing'),
         ('sending', 'Sending request to SecurePay'),
         ('receiving', 'Receiving transaction information from SecurePay'),
+        ('resolving', 'Asking SecurePay what happened to the transaction'),
         ('completed', 'Transaction has completed'),
     ])
     processed = models.NullBooleanField()
@@ -354,15 +790,58 @@ class Transaction(models.Model):
     bank_message = models.CharField(max_length=255, blank=True)
 
     reference_transaction = models.ForeignKey('self', related_name='referenced_by', blank=True, null=True, on_delete=models.SET_NULL)
-    txn_id = models.CharField(max_length=10, blank=True, null=True)
-    preauth_id = models.CharField(max_length=10, blank=True, null=True)
+    txn_id = models.CharField(max_length=10, blank=True, null=True,
+        db_index=True)
+    preauth_id = models.CharField(max_length=10, blank=True, null=True,
+        db_index=True)
 
     debug = models.BooleanField(default=settings.SECUREPAY_DEBUG)
 
+    is_archived = False
+
     objects = TransactionManager()
 
     class Meta:
         ordering = ['-created']
+        # Migration 0010 also adds these indexes, which Django can not
+        # describe on the model:
+        #  * (txn_type, success, created), for reporting and reconciliation
+        #  * (reference_transaction, txn_type), for finding refunds etc.
+        #  * (status, modified) for transactions that are not 'completed'
+        #    only, for finding stuck transactions
+
+    def save(self, *args, **kwargs):
+        created = self.pk is None
+        super(Transaction, self).save(*args, **kwargs)
+        if created:
+            TransactionData.objects.index([self])
+
+    @property
+    def raw_response(self):
+        """
+        The raw XML response from SecurePay. This is loaded from the
+        <TransactionLog> table when first accessed.
+        """
+        if not hasattr(self, '_raw_response'):
+            self._raw_response = self.get_log('response') \
+                or self.response_text
+        return self._raw_response
+
+    @property
+    def raw_request(self):
+        """
+        The redacted XML request sent to SecurePay, if
+        `SECUREPAY_LOG_REQUESTS` was set when it was sent
+        """
+        if not hasattr(self, '_raw_request'):
+            self._raw_request = self.get_log('request')
+        return self._raw_request
+
+    def get_log(self, kind):
+        try:
+            return self.logs.get(kind=kind).text
+        except TransactionLog.DoesNotExist:
+            return ''
 
     def __unicode__(self):
         return "%s %s for $%0.2f on %s by %s" % (
@@ -374,6 +853,352 @@ class Transaction(models.Model):
         );
 
 
+class TransactionDataManager(models.Manager):
+    def index(self, transactions):
+        """
+        Save the `SECUREPAY_INDEXED_DATA_KEYS` keys from the `extra_data` of
+        some new transactions
+        """
+        if not INDEXED_DATA_KEYS:
+            return
+
+        self.bulk_create([
+            TransactionData(transaction=transaction, key=key,
+                value=unicode(transaction.extra_data[key])[:255])
+            for transaction in transactions
+            if isinstance(transaction.extra_data, dict)
+            for key in INDEXED_DATA_KEYS
+            if transaction.extra_data.get(key) is not None])
+
+
+class TransactionData(models.Model):
+    """
+    A copy of one of the `SECUREPAY_INDEXED_DATA_KEYS` from the `extra_data`
+    of a transaction, so that transactions can be found by their extra data
+    in the database. See <TransactionManager.with_data>.
+    """
+    transaction = models.ForeignKey(Transaction, related_name='data_keys')
+    key = models.CharField(max_length=50)
+    value = models.CharField(max_length=255, db_index=True)
+
+    objects = TransactionDataManager()
+
+    class Meta:
+        unique_together = [('transaction', 'key')]
+
+    def __unicode__(self):
+        return "%s=%s" % (self.key, self.value)
+
+
+class TransactionLogManager(models.Manager):
+    def log(self, transactions, kind, text):
+        """
+        Save the same `text` as a log of `kind` against every transaction,
+        replacing any log of that kind from an earlier attempt at sending it
+        """
+        data = utils.compress_text(text)
+        self.filter(kind=kind, transaction__in=[
+            transaction.pk for transaction in transactions]).delete()
+        self.bulk_create([
+            TransactionLog(transaction=transaction, kind=kind, data=data)
+            for transaction in transactions])
+
+
+class TransactionLog(models.Model):
+    """
+    A compressed copy of a raw request to or response from SecurePay. These
+    are kept out of the <Transaction> table so that it stays small, and are
+    only loaded when they are asked for.
+
+    Fields:
+        transaction - The transaction this is a log for.
+
+        kind - `'request'` or `'response'`.
+
+        data - The zlib compressed, base64 encoded XML.
+    """
+    transaction = models.ForeignKey(Transaction, related_name='logs')
+    kind = models.CharField(max_length=10, choices=[
+        ('request', 'Request'),
+        ('response', 'Response'),
+    ])
+    created = models.DateTimeField(auto_now_add=True)
+    data = models.TextField()
+
+    objects = TransactionLogManager()
+
+    class Meta:
+        unique_together = [('transaction', 'kind')]
+
+    @property
+    def text(self):
+        return utils.decompress_text(self.data)
+
+    def __unicode__(self):
+        return "%s for %s" % (self.get_kind_display(), self.transaction_id)
+
+
+class PurchaseOrderSequence(models.Model):
+    """
+    A counter that purchase order numbers are reserved from by
+    <allocators.HiLoAllocator>
+    """
+    name = models.CharField(max_length=50, unique=True)
+    next_value = models.BigIntegerField(default=1)
+
+    def __unicode__(self):
+        return "%s: %d" % (self.name, self.next_value)
+
+
+class ArchivedTransaction(models.Model):
+    """
+    A completed <Transaction> moved out of the live table by
+    <securepay.archive>. It keeps its ID, and has the same fields, except
+    that:
+
+        reference_transaction_id - A plain column, as the referenced
+            transaction may be live or archived. <reference_transaction>
+            looks in both.
+
+        response_log, request_log - The transaction's <TransactionLog>s,
+            still compressed.
+
+        archived - When the transaction was archived.
+
+    Use <Transaction.objects.find> to look transactions up in both tables.
+    """
+    is_archived = True
+
+    id = models.IntegerField(primary_key=True)
+    created = models.DateTimeField(db_index=True)
+    modified = models.DateTimeField()
+    archived = models.DateTimeField(auto_now_add=True)
+
+    purchase_order_no = models.CharField(max_length=60, db_index=True)
+    merchant = models.CharField(max_length=50, db_index=True)
+    card_name = models.CharField(max_length=255)
+    txn_type = models.CharField(max_length=10,
+        choices=Transaction._meta.get_field('txn_type').choices)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    description = models.CharField(max_length=25)
+    extra_data = JSONField(default=dict)
+
+    status = models.CharField(max_length=10)
+    processed = models.NullBooleanField()
+    success = models.NullBooleanField()
+    response_code = models.CharField(max_length=3, blank=True)
+    bank_message = models.CharField(max_length=255, blank=True)
+
+    reference_transaction_id = models.IntegerField(blank=True, null=True,
+        db_index=True)
+    txn_id = models.CharField(max_length=10, blank=True, null=True,
+        db_index=True)
+    preauth_id = models.CharField(max_length=10, blank=True, null=True,
+        db_index=True)
+    debug = models.BooleanField()
+
+    response_log = models.TextField(blank=True)
+    request_log = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['-created']
+
+    @property
+    def reference_transaction(self):
+        if self.reference_transaction_id is None:
+            return None
+        for model in [Transaction, ArchivedTransaction]:
+            try:
+                return model.objects.get(pk=self.reference_transaction_id)
+            except model.DoesNotExist:
+                pass
+        return None
+
+    @property
+    def raw_response(self):
+        return utils.decompress_text(self.response_log) \
+            if self.response_log else ''
+
+    @property
+    def raw_request(self):
+        return utils.decompress_text(self.request_log) \
+            if self.request_log else ''
+
+    def __unicode__(self):
+        return "Archived %s %s for $%0.2f on %s" % (
+            {True: 'successful', False: 'unsuccessful', None: 'unfinished'}[
+                self.success],
+            self.get_txn_type_display(),
+            self.amount,
+            self.created.strftime("%d/%m/%Y"),
+        )
+
+
+def _local_date(value):
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return value.date()
+
+def _day_start(day):
+    start = datetime.datetime.combine(day, datetime.time.min)
+    if settings.USE_TZ:
+        start = timezone.make_aware(start, timezone.get_current_timezone())
+    return start
+
+
+class DailySummaryManager(models.Manager):
+    #: The totals kept for each day
+    TOTALS = ['transactions', 'successful', 'amount', 'successful_amount']
+
+    def record(self, transactions):
+        """
+        Add some newly completed transactions to the totals. Each affected
+        summary row is updated in place with a single `UPDATE`. Inside a
+        transaction the totals are added in a savepoint, so if they fail the
+        caller's transaction can still be committed.
+        """
+        totals = {}
+        for transaction in transactions:
+            key = (_local_date(transaction.created), transaction.txn_type,
+                transaction.merchant, transaction.debug)
+            row = totals.setdefault(key, [0, 0, Decimal('0'), Decimal('0')])
+            row[0] += 1
+            row[2] += transaction.amount
+            if transaction.success:
+                row[1] += 1
+                row[3] += transaction.amount
+
+        with utils.atomic():
+            for (date, txn_type, merchant, debug), row in totals.items():
+                self._add(dict(date=date, txn_type=txn_type,
+                    merchant=merchant, debug=debug),
+                    dict(zip(self.TOTALS, row)))
+
+    def _add(self, key, increments):
+        rows = self.filter(**key)
+        changes = dict((name, F(name) + value)
+            for name, value in increments.items())
+        if rows.update(**changes):
+            return
+
+        try:
+            with utils.atomic():
+                self.create(**dict(key, **increments))
+        except IntegrityError:
+            # Someone else made it first
+            rows.update(**changes)
+
+    def rebuild(self, day):
+        """
+        Recalculate the totals for one day from the <Transaction> and
+        <ArchivedTransaction> tables
+        """
+        group_by = ['txn_type', 'merchant', 'debug']
+        rows = {}
+        for model in [Transaction, ArchivedTransaction]:
+            completed = model.objects.filter(status='completed',
+                created__gte=_day_start(day),
+                created__lt=_day_start(day + datetime.timedelta(days=1)))
+
+            for row in completed.values(*group_by).order_by() \
+                    .annotate(count=Count('pk'), total=Sum('amount')):
+                key = tuple(row[name] for name in group_by)
+                totals = rows.setdefault(key, [0, 0, Decimal('0'),
+                    Decimal('0')])
+                totals[0] += row['count']
+                totals[2] += row['total']
+            for row in completed.filter(success=True).values(*group_by) \
+                    .order_by() \
+                    .annotate(count=Count('pk'), total=Sum('amount')):
+                key = tuple(row[name] for name in group_by)
+                rows[key][1] += row['count']
+                rows[key][3] += row['total']
+
+        with utils.atomic():
+            self.filter(date=day).delete()
+            self.bulk_create([
+                DailySummary(date=day, txn_type=txn_type, merchant=merchant,
+                    debug=debug, **dict(zip(self.TOTALS, totals)))
+                for (txn_type, merchant, debug), totals in rows.items()])
+
+    def totals(self, start=None, end=None, group_by=('date', 'txn_type'),
+        **filters):
+        """
+        Get totals from the summaries, between the dates `start` and `end`
+        inclusive, grouped by any of `date`, `txn_type`, `merchant` and
+        `debug`. Other keyword arguments filter the summaries, e.g.
+        `txn_type='refund'` for refund volume.
+
+        Returns:
+        A list of dicts of the `group_by` fields, the summed totals and the
+        `success_rate`
+        """
+        summaries = self.filter(**filters)
+        if start is not None:
+            summaries = summaries.filter(date__gte=start)
+        if end is not None:
+            summaries = summaries.filter(date__lte=end)
+
+        rows = summaries.values(*group_by).order_by(*group_by) \
+            .annotate(*[Sum(name) for name in self.TOTALS])
+
+        results = []
+        for row in rows:
+            result = dict((name, row[name]) for name in group_by)
+            for name in self.TOTALS:
+                result[name] = row[name + '__sum']
+            result['success_rate'] = (float(result['successful'])
+                / result['transactions'] if result['transactions'] else None)
+            results.append(result)
+        return results
+
+
+class DailySummary(models.Model):
+    """
+    Running totals of the completed transactions for a day, so that reports
+    never have to aggregate the <Transaction> table. Kept up to date as each
+    transaction completes. Use <DailySummaryManager.totals> to query them.
+
+    Fields:
+        date - The local date the transactions were created on.
+
+        txn_type, merchant, debug - As on <Transaction>.
+
+        transactions, amount - The number and total amount of the
+            completed transactions.
+
+        successful, successful_amount - The same, for only the successful
+            transactions.
+    """
+    date = models.DateField()
+    txn_type = models.CharField(max_length=10)
+    merchant = models.CharField(max_length=50)
+    debug = models.BooleanField()
+
+    transactions = models.PositiveIntegerField(default=0)
+    successful = models.PositiveIntegerField(default=0)
+    amount = models.DecimalField(max_digits=14, decimal_places=2,
+        default=0)
+    successful_amount = models.DecimalField(max_digits=14, decimal_places=2,
+        default=0)
+
+    objects = DailySummaryManager()
+
+    class Meta:
+        ordering = ['-date', 'txn_type']
+        unique_together = [('date', 'txn_type', 'merchant', 'debug')]
+        verbose_name_plural = 'daily summaries'
+
+    @property
+    def success_rate(self):
+        if not self.transactions:
+            return None
+        return float(self.successful) / self.transactions
+
+    def __unicode__(self):
+        return "%s %s for %s" % (self.date, self.txn_type, self.merchant)
+
+
 class BankAccount(models.Model):
     name = models.CharField(max_length=32)
     bsb = models.CharField(max_length=6)
@@ -0,0 +1,208 @@
+"""
+Bulk direct entry payouts.
+
+    for progress in payout('2026-10-payroll', accounts, amount=Decimal('50')):
+        print(progress)
+
+pays each <BankAccount> by direct credit (or takes money from it by direct
+debit). The transactions for each chunk of accounts are created with a single
+`bulk_create`. They are sent up to `SECUREPAY_MAX_BATCH_SIZE` to a request,
+with up to `workers` requests in flight at once. Results are written back
+with one `UPDATE` per request, and a <Progress> is yielded as each request
+finishes.
+
+Every transaction in a run gets a purchase order number made from the run
+name and the account's primary key. If a run dies part way through, calling
+<payout> again with the same name and accounts picks up where it left off.
+Accounts already paid are skipped. Transactions created but never sent are
+sent. Transactions left in flight are left for <securepay.reconciler>. An
+account can only be paid once per run: while the transactions for a chunk
+are created, its accounts are locked with `SELECT ... FOR UPDATE`, so two
+attempts at the same run can not both create them.
+
+The transactions are sent from worker threads, which can only see them once
+they are committed, so do not call <payout> inside a database transaction.
+"""
+import logging
+from collections import namedtuple
+
+import requests
+from django.conf import settings
+from django.db import connection
+
+from securepay import client
+from securepay import encoder
+from securepay import merchants
+from securepay import utils
+from securepay.exceptions import SecurePayError, StatusConflict
+from securepay.models import BankAccount, Transaction, TransactionData, \
+    _chunks, _send_batch
+
+logger = logging.getLogger(__name__)
+
+#: Requests to SecurePay in flight at once during a payout
+WORKERS = getattr(settings, 'SECUREPAY_PAYOUT_WORKERS', 4)
+
+#: Accounts read, and transactions created, at a time
+CHUNK_SIZE = getattr(settings, 'SECUREPAY_PAYOUT_CHUNK_SIZE', 1000)
+
+PURCHASE_ORDER_NO = 'Payout %s-%s'
+
+#: The largest <BankAccount> ID a run name must leave room for
+MAX_ACCOUNT_ID = 2 ** 31 - 1
+
+#: Running totals for a payout. `created` transactions were made by this
+#: call, and `skipped` ones were already completed or in flight from an
+#: earlier attempt. Of those sent, `approved` and `declined` were completed,
+#: and `failed` could not be sent or their outcome is unknown.
+Progress = namedtuple('Progress', ['created', 'skipped', 'sent', 'approved',
+    'declined', 'failed'])
+
+ENCODERS = {
+    'credit': encoder.encode_direct_credit_txn,
+    'debit': encoder.encode_direct_debit_txn,
+}
+
+
+def payout(run, items, amount=None, txn_type='credit', data={},
+    merchant=None, workers=WORKERS, chunk_size=CHUNK_SIZE):
+    """
+    Pay out to many bank accounts, yielding a <Progress> after each request.
+
+    Parameters:
+        run - A name for this payout, used to resume it. Must be short enough
+            to fit in a purchase order number along with an account ID.
+        items - An iterable of `(BankAccount, amount)` pairs, or of
+            <BankAccount>s if `amount` is given. Querysets are iterated
+            without caching.
+        amount - The amount to pay every account, in dollars.
+        txn_type - `'credit'` to pay the accounts, or `'debit'` to take money
+            from them.
+        data - Any extra data to store with each transaction.
+        merchant - The name of the merchant to use. See <merchants>.
+        workers - Requests to send at once.
+        chunk_size - Accounts to create transactions for at a time.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    if txn_type not in ENCODERS:
+        raise ValueError('txn_type must be credit or debit, not %s' % txn_type)
+    max_length = Transaction._meta.get_field('purchase_order_no').max_length
+    if len(PURCHASE_ORDER_NO % (run, MAX_ACCOUNT_ID)) > max_length:
+        raise ValueError('Run name %r is too long to fit in a purchase order '
+            'number' % run)
+    merchant = merchants.get_merchant(merchant)
+
+    if hasattr(items, 'iterator'):
+        items = items.iterator()
+    if amount is not None:
+        items = ((account, amount) for account in items)
+
+    totals = dict.fromkeys(Progress._fields, 0)
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for chunk in _read_chunks(items, chunk_size):
+            batches = _prepare(run, chunk, txn_type, data, merchant, totals)
+            futures = [executor.submit(_send, batch, details, txn_type,
+                merchant) for batch, details in batches]
+            for future in as_completed(futures):
+                for name, count in future.result().items():
+                    totals[name] += count
+                yield Progress(**totals)
+    finally:
+        executor.shutdown(wait=True)
+
+def _read_chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _prepare(run, chunk, txn_type, data, merchant, totals):
+    """
+    Create the transactions for a chunk of accounts, and find those left
+    unsent by an earlier attempt. Returns a list of `(transactions, bank
+    details by purchase order number)` batches to send.
+    """
+    with utils.atomic():
+        return _prepare_locked(run, chunk, txn_type, data, merchant, totals)
+
+def _prepare_locked(run, chunk, txn_type, data, merchant, totals):
+    # Held until the new transactions are committed, so a concurrent attempt
+    # at the same run waits, and then sees them
+    list(BankAccount.objects.select_for_update()
+        .filter(pk__in=[account.pk for account, amount in chunk])
+        .order_by('pk').values_list('pk', flat=True))
+
+    details = {}
+    amounts = {}
+    for account, amount in chunk:
+        number = PURCHASE_ORDER_NO % (run, account.pk)
+        details[number] = {'name': account.name, 'bsb': account.bsb,
+            'account_number': account.account_number}
+        amounts[number] = amount
+
+    existing = Transaction.objects.filter(txn_type=txn_type,
+        purchase_order_no__in=list(details))
+    existing_numbers = set()
+    for number, status in existing.values_list('purchase_order_no', 'status'):
+        existing_numbers.add(number)
+        if status not in ('', 'init'):
+            totals['skipped'] += 1
+
+    new = [Transaction(amount=amounts[number],
+            txn_type=txn_type,
+            merchant=merchant.name,
+            card_name=details[number]['name'],
+            description=data.get('description', ''),
+            purchase_order_no=number,
+            extra_data=data)
+        for number in details if number not in existing_numbers]
+    Transaction.objects.bulk_create(new)
+    totals['created'] += len(new)
+
+    # <bulk_create> does not set primary keys, so fetch everything that
+    # still needs sending again
+    unsent = list(Transaction.objects.filter(txn_type=txn_type,
+        purchase_order_no__in=list(details), status__in=['', 'init'])
+        .order_by('pk'))
+    created = set(transaction.purchase_order_no for transaction in new)
+    TransactionData.objects.index([transaction for transaction in unsent
+        if transaction.purchase_order_no in created])
+    return [(batch, details)
+        for batch in _chunks(unsent, client.MAX_BATCH_SIZE)]
+
+def _send(transactions, details, txn_type, merchant):
+    """
+    Send one batch, in a worker thread, and count the outcomes
+    """
+    make_txn = ENCODERS[txn_type]
+    txns = [make_txn(transaction, details[transaction.purchase_order_no],
+            txn_id)
+        for txn_id, transaction in enumerate(transactions, 1)]
+
+    counts = {'sent': len(transactions)}
+    try:
+        _send_batch(transactions, lambda: encoder.encode_batch_request(
+            merchant, txns, timeout=client.get_timeout(txn_type)))
+    except StatusConflict:
+        # Another attempt at the same run got to them first
+        return {'skipped': len(transactions)}
+    except (SecurePayError, requests.RequestException):
+        logger.exception("Payout batch of %d failed", len(transactions))
+        counts['failed'] = len(transactions)
+        return counts
+    finally:
+        connection.close()
+
+    counts['approved'] = sum(1 for transaction in transactions
+        if transaction.status == 'completed' and transaction.success)
+    counts['declined'] = sum(1 for transaction in transactions
+        if transaction.status == 'completed' and not transaction.success)
+    counts['failed'] = len(transactions) - counts['approved'] \
+        - counts['declined']
+    return counts
@@ -0,0 +1,233 @@
+"""
+Echo requests, for keeping connections to SecurePay warm and measuring how
+long SecurePay itself takes to respond.
+
+<warm_up> sends an `Echo` to every endpoint for every merchant, opening
+pooled connections before the first real transaction needs them. Call it
+once a worker process has started. <start_prober> does the same every
+`SECUREPAY_PROBE_INTERVAL` seconds in a background thread, which keeps the
+connections from going idle. It must be started after the process has
+forked, as threads do not survive a fork. `manage.py securepay_probe` runs
+the prober in the foreground and prints the latencies.
+
+The round trip time of every echo is kept in a <RollingHistogram> per
+endpoint, available from <get_histogram>. Only the HTTP round trip is timed,
+not waiting for the merchant's rate limit, and an echo involves no database
+work and almost no processing, so these times are the gateway's latency
+alone.
+Echoes are also reported to any <metrics> sinks, with a `txn_type` of
+`'echo'`.
+"""
+import bisect
+import logging
+import threading
+import time
+from collections import deque
+
+import requests
+from django.conf import settings
+
+from securepay import client
+from securepay import decoder
+from securepay import encoder
+from securepay import merchants
+from securepay import metrics
+from securepay.exceptions import ResponseError, SecurePayError
+from securepay.models import URL_TYPE_MAP, get_endpoint
+
+logger = logging.getLogger(__name__)
+
+#: Seconds between probes. This should be less than `SECUREPAY_POOL_KEEPALIVE`
+#: so that pooled sessions never go idle.
+PROBE_INTERVAL = getattr(settings, 'SECUREPAY_PROBE_INTERVAL', 30)
+
+#: Seconds of round trip times kept in each histogram
+HISTOGRAM_WINDOW = getattr(settings, 'SECUREPAY_PROBE_WINDOW', 600)
+
+#: Upper bounds of the histogram buckets, in milliseconds
+HISTOGRAM_BUCKETS = [25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+class RollingHistogram(object):
+    """
+    Round trip times from the last `window` seconds. Safe to share between
+    threads.
+    """
+    def __init__(self, window=HISTOGRAM_WINDOW, buckets=HISTOGRAM_BUCKETS,
+        max_samples=10000):
+        self.window = window
+        self.buckets = list(buckets)
+        self.samples = deque(maxlen=max_samples)
+        self.lock = threading.Lock()
+
+    def add(self, seconds, now=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            self.samples.append((now, seconds))
+
+    def snapshot(self, now=None):
+        """
+        Summarise the current window as a dict with the `count` of samples,
+        the `min`, `mean`, `p50`, `p90`, `p99` and `max` in milliseconds, and
+        `buckets`: a list of `(upper bound in ms, count)` pairs, the last
+        bound being `None` for everything slower.
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            while self.samples and self.samples[0][0] < now - self.window:
+                self.samples.popleft()
+            rtts = sorted(seconds * 1000 for _, seconds in self.samples)
+
+        counts = [0] * (len(self.buckets) + 1)
+        for rtt in rtts:
+            counts[bisect.bisect_left(self.buckets, rtt)] += 1
+
+        summary = {
+            'count': len(rtts),
+            'buckets': list(zip(self.buckets + [None], counts)),
+        }
+        if rtts:
+            summary.update({
+                'min': rtts[0],
+                'mean': sum(rtts) / len(rtts),
+                'p50': _percentile(rtts, 50),
+                'p90': _percentile(rtts, 90),
+                'p99': _percentile(rtts, 99),
+                'max': rtts[-1],
+            })
+        return summary
+
+def _percentile(ordered, percent):
+    # Nearest rank
+    return ordered[max(0, (len(ordered) * percent + 99) // 100 - 1)]
+
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+def get_histogram(endpoint):
+    """
+    Get the <RollingHistogram> of echo round trip times for an endpoint
+    """
+    with _histograms_lock:
+        histogram = _histograms.get(endpoint)
+        if histogram is None:
+            histogram = _histograms[endpoint] = RollingHistogram()
+    return histogram
+
+def get_endpoints():
+    """
+    Get every SecurePay endpoint transactions are sent to
+    """
+    return sorted(set(get_endpoint(txn_type) for txn_type in URL_TYPE_MAP))
+
+
+def echo(endpoint, merchant=None):
+    """
+    Send an `Echo` to an endpoint, and return the round trip time in
+    seconds. The time is added to the endpoint's histogram. Raises
+    <ResponseError> if SecurePay does not answer normally.
+    """
+    merchant = merchants.get_merchant(merchant)
+    timings = metrics.start('echo')
+    try:
+        timeout = client.get_timeout('echo')
+        request = encoder.encode_request(merchant, 'Echo', timeout=timeout)
+        timings.lap('build')
+
+        http_response = client.post(endpoint, request, timeout, merchant)
+        rtt = http_response.elapsed.total_seconds()
+        response_text = http_response.text
+        timings.lap('send')
+
+        response = decoder.decode_response(response_text)
+        timings.lap('parse')
+        if response.status_code != '000':
+            raise ResponseError('Echo failed with status %s: %s' % (
+                response.status_code, response.status_description),
+                response_text)
+    except Exception as e:
+        timings.finish(error=e.__class__.__name__)
+        raise
+
+    timings.finish(status_code=response.status_code)
+    get_histogram(endpoint).add(rtt)
+    return rtt
+
+def warm_up(connections=1):
+    """
+    Echo every endpoint for every merchant, opening up to `connections`
+    pooled connections to each at once. Returns a dict of
+    `{(endpoint, merchant name): [round trip times]}`; failed echoes are
+    logged and left out.
+    """
+    results = {}
+    threads = []
+    for merchant in merchants.all_merchants():
+        for endpoint in get_endpoints():
+            rtts = results[(endpoint, merchant.name)] = []
+            for i in range(connections):
+                thread = threading.Thread(target=_echo_into,
+                    args=(endpoint, merchant, rtts))
+                thread.start()
+                threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+    return results
+
+def _echo_into(endpoint, merchant, rtts):
+    try:
+        rtts.append(echo(endpoint, merchant))
+    except (SecurePayError, requests.RequestException):
+        logger.warning("Echo to %s for %s failed", endpoint, merchant.name,
+            exc_info=True)
+
+
+class Prober(threading.Thread):
+    """
+    Calls <warm_up> every `interval` seconds until stopped
+    """
+    def __init__(self, interval=PROBE_INTERVAL):
+        super(Prober, self).__init__(name='securepay-prober')
+        self.daemon = True
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                warm_up()
+            except Exception:
+                logger.exception("SecurePay probe failed")
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+
+
+_prober = None
+_prober_lock = threading.Lock()
+
+def start_prober(interval=PROBE_INTERVAL):
+    """
+    Start probing in a background thread, if it is not already running in
+    this process
+    """
+    global _prober
+
+    with _prober_lock:
+        if _prober is None or not _prober.is_alive():
+            _prober = Prober(interval)
+            _prober.start()
+    return _prober
+
+def stop_prober():
+    global _prober
+
+    with _prober_lock:
+        if _prober is not None:
+            _prober.stop()
+            _prober = None
@@ -0,0 +1,251 @@
+"""
+Resolves transactions left in flight.
+
+If a process dies, or gives up waiting, part way through sending a
+transaction, the transaction is left in `'sending'` or `'receiving'` with no
+outcome. Once a transaction has not been touched for
+`SECUREPAY_RECONCILE_AFTER` seconds, <reconcile> claims it and works out what
+happened from the response already saved against it, if there is one.
+
+Otherwise it can send a `Query` for it, if `SECUREPAY_RECONCILE_QUERY` is set.
+SecurePay's XML API has no `Query` request: only <securepay.simulator>
+answers it, so leave this off against the real gateway. Transactions a
+successful `Query` says were never received are completed as unsuccessful,
+so they can be safely tried again. Anything that can not be resolved is
+released, to be looked at again later or resolved by hand.
+
+Run it with `manage.py securepay_reconcile`. Any number of reconcilers can run
+at once: each transaction is claimed with a guarded `UPDATE` before it is
+looked at, so only one of them will resolve it.
+"""
+import datetime
+import logging
+from xml.etree import ElementTree
+
+import requests
+from django.conf import settings
+from django.utils import timezone
+
+from securepay import client
+from securepay import decoder
+from securepay import encoder
+from securepay import merchants
+from securepay.exceptions import SecurePayError, StatusConflict
+from securepay.models import Transaction, TransactionLog, IN_FLIGHT, \
+    get_endpoint, _chunks, _response_fields, _transition
+
+logger = logging.getLogger(__name__)
+
+#: Seconds a transaction must have been in flight before it is reconciled.
+#: This should be well over the read timeout, so that transactions that are
+#: still being sent are left alone.
+STALE_AFTER = getattr(settings, 'SECUREPAY_RECONCILE_AFTER', 300)
+
+#: Transactions claimed at once, and sent in each `Query`
+BATCH_SIZE = getattr(settings, 'SECUREPAY_RECONCILE_BATCH_SIZE',
+    client.MAX_BATCH_SIZE)
+
+#: Send a `Query` for transactions with no saved response. Only the simulator
+#: answers `Query` requests, so this is off by default.
+QUERY = getattr(settings, 'SECUREPAY_RECONCILE_QUERY', False)
+
+#: The <Transaction.bank_message> of transactions SecurePay never received
+NOT_RECEIVED = 'Not received by SecurePay'
+
+
+def find_stale(stale_after=STALE_AFTER):
+    """
+    Get the transactions that have been in flight for longer than
+    `stale_after` seconds, oldest first. This is answered from the partial
+    in flight index.
+    """
+    cutoff = timezone.now() - datetime.timedelta(seconds=stale_after)
+    return Transaction.objects \
+        .filter(status__in=IN_FLIGHT, modified__lt=cutoff) \
+        .order_by('modified')
+
+def claim(transactions):
+    """
+    Move each transaction to `'resolving'`, if nothing else has touched it
+    since it was fetched. Returns the transactions that were claimed.
+    """
+    claimed = []
+    for transaction in transactions:
+        now = timezone.now()
+        updated = Transaction.objects \
+            .filter(pk=transaction.pk, status=transaction.status,
+                modified=transaction.modified) \
+            .update(status='resolving', modified=now)
+        if updated:
+            transaction.status = 'resolving'
+            transaction.modified = now
+            claimed.append(transaction)
+    return claimed
+
+def reconcile(stale_after=STALE_AFTER, batch_size=BATCH_SIZE, limit=None,
+    query=QUERY):
+    """
+    Resolve stale in flight transactions, `batch_size` at a time, until there
+    are none left or `limit` have been looked at. Returns a dict counting how
+    many were `resolved` from SecurePay's answer, found `not_received`,
+    `released` to be tried again later because their outcome could not be
+    found, or `skipped` because something else got to them first. Pass
+    `query` to override `SECUREPAY_RECONCILE_QUERY`.
+    """
+    counts = dict.fromkeys(['resolved', 'not_received', 'released',
+        'skipped'], 0)
+    seen = 0
+    # Transactions someone else claimed first, so they are not fetched again
+    skipped = set()
+
+    while limit is None or seen < limit:
+        size = batch_size if limit is None else min(batch_size, limit - seen)
+        stale = find_stale(stale_after)
+        if skipped:
+            stale = stale.exclude(pk__in=skipped)
+        batch = list(stale[:size])
+        if not batch:
+            break
+        seen += len(batch)
+
+        claimed = claim(batch)
+        counts['skipped'] += len(batch) - len(claimed)
+        skipped.update(transaction.pk for transaction in batch
+            if transaction.status != 'resolving')
+        for outcome in resolve(claimed, query):
+            counts[outcome] += 1
+
+    return counts
+
+def resolve(transactions, query=QUERY):
+    """
+    Resolve some claimed transactions, yielding the outcome for each
+    """
+    unresolved = []
+    for transaction, txn in _saved_results(transactions):
+        if txn is None:
+            unresolved.append(transaction)
+        else:
+            yield _complete(transaction, txn)
+
+    if not query:
+        for transaction in unresolved:
+            yield _release(transaction)
+        return
+
+    groups = {}
+    for transaction in unresolved:
+        key = (get_endpoint(transaction.txn_type), transaction.merchant)
+        groups.setdefault(key, []).append(transaction)
+
+    for (endpoint, merchant), transactions in groups.items():
+        merchant = merchants.get_merchant(merchant)
+        for batch in _chunks(transactions, client.MAX_BATCH_SIZE):
+            for outcome in _query(endpoint, merchant, batch):
+                yield outcome
+
+def _saved_results(transactions):
+    """
+    Pair each transaction with its result from the response already saved
+    against it, or `None`. See <_match>.
+    """
+    logs = TransactionLog.objects.filter(kind__in=['request', 'response'],
+        transaction__in=[transaction.pk for transaction in transactions])
+    texts = dict(((log.transaction_id, log.kind), log.text) for log in logs)
+
+    for transaction in transactions:
+        txn = None
+        if (transaction.pk, 'response') in texts:
+            try:
+                response = decoder.decode_response(
+                    texts[transaction.pk, 'response'])
+            except SecurePayError:
+                response = None
+            if response is not None:
+                txn = _match(transaction, response.txns,
+                    texts.get((transaction.pk, 'request')))
+        yield transaction, txn
+
+def _match(transaction, txns, request_text):
+    """
+    Find the result for `transaction` amongst the `txns` of a saved response.
+    The same response is saved against every transaction in a batch, so a
+    result is only used if it can be matched to this transaction: by its
+    purchase order number, or by the position of the transaction in the saved
+    request. Returns `None` if it can not be matched unambiguously.
+    """
+    purchase_order_no = transaction.purchase_order_no
+    if any(txn.purchase_order_no is not None for txn in txns):
+        matches = [txn for txn in txns
+            if txn.purchase_order_no == purchase_order_no]
+        return matches[0] if len(matches) == 1 else None
+
+    if request_text is None:
+        return None
+    try:
+        request = ElementTree.fromstring(request_text.encode('utf-8'))
+    except SyntaxError:
+        return None
+
+    ids = [txn.get('ID') for txn in request.iter('Txn')
+        if txn.findtext('purchaseOrderNo') == purchase_order_no]
+    matches = [txn for txn in txns if len(ids) == 1 and txn.id == ids[0]]
+    return matches[0] if len(matches) == 1 else None
+
+def _query(endpoint, merchant, transactions):
+    try:
+        response_text = client.post_request(endpoint,
+            encoder.encode_query_request(merchant, transactions),
+            client.get_timeout('query'), merchant)
+        response = decoder.decode_response(response_text)
+    except (SecurePayError, requests.RequestException):
+        logger.exception("Could not query SecurePay for %d transactions",
+            len(transactions))
+        response = decoder.Response(None, None, [])
+
+    if response.status_code != '000':
+        # Rejected, or not understood. The `<Txn>`s may just be echoed back,
+        # so a missing response code says nothing about them.
+        if response.status_code is not None:
+            logger.error("SecurePay rejected a query for %d transactions: "
+                "%s %s", len(transactions), response.status_code,
+                response.status_description)
+        for transaction in transactions:
+            yield _release(transaction)
+        return
+
+    by_id = dict((txn.id, txn) for txn in response.txns)
+    for txn_id, transaction in enumerate(transactions, 1):
+        txn = by_id.get(str(txn_id))
+        if txn is None:
+            yield _release(transaction)
+        elif txn.response_code is None:
+            yield _complete(transaction, None)
+        else:
+            yield _complete(transaction, txn)
+
+def _complete(transaction, txn):
+    if txn is None:
+        fields = {'success': False, 'bank_message': NOT_RECEIVED}
+        outcome = 'not_received'
+    else:
+        fields = _response_fields(txn)
+        outcome = 'resolved'
+
+    try:
+        _transition([transaction], ['resolving'], 'completed', **fields)
+    except StatusConflict:
+        # The original process finished it after all
+        return 'skipped'
+    return outcome
+
+def _release(transaction):
+    """
+    Put a transaction back, to be tried again once it is stale again. It may
+    have reached SecurePay, so it goes back to `'receiving'`.
+    """
+    try:
+        _transition([transaction], ['resolving'], 'receiving')
+    except StatusConflict:
+        return 'skipped'
+    return 'released'
@@ -0,0 +1,210 @@
+"""
+Refunding or reversing many transactions at once, for example when an event
+is cancelled.
+
+    report = mass_refund(Transaction.objects.with_data(event_id=42))
+
+The transactions are read in chunks, with only the columns needed to refund
+them. Refunds are created with a single `bulk_create` per chunk, and sent in
+batches of up to `SECUREPAY_MAX_BATCH_SIZE`, with up to `workers` requests in
+flight at once. A <RefundResult> is returned for every transaction.
+
+A transaction is never refunded twice. While the refunds for a chunk are
+created, the transactions being refunded are locked with `SELECT ... FOR
+UPDATE`, and any transaction that already has a refund or reversal that
+was not declined, live or archived, is skipped. This holds even if a job is
+restarted, or two jobs run at once. Refunds created by a job that died before
+sending them are sent by the next job.
+
+The refunds are sent from worker threads, which can only see them once they
+are committed, so do not call <mass_refund> inside a database transaction.
+"""
+import logging
+from collections import namedtuple
+
+import requests
+from django.conf import settings
+from django.db import connection
+
+from securepay import client
+from securepay import encoder
+from securepay import merchants
+from securepay import utils
+from securepay.exceptions import SecurePayError, StatusConflict
+from securepay.models import ArchivedTransaction, Transaction, \
+    TransactionData, _chunks, _send_batch
+
+logger = logging.getLogger(__name__)
+
+#: Requests to SecurePay in flight at once during a mass refund
+WORKERS = getattr(settings, 'SECUREPAY_REFUND_WORKERS', 4)
+
+#: Transactions locked and refunded at a time
+CHUNK_SIZE = getattr(settings, 'SECUREPAY_REFUND_CHUNK_SIZE', 500)
+
+#: Types of transaction that take money, and so can be refunded
+REFUNDABLE_TYPES = ['pay', 'complete']
+
+#: The columns read from the transactions being refunded
+FIELDS = ['id', 'txn_type', 'status', 'success', 'amount', 'card_name',
+    'purchase_order_no', 'txn_id', 'merchant']
+
+ENCODERS = {
+    'refund': encoder.encode_refund_txn,
+    'reversal': encoder.encode_void_txn,
+}
+
+#: The outcome for one transaction. `outcome` is one of `'approved'`,
+#: `'declined'`, `'failed'` (the outcome is not known), `'already_refunded'`
+#: or `'not_refundable'`. `refund` is the refund or reversal <Transaction>,
+#: if one was sent.
+RefundResult = namedtuple('RefundResult', ['reference', 'refund', 'outcome',
+    'message'])
+
+
+def mass_refund(queryset, txn_type='refund', data={}, workers=WORKERS,
+    chunk_size=CHUNK_SIZE):
+    """
+    Refund or reverse, in full, every transaction in `queryset`, and return
+    a list of <RefundResult>s.
+
+    Parameters:
+        queryset - The transactions to refund.
+        txn_type - `'refund'` or `'reversal'`.
+        data - Any extra data to store with each refund.
+        workers - Requests to send at once.
+        chunk_size - Transactions to lock and create refunds for at a time.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if txn_type not in ENCODERS:
+        raise ValueError('txn_type must be refund or reversal, not %s'
+            % txn_type)
+
+    pks = list(queryset.order_by('pk').values_list('pk', flat=True))
+    report = []
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for chunk in _chunks(pks, chunk_size):
+            batches = _prepare(chunk, txn_type, data, report)
+            futures = [executor.submit(_send, batch, txn_type)
+                for batch in batches]
+            for future in futures:
+                report.extend(future.result())
+    finally:
+        executor.shutdown(wait=True)
+    return report
+
+def _refundable(reference):
+    return reference.txn_type in REFUNDABLE_TYPES \
+        and reference.status == 'completed' and reference.success \
+        and reference.txn_id
+
+def _prepare(pks, txn_type, data, report):
+    """
+    Lock a chunk of transactions, and create the refunds for them. Returns
+    the batches of refunds to send, with any left unsent by an earlier job.
+    """
+    with utils.atomic():
+        return _prepare_locked(pks, txn_type, data, report)
+
+def _prepare_locked(pks, txn_type, data, report):
+    references = Transaction.objects.select_for_update().filter(pk__in=pks) \
+        .only(*FIELDS).order_by('pk')
+    references = dict((reference.pk, reference) for reference in references)
+
+    # Refunds and reversals already made, other than declined ones
+    previous = {}
+    existing = Transaction.objects \
+        .filter(reference_transaction__in=pks,
+            txn_type__in=list(ENCODERS)) \
+        .exclude(status='completed', success=False) \
+        .values_list('reference_transaction', 'status')
+    archived = ArchivedTransaction.objects \
+        .filter(reference_transaction_id__in=pks,
+            txn_type__in=list(ENCODERS)) \
+        .exclude(success=False) \
+        .values_list('reference_transaction_id', 'status')
+    for reference_pk, status in list(existing) + list(archived):
+        previous.setdefault(reference_pk, []).append(status)
+
+    new = []
+    for pk in pks:
+        reference = references.get(pk)
+        if reference is None:
+            # Deleted since the job started
+            continue
+        if not _refundable(reference):
+            report.append(RefundResult(reference, None, 'not_refundable',
+                'Only successful payments and completes can be refunded'))
+        elif pk in previous:
+            if all(status in ('', 'init') for status in previous[pk]):
+                # Created by a job that died before sending it
+                continue
+            report.append(RefundResult(reference, None, 'already_refunded',
+                'Already refunded or reversed'))
+        else:
+            new.append(Transaction(amount=reference.amount,
+                txn_type=txn_type,
+                merchant=reference.merchant,
+                card_name=reference.card_name,
+                description=data.get('description', ''),
+                reference_transaction_id=reference.pk,
+                purchase_order_no=reference.purchase_order_no,
+                extra_data=data))
+    Transaction.objects.bulk_create(new)
+
+    # <bulk_create> does not set primary keys, so fetch everything that
+    # still needs sending again
+    unsent = list(Transaction.objects
+        .filter(reference_transaction__in=pks, txn_type=txn_type,
+            status__in=['', 'init'])
+        .order_by('merchant', 'pk'))
+    created = set(refund.reference_transaction_id for refund in new)
+    TransactionData.objects.index([refund for refund in unsent
+        if refund.reference_transaction_id in created])
+
+    by_merchant = {}
+    for refund in unsent:
+        # Saves fetching each reference again when the refund is encoded
+        refund.reference_transaction = references[
+            refund.reference_transaction_id]
+        by_merchant.setdefault(refund.merchant, []).append(refund)
+
+    return [batch for refunds in by_merchant.values()
+        for batch in _chunks(refunds, client.MAX_BATCH_SIZE)]
+
+def _send(refunds, txn_type):
+    """
+    Send one batch of refunds, in a worker thread, and report on each
+    """
+    merchant = merchants.get_merchant(refunds[0].merchant)
+    make_txn = ENCODERS[txn_type]
+    txns = [make_txn(refund, txn_id)
+        for txn_id, refund in enumerate(refunds, 1)]
+
+    try:
+        _send_batch(refunds, lambda: encoder.encode_batch_request(
+            merchant, txns, timeout=client.get_timeout(txn_type)))
+    except StatusConflict:
+        return [RefundResult(refund.reference_transaction, refund,
+            'already_refunded', 'Being sent by another job')
+            for refund in refunds]
+    except (SecurePayError, requests.RequestException) as e:
+        logger.exception("Refund batch of %d failed", len(refunds))
+        return [RefundResult(refund.reference_transaction, refund, 'failed',
+            str(e)) for refund in refunds]
+    finally:
+        connection.close()
+
+    results = []
+    for refund in refunds:
+        if refund.status != 'completed':
+            outcome = 'failed'
+        elif refund.success:
+            outcome = 'approved'
+        else:
+            outcome = 'declined'
+        results.append(RefundResult(refund.reference_transaction, refund,
+            outcome, refund.bank_message))
+    return results
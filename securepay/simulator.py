@@ -0,0 +1,475 @@
+"""
+A local stand in for the SecurePay XML API, for load and latency testing.
+
+The simulator understands the requests <securepay.client> makes to the
+`xmlapi/payment` and `xmlapi/directentry` endpoints, and answers them the way
+the SecurePay test gateway does: the cents of the amount decide the bank
+response code, so `$10.00` is approved and `$10.51` is declined with `51`
+(Insufficient Funds). Card numbers in `DECLINED_CARDS` are always declined.
+Transaction and preauth IDs are remembered, so completes, refunds and
+reversals of unknown or over-refunded transactions are declined. The outcome
+of every transaction is remembered too, and is sent back for `Query`
+requests. Only the most recently used `remember` of each are kept, so that a
+long load test does not grow without limit.
+
+Latency, server errors, malformed responses and dropped connections can be
+added at configurable rates. Latencies are given as:
+
+    fixed:MS
+    uniform:MIN_MS:MAX_MS
+    normal:MEAN_MS:STDDEV_MS
+    lognormal:MEDIAN_MS:SIGMA
+    exponential:MEAN_MS
+
+The simulator can be used in process, by setting `SECUREPAY_TRANSPORT_ADAPTER`
+to `'securepay.simulator.SimulatorAdapter'` (configured by the
+`SECUREPAY_SIMULATOR` setting, a dict of <Simulator> arguments), or over HTTP
+with `manage.py securepay_simulator`.
+"""
+import copy
+import math
+import time
+import random
+import datetime
+import threading
+from collections import OrderedDict
+from xml.etree import ElementTree
+
+from django.conf import settings
+from requests.adapters import BaseAdapter
+from requests.exceptions import ConnectionError
+from requests.models import Response
+
+from securepay.client import make_element, make_message_timestamp, \
+    API_VERSION, TYPE_MAP
+
+#: Maps from SecurePay <txnType> numbers back to <Transaction.txn_type>
+TXN_TYPES = dict((str(number), name) for name, number in TYPE_MAP.items())
+
+#: Which transaction types each endpoint accepts
+ENDPOINT_TXN_TYPES = {
+    'payment': ['pay', 'refund', 'reversal', 'preauth', 'complete'],
+    'directentry': ['credit', 'debit'],
+}
+
+#: Bank response codes that mean the transaction was approved
+APPROVED_CODES = ['00', '08', '11', '16']
+
+RESPONSE_TEXTS = {
+    '00': 'Approved',
+    '01': 'Refer to Card Issuer',
+    '04': 'Pickup Card',
+    '05': 'Do Not Honour',
+    '08': 'Honour with ID',
+    '11': 'Approved VIP',
+    '12': 'Invalid Transaction',
+    '16': 'Approved, update track 3',
+    '31': 'Bank not supported by switch',
+    '33': 'Expired Card',
+    '41': 'Lost Card',
+    '43': 'Stolen Card',
+    '51': 'Insufficient Funds',
+    '54': 'Expired Card',
+    '61': 'Exceeds withdrawal amount limits',
+    '91': 'Card Issuer Unavailable',
+}
+
+#: Card numbers that are always declined, and the code they are declined with
+DECLINED_CARDS = {
+    '4000000000000002': '05',
+    '4000000000000069': '54',
+    '4000000000009995': '51',
+}
+
+
+class ConnectionDropped(Exception):
+    """
+    The simulator decided to drop the connection without responding
+    """
+
+
+def parse_latency(spec):
+    """
+    Parse a latency spec (see the module documentation) in to a function that
+    returns a delay in seconds
+    """
+    if not spec:
+        return lambda rng: 0.0
+
+    parts = str(spec).split(':')
+    kind, args = parts[0], [float(arg) for arg in parts[1:]]
+
+    distributions = {
+        'fixed': lambda rng: args[0],
+        'uniform': lambda rng: rng.uniform(args[0], args[1]),
+        'normal': lambda rng: max(0.0, rng.normalvariate(args[0], args[1])),
+        'lognormal': lambda rng: rng.lognormvariate(math.log(args[0]),
+            args[1]),
+        'exponential': lambda rng: rng.expovariate(1.0 / args[0]),
+    }
+    if kind not in distributions:
+        raise ValueError('Unknown latency distribution %s. Must be one of %s'
+            % (kind, ', '.join(sorted(distributions))))
+
+    distribution = distributions[kind]
+    return lambda rng: distribution(rng) / 1000.0
+
+
+class Simulator(object):
+    """
+    Answers SecurePay requests. Safe to share between threads.
+
+    Parameters:
+        latency - A latency spec, for how long each response takes.
+        error_rate - The fraction of requests answered with an HTTP 500.
+        malformed_rate - The fraction of requests answered with truncated XML.
+        drop_rate - The fraction of requests that get no response at all.
+        seed - Seed for the random number generator, for repeatable runs.
+        remember - How many transaction IDs and outcomes to keep. The least
+            recently used are forgotten first.
+    """
+    def __init__(self, latency=None, error_rate=0.0, malformed_rate=0.0,
+        drop_rate=0.0, seed=None, remember=100000):
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.drop_rate = drop_rate
+        self.remember = remember
+
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+        #: txnID or preauthID: [txn_type, amount in cents, amount refunded]
+        self.transactions = OrderedDict()
+        #: <order_key>: the `<Txn>` responded with
+        self.outcomes = OrderedDict()
+        self.next_id = self.random.randint(100000, 500000)
+
+    def delay(self):
+        """
+        How long to wait before responding to the next request, in seconds
+        """
+        with self.lock:
+            return self.latency(self.random)
+
+    def handle(self, path, body):
+        """
+        Handle a request to `path` with the XML `body`. Returns an
+        `(HTTP status, response body)` tuple, or raises <ConnectionDropped>.
+        """
+        with self.lock:
+            roll = self.random.random()
+
+        if roll < self.drop_rate:
+            raise ConnectionDropped()
+        roll -= self.drop_rate
+        if roll < self.error_rate:
+            return (500, '<html><body><h1>500 Internal Server Error</h1>'
+                '</body></html>')
+        roll -= self.error_rate
+
+        endpoint = path.rstrip('/').rsplit('/', 1)[-1]
+        if endpoint not in ENDPOINT_TXN_TYPES:
+            return (404, '<html><body><h1>404 Not Found</h1></body></html>')
+
+        try:
+            request = ElementTree.fromstring(body)
+        except SyntaxError:
+            return (200, self.render(None, '575', 'Invalid XML', []))
+
+        response = self.respond(endpoint, request)
+        if roll < self.malformed_rate:
+            response = response[:len(response) // 2]
+        return (200, response)
+
+    def respond(self, endpoint, request):
+        request_type = request.findtext('RequestType')
+        if request.findtext('MerchantInfo/merchantID') is None:
+            return self.render(request, '504', 'Invalid merchant ID', [])
+
+        if request_type == 'Echo':
+            return self.render(request, '000', 'Normal', None)
+        if request_type == 'Query':
+            process = self.query
+        elif request_type == 'Payment':
+            process = self.process
+        else:
+            return self.render(request, '577', 'Invalid request type', [])
+
+        txns = [process(endpoint, txn)
+            for txn in request.findall('Payment/TxnList/Txn')]
+        return self.render(request, '000', 'Normal', txns)
+
+    def order_key(self, txn):
+        """
+        What identifies a transaction when it is queried
+        """
+        return tuple(txn.findtext(name) for name in [
+            'txnType', 'purchaseOrderNo', 'amount', 'txnID', 'preauthID'])
+
+    def query(self, endpoint, txn):
+        """
+        Answer one `<Txn>` of a `Query` with the `<Txn>` the transaction was
+        originally answered with, or with no `<responseCode>` if it was never
+        received
+        """
+        with self.lock:
+            outcome = self.recall(self.outcomes, self.order_key(txn))
+
+        if outcome is not None:
+            outcome = copy.deepcopy(outcome)
+            outcome.set('ID', txn.get('ID', '1'))
+            return outcome
+
+        return make_element('Txn', attrib={'ID': txn.get('ID', '1')},
+            children=[
+                make_element('txnType', text=txn.findtext('txnType')),
+                make_element('txnSource', text=txn.findtext('txnSource')),
+                make_element('amount', text=txn.findtext('amount')),
+                make_element('purchaseOrderNo',
+                    text=txn.findtext('purchaseOrderNo')),
+                make_element('approved', text='No'),
+                make_element('responseText', text='Transaction not found'),
+            ])
+
+    def process(self, endpoint, txn):
+        """
+        Process one `<Txn>`, and return the `<Txn>` element to respond with
+        """
+        txn_type = TXN_TYPES.get(txn.findtext('txnType'))
+        try:
+            amount = int(txn.findtext('amount'))
+        except (TypeError, ValueError):
+            amount = 0
+
+        ids = {}
+        if txn_type not in ENDPOINT_TXN_TYPES[endpoint]:
+            code = '12'
+        else:
+            code = self.response_code(txn, txn_type, amount)
+
+        approved = code in APPROVED_CODES
+        if approved:
+            with self.lock:
+                self.next_id += 1
+                new_id = '%06d' % self.next_id
+                if txn_type == 'preauth':
+                    ids['preauthID'] = new_id
+                ids['txnID'] = new_id
+                self.store(self.transactions, new_id, [txn_type, amount, 0])
+        else:
+            ids['txnID'] = ''
+
+        children = [
+            make_element('txnType', text=txn.findtext('txnType')),
+            make_element('txnSource', text=txn.findtext('txnSource')),
+            make_element('amount', text=amount),
+            make_element('currency', text='AUD'),
+            make_element('purchaseOrderNo',
+                text=txn.findtext('purchaseOrderNo')),
+            make_element('approved', text='Yes' if approved else 'No'),
+            make_element('responseCode', text=code),
+            make_element('responseText',
+                text=RESPONSE_TEXTS.get(code, 'Declined')),
+            make_element('settlementDate',
+                text=datetime.date.today().strftime('%Y%m%d')),
+        ]
+        for name in ['txnID', 'preauthID']:
+            if name in ids:
+                children.append(make_element(name, text=ids[name]))
+
+        card_number = txn.findtext('CreditCardInfo/cardNumber')
+        if card_number is not None:
+            children.append(make_element('CreditCardInfo', children=[
+                make_element('pan',
+                    text='%s...%s' % (card_number[:6], card_number[-3:])),
+                make_element('expiryDate',
+                    text=txn.findtext('CreditCardInfo/expiryDate')),
+            ]))
+
+        direct_entry = txn.find('DirectEntryInfo')
+        if direct_entry is not None:
+            children.append(direct_entry)
+
+        outcome = make_element('Txn', attrib={'ID': txn.get('ID', '1')},
+            children=children)
+        with self.lock:
+            self.store(self.outcomes, self.order_key(txn), outcome)
+        return outcome
+
+    def store(self, remembered, key, value):
+        """
+        Remember `value`, forgetting the least recently used values if there
+        are too many. Call with the lock held.
+        """
+        remembered.pop(key, None)
+        remembered[key] = value
+        while len(remembered) > self.remember:
+            remembered.popitem(last=False)
+
+    def recall(self, remembered, key):
+        """
+        Get a remembered value, or `None`, and mark it as recently used. Call
+        with the lock held.
+        """
+        value = remembered.pop(key, None)
+        if value is not None:
+            remembered[key] = value
+        return value
+
+    def response_code(self, txn, txn_type, amount):
+        """
+        Decide the bank response code for a transaction
+        """
+        if amount <= 0:
+            return '12'
+
+        card_number = txn.findtext('CreditCardInfo/cardNumber')
+        if card_number in DECLINED_CARDS:
+            return DECLINED_CARDS[card_number]
+
+        if txn_type in ('refund', 'reversal', 'complete'):
+            reference = txn.findtext('preauthID') \
+                if txn_type == 'complete' else txn.findtext('txnID')
+            with self.lock:
+                original = self.recall(self.transactions, reference)
+                if original is None:
+                    return '12'
+                if txn_type == 'complete' and original[0] != 'preauth':
+                    return '12'
+                if original[2] + amount > original[1]:
+                    return '61'
+                original[2] += amount
+            return '00'
+
+        return '%02d' % (amount % 100)
+
+    def render(self, request, status_code, status_description, txns):
+        """
+        Render a whole response. `txns` is a list of `<Txn>` elements, or
+        `None` if there should be no `<Payment>` element.
+        """
+        message_id = ''
+        merchant_id = ''
+        request_type = 'Payment'
+        if request is not None:
+            message_id = request.findtext('MessageInfo/messageID') or ''
+            merchant_id = request.findtext('MerchantInfo/merchantID') or ''
+            request_type = request.findtext('RequestType') or request_type
+
+        children = [
+            make_element('MessageInfo', children=[
+                make_element('messageID', text=message_id),
+                make_element('messageTimestamp',
+                    text=make_message_timestamp()),
+                make_element('apiVersion', text=API_VERSION),
+            ]),
+            make_element('RequestType', text=request_type),
+            make_element('MerchantInfo', children=[
+                make_element('merchantID', text=merchant_id),
+            ]),
+            make_element('Status', children=[
+                make_element('statusCode', text=status_code),
+                make_element('statusDescription', text=status_description),
+            ]),
+        ]
+        if txns is not None:
+            children.append(make_element('Payment', children=[
+                make_element('TxnList', attrib={'count': str(len(txns))},
+                    children=txns),
+            ]))
+
+        root = make_element('SecurePayMessage', children=children)
+        return '<?xml version="1.0" encoding="UTF-8" standalone="no"?>' + \
+            ElementTree.tostring(root).decode('ascii')
+
+
+_simulator = None
+_simulator_lock = threading.Lock()
+
+def get_simulator():
+    """
+    Get the shared <Simulator>, configured by the `SECUREPAY_SIMULATOR`
+    setting
+    """
+    global _simulator
+
+    with _simulator_lock:
+        if _simulator is None:
+            _simulator = Simulator(
+                **getattr(settings, 'SECUREPAY_SIMULATOR', {}))
+    return _simulator
+
+
+class SimulatorAdapter(BaseAdapter):
+    """
+    A transport adapter that sends requests to the shared <Simulator>, in
+    process. Set `SECUREPAY_TRANSPORT_ADAPTER` to
+    `'securepay.simulator.SimulatorAdapter'` to use it.
+    """
+    def __init__(self, simulator=None):
+        super(SimulatorAdapter, self).__init__()
+        self.simulator = simulator or get_simulator()
+
+    def send(self, request, **kwargs):
+        time.sleep(self.simulator.delay())
+
+        try:
+            status, body = self.simulator.handle(request.path_url,
+                request.body)
+        except ConnectionDropped:
+            raise ConnectionError('Connection dropped by the simulator',
+                request=request)
+
+        response = Response()
+        response.status_code = status
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        response._content = body.encode('utf-8')
+        return response
+
+    def close(self):
+        pass
+
+
+def make_server(simulator, host='127.0.0.1', port=8001):
+    """
+    Make a threaded HTTP server that answers requests with `simulator`. Call
+    `serve_forever()` on it to start it.
+    """
+    try:
+        from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+        from SocketServer import ThreadingMixIn
+    except ImportError:
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        from socketserver import ThreadingMixIn
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            time.sleep(simulator.delay())
+
+            try:
+                status, response = simulator.handle(self.path, body)
+            except ConnectionDropped:
+                self.close_connection = True
+                self.connection.close()
+                return
+
+            response = response.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/xml; charset=utf-8')
+            self.send_header('Content-Length', str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+        def log_message(self, format, *args):
+            pass
+
+    class Server(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    return Server((host, port), Handler)
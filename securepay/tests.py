@@ -1,16 +1,1216 @@
-"""
-This file demonstrates writing tests using the unittest module. These will pass
-when you run "manage.py test".
+from decimal import Decimal
 
-Replace this with more appropriate tests for your application.
-"""
+from django.test import TestCase, TransactionTestCase
 
-from django.test import TestCase
 
+class SharedConnection(object):
+    """
+    Lets other threads use this thread's connection, and so see the
+    in-memory test database, while in the `with` block
+    """
+    def __enter__(self):
+        from django.db import connections
 
-class SimpleTest(TestCase):
-    def test_basic_addition(self):
+        self.connection = connections['default']
+        self.connections = connections._connections
+        shared = type('Connections', (object,), {})()
+        shared.default = self.connection
+        connections._connections = shared
+        self.connection.allow_thread_sharing = True
+        return self.connection
+
+    def __exit__(self, *exc_info):
+        from django.db import connections
+
+        connections._connections = self.connections
+        self.connection.allow_thread_sharing = False
+
+
+class EncoderTest(TestCase):
+    merchant = {'merchant_id': 'ABC0001', 'password': 'abc&123'}
+
+    def assertSameRequest(self, reference, encode, *args):
         """
-        Tests that 1 + 1 always equals 2.
+        Check that the encoder produces exactly what ElementTree produces for
+        the reference request, given the same message ID and timestamp
         """
-        self.assertEqual(1 + 1, 2)
+        from xml.etree import ElementTree
+
+        encoded = encode(*args,
+            message_id=reference.findtext('MessageInfo/messageID'),
+            timestamp=reference.findtext('MessageInfo/messageTimestamp'))
+        self.assertEqual(ElementTree.tostring(reference), encoded)
+
+    def test_pay_request(self):
+        from securepay import client, encoder
+        from securepay.models import Transaction
+        from securepay.utils import sample_credit_card_data
+
+        transaction = Transaction(amount=Decimal('12.34'), txn_type='pay',
+            purchase_order_no='Transaction <1> & 2')
+        self.assertSameRequest(
+            client.make_pay_request(self.merchant, transaction,
+                sample_credit_card_data),
+            encoder.encode_pay_request, self.merchant, transaction,
+            sample_credit_card_data)
+
+    def test_referenced_requests(self):
+        from securepay import client, encoder
+        from securepay.models import Transaction
+
+        reference = Transaction(amount=Decimal('10.00'), txn_type='preauth',
+            purchase_order_no='Transaction-1', txn_id='123456',
+            preauth_id='654321')
+        for txn_type in ['refund', 'reversal', 'complete']:
+            transaction = Transaction(amount=Decimal('10.00'),
+                txn_type=txn_type, purchase_order_no='Transaction-1',
+                reference_transaction=reference)
+            self.assertSameRequest(
+                client.make_refund_request(self.merchant, transaction),
+                encoder.encode_refund_request, self.merchant, transaction)
+
+    def test_direct_transfer_batch_request(self):
+        from securepay import client, encoder
+        from securepay.models import Transaction
+
+        bank_account = {'bsb': '123456', 'account_number': '12345678',
+            'name': 'Test Account'}
+        transactions = [Transaction(amount=amount, txn_type='debit',
+                purchase_order_no='Transfer %s' % amount)
+            for amount in map(Decimal, ['1.00', '2.50', '1000.00'])]
+
+        self.assertSameRequest(
+            client.make_batch_request(self.merchant, [
+                client.make_direct_debit_txn(transaction, bank_account)
+                for transaction in transactions]),
+            encoder.encode_batch_request, self.merchant, [
+                encoder.encode_direct_debit_txn(transaction, bank_account,
+                    txn_id)
+                for txn_id, transaction in enumerate(transactions, 1)])
+
+
+class DecoderTest(TestCase):
+    response = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="no"?>'
+        '<SecurePayMessage>'
+        '<MessageInfo><messageID>8af793f9af34bea0cf40f5fb5c630c</messageID>'
+        '</MessageInfo>'
+        '<RequestType>Payment</RequestType>'
+        '<Status><statusCode>000</statusCode>'
+        '<statusDescription>Normal</statusDescription></Status>'
+        '<Payment><TxnList count="2">'
+        '<Txn ID="1"><txnType>0</txnType><approved>Yes</approved>'
+        '<responseCode>00</responseCode><responseText>Approved</responseText>'
+        '<txnID>009844</txnID><CreditCardInfo><pan>444433...111</pan>'
+        '</CreditCardInfo></Txn>'
+        '<Txn ID="2"><txnType>10</txnType><approved>No</approved>'
+        '<responseCode>51</responseCode>'
+        '<responseText>Insufficient Funds</responseText>'
+        '<preauthID>123456</preauthID></Txn>'
+        '</TxnList></Payment></SecurePayMessage>')
+
+    def test_decode_response(self):
+        from securepay import decoder
+
+        response = decoder.decode_response(self.response)
+        self.assertEqual(response.status_code, '000')
+        self.assertEqual(response.txns, [
+            decoder.TxnResult(id='1', approved='Yes', response_code='00',
+                response_text='Approved', txn_id='009844', preauth_id=None),
+            decoder.TxnResult(id='2', approved='No', response_code='51',
+                response_text='Insufficient Funds', txn_id=None,
+                preauth_id='123456'),
+        ])
+
+    def test_unknown_shape_uses_full_tree(self):
+        from securepay import decoder
+
+        response = decoder.decode_response(
+            '<Response><Txn ID="1"><approved>No</approved></Txn></Response>')
+        self.assertEqual([txn.approved for txn in response.txns], ['No'])
+
+    def test_malformed_response(self):
+        from securepay import decoder
+        from securepay.exceptions import ResponseError
+
+        self.assertRaises(ResponseError, decoder.decode_response,
+            '<html><body>Service Unavailable')
+
+
+class RedactedXMLTest(TestCase):
+    def test_redacts_a_copy(self):
+        from securepay import client
+        from securepay.models import Transaction
+        from securepay.utils import RedactedXML, sample_credit_card_data
+
+        transaction = Transaction(amount=Decimal('1.00'), txn_type='pay',
+            purchase_order_no='Transaction-1')
+        request = client.make_pay_request(
+            {'merchant_id': 'ABC0001', 'password': 'abc123'}, transaction,
+            sample_credit_card_data)
+
+        text = str(RedactedXML(request, censor=True))
+        self.assertFalse('abc123' in text)
+        self.assertFalse(sample_credit_card_data['number'] in text)
+
+        # The request that is actually sent must be left alone
+        self.assertEqual(request.findtext('MerchantInfo/password'), 'abc123')
+
+
+class BatchRequestTest(TestCase):
+    def make_transaction(self, amount, purchase_order_no):
+        from securepay.models import Transaction
+        return Transaction(amount=amount, txn_type='credit',
+            purchase_order_no=purchase_order_no)
+
+    def test_txns_are_numbered_sequentially(self):
+        from securepay import client
+
+        bank_account = {'bsb': '123456', 'account_number': '12345678',
+            'name': 'Test Account'}
+        txns = [client.make_direct_credit_txn(
+                self.make_transaction(10, 'Transfer %d' % i), bank_account)
+            for i in range(3)]
+        request = client.make_batch_request(
+            {'merchant_id': 'ABC0001', 'password': 'abc123'}, txns)
+
+        txn_list = request.find('Payment/TxnList')
+        self.assertEqual(txn_list.get('count'), '3')
+        self.assertEqual([txn.get('ID') for txn in txn_list.findall('Txn')],
+            ['1', '2', '3'])
+
+    def test_batch_size_is_capped(self):
+        from securepay import client
+
+        txns = [client.make_basic_txn(self.make_transaction(1, 'Transfer'))
+            for i in range(client.MAX_BATCH_SIZE + 1)]
+        self.assertRaises(ValueError, client.make_batch_request,
+            {'merchant_id': 'ABC0001', 'password': 'abc123'}, txns)
+
+
+class SessionPoolTest(TestCase):
+    def test_sessions_in_use_are_not_replaced(self):
+        from securepay import client
+
+        endpoint = 'https://test.securepay.com.au/xmlapi/payment'
+        key = (endpoint, None)
+        def idle():
+            client._sessions[key][1] -= client.POOL_KEEPALIVE + 1
+
+        client.reset_sessions()
+        try:
+            with client.pooled_session(endpoint) as session:
+                # A slow request
+                idle()
+                self.assertIs(client.get_session(endpoint), session)
+                idle()
+            # Idle time counts from the end of the request
+            self.assertIs(client.get_session(endpoint), session)
+
+            idle()
+            replaced = client.get_session(endpoint)
+            self.assertIsNot(replaced, session)
+            self.assertIs(client.get_session(endpoint), replaced)
+        finally:
+            client.reset_sessions()
+
+
+class CircuitBreakerTest(TestCase):
+    def test_opens_after_failures_and_lets_one_trial_through(self):
+        from securepay.circuit import CircuitBreaker, CLOSED, HALF_OPEN
+        from securepay.exceptions import CircuitOpen
+
+        breaker = CircuitBreaker('test', failures=2, reset=30)
+        breaker.failure()
+        breaker.before_call()
+        breaker.failure()
+        self.assertRaises(CircuitOpen, breaker.before_call)
+
+        breaker.opened_at -= 30
+        breaker.before_call()
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertRaises(CircuitOpen, breaker.before_call)
+
+        breaker.success()
+        self.assertEqual(breaker.state, CLOSED)
+        breaker.before_call()
+
+    def test_every_trial_request_closes_or_reopens_the_circuit(self):
+        from securepay import circuit, client
+        from securepay.simulator import Simulator, SimulatorAdapter
+
+        class Broken(SimulatorAdapter):
+            def send(self, request, **kwargs):
+                raise ValueError('Not a transport error')
+
+        class Unavailable(Simulator):
+            def respond(self, endpoint, request):
+                return self.render(request, '510', 'Unable to connect', [])
+
+        endpoint = 'https://test.securepay.com.au/xmlapi/payment'
+        breaker = circuit.get_breaker(endpoint)
+        try:
+            for adapter, error in [(Broken, ValueError),
+                    (lambda: SimulatorAdapter(Unavailable()), None)]:
+                client.set_transport_adapter(adapter)
+                breaker.state, breaker.opened_at = circuit.OPEN, 0
+                if error is None:
+                    client.post_request(endpoint, b'<SecurePayMessage/>')
+                else:
+                    self.assertRaises(error, client.post_request, endpoint,
+                        b'<SecurePayMessage/>')
+                self.assertEqual(breaker.state, circuit.OPEN)
+        finally:
+            client.set_transport_adapter(None)
+            circuit.reset_breakers()
+
+    def test_deadline_is_sent_as_timeout_value(self):
+        from securepay import client, encoder
+
+        request = encoder.encode_request(
+            {'merchant_id': 'ABC0001', 'password': 'abc123'}, 'Echo',
+            timeout=client.Timeout(connect=1, read=35, deadline=30))
+        self.assertIn(b'<timeoutValue>30</timeoutValue>', request)
+
+
+class SimulatorTest(TestCase):
+    def send(self, simulator, transaction, credit_card):
+        from securepay import decoder, encoder
+
+        status, body = simulator.handle('/test/xmlapi/payment',
+            encoder.encode_pay_request(
+                {'merchant_id': 'ABC0001', 'password': 'abc123'},
+                transaction, credit_card))
+        self.assertEqual(status, 200)
+        return decoder.decode_response(body).txns[0]
+
+    def test_cents_decide_the_response_code(self):
+        from securepay.models import Transaction
+        from securepay.simulator import Simulator
+        from securepay.utils import sample_credit_card_data
+
+        simulator = Simulator(seed=1)
+        approved = self.send(simulator, Transaction(amount=Decimal('10.00'),
+            txn_type='pay', purchase_order_no='Transaction-1'),
+            sample_credit_card_data)
+        self.assertEqual((approved.approved, approved.response_code),
+            ('Yes', '00'))
+        self.assertTrue(approved.txn_id)
+
+        declined = self.send(simulator, Transaction(amount=Decimal('10.51'),
+            txn_type='pay', purchase_order_no='Transaction-2'),
+            sample_credit_card_data)
+        self.assertEqual((declined.approved, declined.response_code),
+            ('No', '51'))
+
+    def test_query_returns_the_original_outcome(self):
+        from securepay import decoder, encoder
+        from securepay.models import Transaction
+        from securepay.simulator import Simulator
+        from securepay.utils import sample_credit_card_data
+
+        simulator = Simulator(seed=1)
+        merchant = {'merchant_id': 'ABC0001', 'password': 'abc123'}
+        sent = Transaction(amount=Decimal('10.51'), txn_type='pay',
+            purchase_order_no='Transaction-1')
+        lost = Transaction(amount=Decimal('10.00'), txn_type='pay',
+            purchase_order_no='Transaction-2')
+        self.send(simulator, sent, sample_credit_card_data)
+
+        status, body = simulator.handle('/test/xmlapi/payment',
+            encoder.encode_query_request(merchant, [sent, lost]))
+        txns = decoder.decode_response(body).txns
+        self.assertEqual([txn.id for txn in txns], ['1', '2'])
+        self.assertEqual(txns[0].response_code, '51')
+        self.assertEqual(txns[1].response_code, None)
+
+    def test_only_recent_transactions_are_remembered(self):
+        from securepay.models import Transaction
+        from securepay.simulator import Simulator
+        from securepay.utils import sample_credit_card_data
+
+        simulator = Simulator(seed=1, remember=2)
+        simulator.next_id = 999998
+        txns = [self.send(simulator, Transaction(amount=Decimal('10.00'),
+                txn_type='pay', purchase_order_no='Transaction-%d' % i),
+                sample_credit_card_data)
+            for i in range(3)]
+        self.assertEqual([txn.txn_id for txn in txns],
+            ['999999', '1000000', '1000001'])
+        self.assertEqual(list(simulator.transactions), ['1000000', '1000001'])
+        self.assertEqual(len(simulator.outcomes), 2)
+
+
+class TransitionTest(TransactionTestCase):
+    """
+    Not run in a transaction, so that rolling back a conflict can be seen
+    """
+    def make(self, *statuses):
+        from securepay.models import Transaction
+
+        return [Transaction.objects.create(amount=Decimal('10.00'),
+                txn_type='pay', status=status, purchase_order_no='T')
+            for status in statuses]
+
+    def statuses(self, transactions):
+        from securepay.models import Transaction
+
+        saved = Transaction.objects.in_bulk([t.pk for t in transactions])
+        return [saved[t.pk].status for t in transactions]
+
+    def test_transition(self):
+        from securepay.models import _transition
+
+        transactions = self.make('init', '')
+        _transition(transactions, ['', 'init'], 'sending', bank_message='x')
+        self.assertEqual(self.statuses(transactions), ['sending', 'sending'])
+        self.assertEqual([(t.status, t.bank_message) for t in transactions],
+            [('sending', 'x'), ('sending', 'x')])
+
+    def test_transition_conflicts_move_nothing(self):
+        from securepay.exceptions import StatusConflict
+        from securepay.models import _transition
+
+        transactions = self.make('init', 'sending')
+        self.assertRaises(StatusConflict, _transition, transactions,
+            ['', 'init'], 'sending')
+        self.assertEqual(self.statuses(transactions), ['init', 'sending'])
+        self.assertEqual(transactions[0].status, 'init')
+
+    def test_transition_each_conflicts_move_nothing(self):
+        from securepay.exceptions import StatusConflict
+        from securepay.models import _transition_each
+
+        transactions = self.make('receiving', 'completed', 'receiving')
+        self.assertRaises(StatusConflict, _transition_each,
+            [(transaction, {'success': True}) for transaction in transactions],
+            ['receiving'], 'completed')
+        self.assertEqual(self.statuses(transactions),
+            ['receiving', 'completed', 'receiving'])
+
+
+    def test_summaries_leave_the_callers_transaction_alone(self):
+        from django.db import transaction as db_transaction
+        from securepay.models import DailySummary, _transition
+
+        transactions = self.make('receiving')
+        with db_transaction.commit_manually():
+            _transition(transactions, ['receiving'], 'completed',
+                success=True)
+            db_transaction.rollback()
+        self.assertEqual(self.statuses(transactions), ['receiving'])
+        self.assertFalse(DailySummary.objects.exists())
+
+
+class TransactionLogTest(TestCase):
+    def test_logs_are_compressed_and_replaced(self):
+        from securepay.models import Transaction, TransactionLog
+
+        transaction = Transaction.objects.create(amount=Decimal('10.00'),
+            txn_type='pay', purchase_order_no='Transaction-1')
+        text = '<SecurePayMessage>%s</SecurePayMessage>' % ('x' * 1000)
+        TransactionLog.objects.log([transaction], 'request', 'First try')
+        TransactionLog.objects.log([transaction], 'request', text)
+
+        log = TransactionLog.objects.get(transaction=transaction)
+        self.assertEqual(log.kind, 'request')
+        self.assertTrue(len(log.data) < len(text))
+        self.assertEqual(transaction.raw_request, text)
+        self.assertEqual(transaction.raw_response, '')
+
+    def test_migration_moves_responses_both_ways(self):
+        from django.utils.importlib import import_module
+        from securepay.models import Transaction, TransactionLog
+
+        migration = import_module(
+            'securepay.migrations.0006_move_response_text_to_transactionlog')
+        orm = {'securepay.Transaction': Transaction,
+            'securepay.TransactionLog': TransactionLog}
+        transactions = [Transaction.objects.create(amount=Decimal('10.00'),
+                txn_type='pay', purchase_order_no='Transaction-%d' % i,
+                response_text=text)
+            for i, text in enumerate(['<Response>1</Response>', ''])]
+
+        migration.Migration().forwards(orm)
+        moved = Transaction.objects.get(pk=transactions[0].pk)
+        self.assertEqual(moved.response_text, '')
+        self.assertEqual(moved.raw_response, '<Response>1</Response>')
+        self.assertEqual(TransactionLog.objects.count(), 1)
+
+        migration.Migration().backwards(orm)
+        self.assertEqual(
+            Transaction.objects.get(pk=transactions[0].pk).response_text,
+            '<Response>1</Response>')
+        self.assertFalse(TransactionLog.objects.exists())
+
+
+class ExtraDataTest(TestCase):
+    def test_only_loaded_values_are_decoded(self):
+        from securepay.models import Transaction
+
+        def reload(transaction):
+            return Transaction.objects.get(pk=transaction.pk)
+
+        transaction = Transaction.objects.create(amount=Decimal('1.00'),
+            txn_type='pay', extra_data='123')
+        self.assertEqual(transaction.extra_data, '123')
+        self.assertEqual(reload(transaction).extra_data, '123')
+
+        transaction.extra_data = {'invoice': 7, 'lines': [1, 2]}
+        transaction.save()
+        loaded = reload(transaction)
+        self.assertEqual(loaded.extra_data, {'invoice': 7, 'lines': [1, 2]})
+        self.assertEqual(Transaction.objects.only('pk', 'extra_data')
+            .get(pk=transaction.pk).extra_data, loaded.extra_data)
+        self.assertEqual(Transaction.objects.defer('extra_data')
+            .get(pk=transaction.pk).extra_data, loaded.extra_data)
+
+        loaded.extra_data = '[1]'
+        self.assertEqual(loaded.extra_data, '[1]')
+        self.assertEqual(Transaction(pk=loaded.pk, extra_data='{}').extra_data,
+            '{}')
+
+    def test_with_data(self):
+        from securepay import models
+        from securepay.models import Transaction
+
+        keys = models.INDEXED_DATA_KEYS
+        models.INDEXED_DATA_KEYS = ['event_id', 'seat']
+        try:
+            transactions = [Transaction.objects.create(amount=Decimal('1.00'),
+                txn_type='pay', extra_data=data) for data in [
+                    {'event_id': 42, 'seat': 'A1', 'note': 'x'},
+                    {'event_id': 42, 'seat': 'A2'},
+                    {'event_id': 43},
+                    'not a dict']]
+
+            def found(**kwargs):
+                return set(t.pk for t in
+                    Transaction.objects.with_data(**kwargs))
+
+            self.assertEqual(found(event_id=42),
+                set(t.pk for t in transactions[:2]))
+            self.assertEqual(found(event_id='42', seat='A2'),
+                set([transactions[1].pk]))
+            self.assertEqual(found(event_id=44), set())
+            self.assertRaises(ValueError, Transaction.objects.with_data,
+                note='x')
+        finally:
+            models.INDEXED_DATA_KEYS = keys
+
+
+class AllocatorTest(TransactionTestCase):
+    def test_hilo_blocks_are_unique_and_ordered(self):
+        from securepay.allocators import HiLoAllocator
+        from securepay.models import PurchaseOrderSequence, Transaction
+
+        latest = Transaction.objects.create(amount=Decimal('1.00'),
+            txn_type='pay')
+        first, second = HiLoAllocator(block_size=3), HiLoAllocator(block_size=3)
+
+        numbers = first.allocate_many(4) + second.allocate_many(2) \
+            + [first.allocate() for i in range(3)]
+        self.assertEqual(len(set(numbers)), len(numbers))
+        self.assertEqual(numbers[:4], range(latest.pk + 1, latest.pk + 5))
+        self.assertEqual(numbers[6:], sorted(numbers[6:]))
+        self.assertTrue(all(number > latest.pk for number in numbers))
+        self.assertEqual(PurchaseOrderSequence.objects.get().next_value,
+            latest.pk + 1 + 4 + 3 + 3)
+
+    def test_hilo_leaves_the_callers_transaction_alone(self):
+        from django.db import transaction as db_transaction
+        from securepay.allocators import HiLoAllocator
+        from securepay.models import Transaction
+
+        with db_transaction.commit_manually():
+            Transaction.objects.create(amount=Decimal('1.00'), txn_type='pay')
+            HiLoAllocator().allocate()
+            db_transaction.rollback()
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_hilo_blocks_are_not_kept_after_a_rollback(self):
+        from django.db import transaction as db_transaction
+        from securepay.allocators import HiLoAllocator
+
+        first, second = HiLoAllocator(block_size=5), HiLoAllocator(block_size=5)
+        first.allocate()
+        with db_transaction.commit_manually():
+            rolled_back = first.allocate_many(6)
+            db_transaction.rollback()
+
+        numbers = second.allocate_many(5) + first.allocate_many(5)
+        self.assertEqual(len(set(numbers)), len(numbers))
+        self.assertTrue(set(rolled_back[:4]).isdisjoint(numbers))
+
+    def test_time_ordered_numbers_are_unique_and_ordered(self):
+        from securepay.allocators import TimeOrderedAllocator
+
+        numbers = [TimeOrderedAllocator(node=1).allocate()] \
+            + TimeOrderedAllocator(node=2).allocate_many(5000)
+        self.assertEqual(len(set(numbers)), len(numbers))
+        self.assertEqual(numbers[1:], sorted(numbers[1:]))
+
+
+class QueryPlanTest(TestCase):
+    """
+    Check that the common transaction lookups use an index. Only run on
+    SQLite, where the plan is easy to read.
+    """
+    def get_plan(self, queryset):
+        from django.db import connection
+
+        sql, params = queryset.query.sql_with_params()
+        cursor = connection.cursor()
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return ' '.join(row[-1] for row in cursor.fetchall())
+
+    def assertUsesIndex(self, queryset):
+        plan = self.get_plan(queryset)
+        self.assertTrue('USING INDEX' in plan
+            or 'USING COVERING INDEX' in plan, plan)
+
+    def test_lookups_use_indexes(self):
+        from django.db import connection
+        from securepay.models import Transaction
+
+        if connection.vendor != 'sqlite':
+            return
+
+        objects = Transaction.objects.order_by()
+        self.assertUsesIndex(objects.filter(purchase_order_no='Transaction-1'))
+        self.assertUsesIndex(objects.filter(txn_id='123456'))
+        self.assertUsesIndex(objects.filter(preauth_id='123456'))
+        self.assertUsesIndex(objects.filter(reference_transaction=1))
+
+    def test_migration_indexes(self):
+        import datetime
+        from django.db import connection
+        from django.utils import timezone
+        from django.utils.importlib import import_module
+        from securepay.models import Transaction
+
+        if connection.vendor != 'sqlite':
+            return
+
+        # The test database is made with syncdb, which already made the
+        # single column indexes, so only add the ones the migration names
+        migration = import_module(
+            'securepay.migrations.0010_add_transaction_lookup_indexes')
+        indexes = migration.INDEXES
+        migration.INDEXES = [index for index in indexes if index[0]]
+        try:
+            migration.Migration().forwards(None)
+        finally:
+            migration.INDEXES = indexes
+
+        since = timezone.now() - datetime.timedelta(days=1)
+        plan = self.get_plan(Transaction.objects.order_by().filter(
+            txn_type='refund', success=True, created__gte=since))
+        self.assertTrue('securepay_transaction_type_success_created' in plan,
+            plan)
+        plan = self.get_plan(Transaction.objects.order_by().filter(
+            reference_transaction=1, txn_type='refund'))
+        self.assertTrue('securepay_transaction_reference_type' in plan, plan)
+
+        cursor = connection.cursor()
+        cursor.execute("SELECT sql FROM sqlite_master WHERE name = %s",
+            ['securepay_transaction_in_flight'])
+        self.assertTrue(cursor.fetchone()[0].endswith(
+            "WHERE status <> 'completed'"))
+
+
+class DailySummaryTest(TestCase):
+    def test_incremental_totals_match_a_rebuild(self):
+        from securepay.models import DailySummary, Transaction, _transition
+
+        transactions = [Transaction.objects.create(amount=Decimal(amount),
+            txn_type='pay', status='receiving', purchase_order_no='T')
+            for amount in ['10.00', '20.00', '5.00']]
+        _transition(transactions[:2], ['receiving'], 'completed',
+            success=True)
+        _transition(transactions[2:], ['receiving'], 'completed',
+            success=False)
+
+        def totals():
+            return [(row['transactions'], row['successful'], row['amount'],
+                row['successful_amount'], row['success_rate'])
+                for row in DailySummary.objects.totals(group_by=['txn_type'])]
+
+        expected = [(3, 2, Decimal('35.00'), Decimal('30.00'), 2.0 / 3)]
+        self.assertEqual(totals(), expected)
+
+        for summary in DailySummary.objects.all():
+            DailySummary.objects.rebuild(summary.date)
+        self.assertEqual(totals(), expected)
+
+
+class ReconcilerTest(TestCase):
+    merchant = {'merchant_id': 'ABC0001', 'password': 'abc123'}
+
+    def setUp(self):
+        from securepay import client
+        from securepay.simulator import Simulator, SimulatorAdapter
+
+        self.simulator = Simulator(seed=1)
+        client.set_transport_adapter(
+            lambda: SimulatorAdapter(self.simulator))
+
+    def tearDown(self):
+        from securepay import circuit, client
+
+        client.set_transport_adapter(None)
+        circuit.reset_breakers()
+
+    def make_stale(self, transactions):
+        import datetime
+        from django.utils import timezone
+        from securepay.models import Transaction
+
+        Transaction.objects.filter(pk__in=[t.pk for t in transactions]) \
+            .update(modified=timezone.now() - datetime.timedelta(hours=1))
+
+    def test_partial_batch_results_are_matched_to_their_transactions(self):
+        from xml.etree import ElementTree
+        from securepay import decoder, encoder, reconciler
+        from securepay.models import Transaction, TransactionLog, \
+            _response_fields, _transition_each
+
+        bank_account = {'bsb': '123456', 'account_number': '12345678',
+            'name': 'Test Account'}
+        transactions = [Transaction.objects.create(amount=Decimal(amount),
+                txn_type='credit', status='receiving',
+                purchase_order_no='Payout 1-%d' % i)
+            for i, amount in enumerate(['10.00', '10.51'])]
+        status, body = self.simulator.handle('/test/xmlapi/directentry',
+            encoder.encode_batch_request(self.merchant, [
+                encoder.encode_direct_credit_txn(transaction, bank_account,
+                    txn_id)
+                for txn_id, transaction in enumerate(transactions, 1)]))
+
+        # The response only answered the first transaction, and the process
+        # died after saving its result
+        response = ElementTree.fromstring(body)
+        txn_list = response.find('Payment/TxnList')
+        txn_list.remove(txn_list.findall('Txn')[1])
+        body = ElementTree.tostring(response)
+        TransactionLog.objects.log(transactions, 'response', body)
+        approved = decoder.decode_response(body).txns[0]
+        _transition_each([(transactions[0], _response_fields(approved))],
+            ['receiving'], 'completed')
+        self.make_stale(transactions)
+
+        counts = reconciler.reconcile(stale_after=60, query=True)
+        self.assertEqual(counts['resolved'], 1)
+        declined = Transaction.objects.get(pk=transactions[1].pk)
+        self.assertEqual((declined.status, declined.success,
+            declined.response_code), ('completed', False, '51'))
+        self.assertNotEqual(declined.txn_id, approved.txn_id)
+
+    def test_unsaved_results_are_queried(self):
+        from securepay import encoder, reconciler
+        from securepay.models import Transaction
+        from securepay.utils import sample_credit_card_data
+
+        sent, lost = [Transaction.objects.create(amount=Decimal('10.00'),
+                txn_type='pay', status='sending', purchase_order_no=number)
+            for number in ['Transaction-1', 'Transaction-2']]
+        self.simulator.handle('/test/xmlapi/payment',
+            encoder.encode_pay_request(self.merchant, sent,
+                sample_credit_card_data))
+        self.make_stale([sent, lost])
+
+        counts = reconciler.reconcile(stale_after=60, query=True)
+        self.assertEqual((counts['resolved'], counts['not_received']), (1, 1))
+
+        sent = Transaction.objects.get(pk=sent.pk)
+        self.assertEqual((sent.status, sent.success, sent.response_code),
+            ('completed', True, '00'))
+        lost = Transaction.objects.get(pk=lost.pk)
+        self.assertEqual((lost.status, lost.success, lost.bank_message),
+            ('completed', False, reconciler.NOT_RECEIVED))
+
+    def test_unanswered_queries_release_transactions(self):
+        from securepay import client, reconciler
+        from securepay.models import Transaction
+        from securepay.simulator import Simulator, SimulatorAdapter
+
+        class Rejecting(Simulator):
+            def respond(self, endpoint, request):
+                # Echo the Txns back, with no response codes
+                return self.render(request, '577', 'Invalid request type',
+                    request.findall('Payment/TxnList/Txn'))
+
+        transaction = Transaction.objects.create(amount=Decimal('10.00'),
+            txn_type='pay', status='receiving', purchase_order_no='T')
+        self.make_stale([transaction])
+        self.assertEqual(reconciler.reconcile(stale_after=60)['released'], 1)
+
+        client.set_transport_adapter(lambda: SimulatorAdapter(Rejecting()))
+        self.make_stale([transaction])
+        counts = reconciler.reconcile(stale_after=60, query=True)
+        self.assertEqual((counts['released'], counts['not_received']), (1, 0))
+        self.assertEqual(Transaction.objects.get(pk=transaction.pk).status,
+            'receiving')
+
+    def test_claims_are_guarded(self):
+        from securepay import reconciler
+        from securepay.models import Transaction
+
+        transaction = Transaction.objects.create(amount=Decimal('10.00'),
+            txn_type='pay', status='receiving', purchase_order_no='T')
+        self.make_stale([transaction])
+        stale = list(reconciler.find_stale(60))
+        self.assertEqual(stale, [transaction])
+
+        # Something else touched it after it was fetched
+        Transaction.objects.filter(pk=transaction.pk).update(status='sending')
+        self.assertEqual(reconciler.claim(stale), [])
+
+
+class DispatchTest(TestCase):
+    def test_slots_apply_backpressure(self):
+        from securepay.dispatch import Slots
+
+        slots = Slots(2)
+        self.assertTrue(slots.acquire(0))
+        self.assertTrue(slots.acquire(0))
+        self.assertFalse(slots.acquire(0.01))
+        slots.release()
+        self.assertTrue(slots.acquire(0))
+
+    def test_transactions_are_sent_on_the_pool(self):
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        from securepay import client, dispatch
+        from securepay.models import Transaction
+        from securepay.simulator import Simulator, SimulatorAdapter
+        from securepay.utils import sample_credit_card_data
+
+        executor = ThreadPoolExecutor(max_workers=1)
+        slots = dispatch.Slots(2)
+        dispatch._pool = (executor, slots)
+        client.set_transport_adapter(
+            lambda: SimulatorAdapter(Simulator(seed=1)))
+
+        threads = []
+        def callback(transaction):
+            threads.append(threading.current_thread())
+            return True
+
+        try:
+            with SharedConnection():
+                handle = Transaction.objects.dispatched(callback).pay(
+                    Decimal('10.00'), sample_credit_card_data)
+                transaction = handle.result(timeout=10)
+        finally:
+            client.set_transport_adapter(None)
+            executor.shutdown()
+            dispatch._pool = None
+
+        self.assertTrue(handle.done())
+        self.assertEqual((transaction.status, transaction.success),
+            ('completed', True))
+        self.assertEqual(handle.status(), ('completed', True))
+        self.assertNotEqual(threads, [threading.current_thread()])
+        self.assertEqual(Transaction.objects.get(pk=transaction.pk).processed,
+            True)
+        self.assertEqual(slots.free, 2)
+
+
+class MerchantTest(TestCase):
+    def test_merchants_have_their_own_credentials(self):
+        from securepay import encoder, merchants
+
+        events = merchants.register('events', 'ABC0002', 'def456',
+            rate_limit=100)
+        self.assertIs(merchants.get_merchant('events'), events)
+        self.assertIn(b'<merchantID>ABC0002</merchantID>',
+            encoder.encode_merchant_info(events))
+        self.assertRaises(merchants.UnknownMerchant,
+            merchants.get_merchant, 'nobody')
+
+
+class MetricsTest(TestCase):
+    def test_phases_are_timed(self):
+        from securepay import metrics
+
+        self.assertIs(metrics.start('pay'), metrics.NULL_TIMINGS)
+
+        received = []
+        metrics.add_sink(received.append)
+        try:
+            timings = metrics.start('pay', 2)
+            timings.lap('build')
+            timings.lap('send')
+            timings.lap('build')
+            timings.finish(response_codes=['00', '51'])
+        finally:
+            metrics.remove_sink(received.append)
+
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0]['count'], 2)
+        self.assertEqual(sorted(received[0]['phases']), ['build', 'send'])
+        self.assertEqual(received[0]['response_codes'], ['00', '51'])
+
+    def test_lazy_sinks_are_made_once(self):
+        import threading
+        import time
+        from securepay import metrics
+
+        made = []
+        received = []
+        def factory():
+            time.sleep(0.01)
+            made.append(True)
+            return received.append
+
+        sink = metrics._LazySink(factory)
+        threads = [threading.Thread(target=sink, args=({'count': 1},))
+            for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((len(made), len(received)), (1, 8))
+
+
+class ProbeTest(TestCase):
+    def test_histogram_only_keeps_the_window(self):
+        from securepay.probe import RollingHistogram
+
+        histogram = RollingHistogram(window=10, buckets=[100, 1000])
+        histogram.add(0.01, now=0)
+        histogram.add(0.2, now=5)
+        histogram.add(0.05, now=6)
+        histogram.add(3, now=7)
+
+        summary = histogram.snapshot(now=12)
+        self.assertEqual(summary['count'], 3)
+        self.assertEqual(summary['buckets'], [(100, 1), (1000, 1), (None, 1)])
+        self.assertEqual(summary['p50'], 200)
+
+    def test_echo_times_only_the_round_trip(self):
+        import time
+        from securepay import client, merchants, probe
+        from securepay.simulator import Simulator, SimulatorAdapter
+
+        merchant = merchants.register('throttled', 'ABC0003', 'ghi789')
+        merchant.throttle = lambda: time.sleep(0.2)
+        client.set_transport_adapter(
+            lambda: SimulatorAdapter(Simulator(seed=1)))
+        endpoint = probe.get_endpoints()[0]
+        try:
+            rtt = probe.echo(endpoint, merchant)
+        finally:
+            client.set_transport_adapter(None)
+        self.assertTrue(0 <= rtt < 0.1, rtt)
+        self.assertEqual(probe.get_histogram(endpoint).snapshot()['count'], 1)
+
+
+class PayoutTest(TestCase):
+    def test_results_are_written_in_one_update(self):
+        from securepay.models import Transaction, _transition_each
+
+        transactions = [Transaction.objects.create(amount=Decimal('1.00'),
+            txn_type='credit', status='receiving',
+            purchase_order_no='Payout test-%d' % i) for i in range(2)]
+        _transition_each([
+            (transactions[0], {'success': True, 'txn_id': '000001'}),
+            (transactions[1], {'success': False, 'txn_id': None}),
+        ], ['receiving'], 'completed')
+
+        saved = Transaction.objects.in_bulk([t.pk for t in transactions])
+        self.assertEqual(
+            [(saved[t.pk].status, saved[t.pk].success, saved[t.pk].txn_id)
+                for t in transactions],
+            [('completed', True, '000001'), ('completed', False, None)])
+
+    def test_run_names_must_fit_in_a_purchase_order_number(self):
+        from securepay import payouts
+
+        self.assertRaises(ValueError, list,
+            payouts.payout('x' * 50, [], amount=Decimal('1.00')))
+
+    def test_payouts_resume_after_the_circuit_opens(self):
+        from securepay import circuit, client, models, payouts
+        from securepay.models import BankAccount, Transaction, TransactionLog
+        from securepay.simulator import Simulator, SimulatorAdapter
+
+        accounts = [BankAccount.objects.create(name='Account %d' % i,
+            bsb='123456', account_number='1234567%d' % i) for i in range(3)]
+        breaker = circuit.get_breaker(models.get_endpoint('credit'))
+        for i in range(circuit.FAILURES):
+            breaker.failure()
+
+        client.set_transport_adapter(
+            lambda: SimulatorAdapter(Simulator(seed=1)))
+        settings = (models.LOG_REQUESTS, models.INDEXED_DATA_KEYS)
+        models.LOG_REQUESTS, models.INDEXED_DATA_KEYS = True, ['payroll']
+        try:
+            with SharedConnection():
+                progress = list(payouts.payout('October', accounts,
+                    amount=Decimal('10.00'), data={'payroll': 'October'},
+                    workers=1))
+                self.assertEqual((progress[-1].created, progress[-1].failed),
+                    (3, 3))
+
+                circuit.reset_breakers()
+                progress = list(payouts.payout('October', accounts,
+                    amount=Decimal('10.00'), data={'payroll': 'October'},
+                    workers=1))
+            paid = Transaction.objects.with_data(payroll='October').count()
+        finally:
+            client.set_transport_adapter(None)
+            circuit.reset_breakers()
+            models.LOG_REQUESTS, models.INDEXED_DATA_KEYS = settings
+
+        self.assertEqual((progress[-1].created, progress[-1].approved), (0, 3))
+        self.assertEqual(set(Transaction.objects.values_list('status',
+            flat=True)), set(['completed']))
+        self.assertEqual(TransactionLog.objects.filter(kind='request').count(),
+            3)
+        self.assertEqual(paid, 3)
+
+
+class MassRefundTest(TestCase):
+    def test_never_refunds_twice(self):
+        from securepay.models import Transaction
+        from securepay.refunds import _prepare
+
+        def make(**kwargs):
+            return Transaction.objects.create(amount=Decimal('10.00'),
+                status='completed', success=True, txn_id='000001',
+                purchase_order_no='Transaction-1', **kwargs)
+
+        paid = make(txn_type='pay')
+        refunded = make(txn_type='pay')
+        make(txn_type='refund', reference_transaction=refunded)
+        preauth = make(txn_type='preauth')
+
+        report = []
+        batches = _prepare([paid.pk, refunded.pk, preauth.pk], 'refund', {},
+            report)
+
+        self.assertEqual(
+            sorted((result.reference.pk, result.outcome) for result in report),
+            [(refunded.pk, 'already_refunded'),
+                (preauth.pk, 'not_refundable')])
+        self.assertEqual([[refund.reference_transaction_id
+            for refund in batch] for batch in batches], [[paid.pk]])
+
+    def test_refunds_are_indexed(self):
+        from securepay import models
+        from securepay.models import Transaction
+        from securepay.refunds import _prepare
+
+        paid = Transaction.objects.create(amount=Decimal('10.00'),
+            txn_type='pay', status='completed', success=True,
+            txn_id='000001', purchase_order_no='Transaction-1')
+
+        keys = models.INDEXED_DATA_KEYS
+        models.INDEXED_DATA_KEYS = ['event_id']
+        try:
+            _prepare([paid.pk], 'refund', {'event_id': 42}, [])
+            _prepare([paid.pk], 'refund', {'event_id': 42}, [])
+            refunds = list(Transaction.objects.with_data(event_id=42))
+        finally:
+            models.INDEXED_DATA_KEYS = keys
+
+        self.assertEqual([(refund.txn_type, refund.reference_transaction_id)
+            for refund in refunds], [('refund', paid.pk)])
+
+
+class ArchiveTest(TransactionTestCase):
+    def test_archive_and_restore(self):
+        import datetime
+        from django.utils import timezone
+        from securepay import archive
+        from securepay.models import ArchivedTransaction, Transaction, \
+            TransactionLog
+        from securepay.utils import compress_text
+
+        def create(**kwargs):
+            kwargs.setdefault('status', 'completed')
+            return Transaction.objects.create(amount=Decimal('10.00'),
+                success=True, **kwargs)
+
+        original = create(txn_type='pay', purchase_order_no='A')
+        TransactionLog.objects.create(transaction=original, kind='response',
+            data=compress_text('<SecurePayMessage/>'))
+        refund = create(txn_type='refund', purchase_order_no='A',
+            reference_transaction=original)
+        kept = create(txn_type='pay', purchase_order_no='B')
+        create(txn_type='refund', purchase_order_no='B',
+            reference_transaction=kept, status='init')
+        Transaction.objects.filter(status='completed').update(
+            created=timezone.now() - datetime.timedelta(days=60))
+
+        self.assertEqual(archive.archive(older_than=30), 2)
+        found = Transaction.objects.find(purchase_order_no='A')
+        self.assertEqual(set(t.pk for t in found),
+            set([original.pk, refund.pk]))
+        self.assertTrue(all(t.is_archived for t in found))
+        self.assertTrue(Transaction.objects.filter(pk=kept.pk).exists())
+
+        archived = ArchivedTransaction.objects.get(pk=refund.pk)
+        self.assertEqual(archived.reference_transaction.pk, original.pk)
+
+        restored = archive.restore(archived)
+        self.assertEqual(restored.reference_transaction_id, original.pk)
+        self.assertEqual(restored.reference_transaction.raw_response,
+            '<SecurePayMessage/>')
+        self.assertFalse(ArchivedTransaction.objects.exists())
+
+        # A second restore from a stale copy gets the restored transaction
+        self.assertEqual(archive.restore(archived).pk, archived.pk)
+
+    def test_restore_leaves_the_callers_transaction_alone(self):
+        import datetime
+        from django.db import transaction as db_transaction
+        from django.utils import timezone
+        from securepay import archive
+        from securepay.models import ArchivedTransaction, BankAccount, \
+            Transaction
+
+        transaction = Transaction.objects.create(amount=Decimal('10.00'),
+            txn_type='pay', status='completed', success=True)
+        Transaction.objects.filter(pk=transaction.pk).update(
+            created=timezone.now() - datetime.timedelta(days=60))
+        archive.archive(older_than=30)
+        archived = ArchivedTransaction.objects.get()
+
+        with db_transaction.commit_manually():
+            BankAccount.objects.create(name='Test', bsb='123456',
+                account_number='12345678')
+            archive.restore(archived)
+            db_transaction.rollback()
+        self.assertFalse(BankAccount.objects.exists())
+        self.assertTrue(ArchivedTransaction.objects.exists())
+        self.assertFalse(Transaction.objects.exists())
+
+
+class AdminTest(TestCase):
+    def changelist(self, model_admin, **params):
+        from django.contrib.auth.models import User
+        from django.test.client import RequestFactory
+
+        request = RequestFactory().get('/', params)
+        request.user = User(username='admin', is_staff=True,
+            is_superuser=True)
+        return model_admin.changelist_view(request).context_data['cl']
+
+    def test_keyset_changelist(self):
+        from django.contrib import admin
+        from securepay.admin import EstimatedCountPaginator, \
+            KeysetChangeList, TransactionAdmin
+        from securepay.models import Transaction
+
+        class HighVolumeAdmin(TransactionAdmin):
+            date_hierarchy = None
+            search_fields = ['=purchase_order_no', '=txn_id', '=preauth_id']
+            paginator = EstimatedCountPaginator
+            list_per_page = 2
+
+            def get_changelist(self, request, **kwargs):
+                return KeysetChangeList
+
+        pks = [Transaction.objects.create(amount=Decimal('1.00'),
+            txn_type='pay', purchase_order_no='Order-%d' % i).pk
+            for i in range(5)]
+        model_admin = HighVolumeAdmin(Transaction, admin.site)
+
+        cl = self.changelist(model_admin)
+        self.assertEqual([t.pk for t in cl.result_list], pks[:2:-1])
+        self.assertEqual(cl.result_count, 5)
+        cl = self.changelist(model_admin, before=cl.next_before)
+        self.assertEqual([t.pk for t in cl.result_list], pks[2:0:-1])
+        cl = self.changelist(model_admin, before=cl.next_before)
+        self.assertEqual([t.pk for t in cl.result_list], pks[:1])
+        self.assertEqual(cl.next_before, None)
+
+        cl = self.changelist(model_admin, q='Order-3')
+        self.assertEqual([t.pk for t in cl.result_list], [pks[3]])
+        self.assertEqual(cl.full_result_count, 5)
+        # Case sensitive, so the index on each identifier can be used
+        cl = self.changelist(model_admin, q='order-3')
+        self.assertEqual(cl.result_list, [])
+        self.assertNotIn('LIKE', str(cl.query_set.query))
+
+    def test_merchant_filter(self):
+        from django.contrib import admin
+        from securepay import merchants
+        from securepay.admin import TransactionAdmin
+        from securepay.models import Transaction
+
+        merchants.register('events', 'ABC0002', 'def456')
+        for merchant in ['default', 'events', 'events']:
+            Transaction.objects.create(amount=Decimal('1.00'),
+                txn_type='pay', merchant=merchant)
+        model_admin = TransactionAdmin(Transaction, admin.site)
+
+        cl = self.changelist(model_admin, merchant='events')
+        self.assertEqual(len(cl.result_list), 2)
+        merchant_filter = cl.filter_specs[-1]
+        self.assertIn(('events', 'events'), merchant_filter.lookup_choices)
+
+    def test_keyset_changelist_falls_back_to_offsets_when_sorted(self):
+        from django.contrib import admin
+        from securepay.admin import KeysetChangeList, TransactionAdmin
+        from securepay.models import Transaction
+
+        class HighVolumeAdmin(TransactionAdmin):
+            date_hierarchy = None
+            list_per_page = 2
+
+            def get_changelist(self, request, **kwargs):
+                return KeysetChangeList
+
+        for amount in ['3.00', '1.00', '2.00']:
+            Transaction.objects.create(amount=Decimal(amount), txn_type='pay')
+        model_admin = HighVolumeAdmin(Transaction, admin.site)
+
+        # Sort by amount, the second column after the action checkbox
+        cl = self.changelist(model_admin, o='2', before='1')
+        self.assertFalse(cl.keyset)
+        self.assertEqual([t.amount for t in cl.result_list],
+            [Decimal('1.00'), Decimal('2.00')])
+        self.assertTrue(cl.multi_page)
+        cl = self.changelist(model_admin, o='2', p='1')
+        self.assertEqual([t.amount for t in cl.result_list], [Decimal('3.00')])
+
+    def test_estimated_count_paginator(self):
+        from securepay.admin import EstimatedCountPaginator
+        from securepay.models import Transaction
+
+        for i in range(3):
+            Transaction.objects.create(amount=Decimal('1.00'), txn_type='pay')
+        paginator = EstimatedCountPaginator(Transaction.objects.all(), 2)
+        # Databases other than PostgreSQL always get an exact count
+        self.assertEqual(paginator.count, 3)
+        self.assertEqual(paginator.num_pages, 2)
+
+
+class ExportTest(TestCase):
+    def test_exports_in_chunks(self):
+        import json
+        from securepay import export
+        from securepay.models import Transaction
+
+        for amount in ['1.00', '2.00', '3.00']:
+            Transaction.objects.create(amount=Decimal(amount), txn_type='pay',
+                purchase_order_no='E', extra_data={'invoice': amount})
+        queryset = Transaction.objects.all()
+
+        lines = list(export.export(queryset, 'csv',
+            ['amount', 'txn_type'], chunk_size=2))
+        self.assertEqual(lines, ['amount,txn_type\r\n', '1.00,pay\r\n',
+            '2.00,pay\r\n', '3.00,pay\r\n'])
+
+        lines = list(export.export(queryset, 'jsonl',
+            ['amount', 'extra_data'], chunk_size=2))
+        self.assertEqual([json.loads(line) for line in lines], [
+            {'amount': amount, 'extra_data': {'invoice': amount}}
+            for amount in ['1.00', '2.00', '3.00']])
+
+        self.assertRaises(ValueError, export.export, queryset, 'csv',
+            ['response_txt'])
@@ -0,0 +1,5 @@
+from django.conf.urls import patterns, url
+
+urlpatterns = patterns('securepay.views',
+    url(r'^export/$', 'export_transactions', name='securepay_export'),
+)
@@ -1,7 +1,15 @@
+import re
+import time
+import zlib
+import threading
+import base64
+from contextlib import contextmanager
 from logging import Filter
 from xml.etree import ElementTree
 
 from django.conf import settings
+from django.db import connection
+from django.db import transaction as db_transaction
 
 # On 2.6.6, <ElementTree.Element> is function which constructs an 
 # <ElementTree._ElementInterface> instance. On 2.7.7, it is a class.
@@ -9,11 +17,109 @@ from django.conf import settings
 # so we extract the class here for later use
 ELEMENT_CLASS = ElementTree.Element('dummy').__class__
 
-class Merchant:
-    def __init__(self, merchant_id, password):
+class Merchant(object):
+    """
+    A SecurePay merchant account. See <securepay.merchants>.
+
+    Parameters:
+        name - The name the merchant is registered under, and saved as
+            <Transaction.merchant>.
+        merchant_id, password - The SecurePay credentials.
+        rate_limit - The most requests per second to send for this merchant,
+            or `None` for no limit.
+        pool_maxsize - The number of keep-alive connections to hold open for
+            this merchant. Defaults to `SECUREPAY_POOL_MAXSIZE`.
+
+    Merchants can be used anywhere a dict of merchant credentials is expected.
+    """
+    def __init__(self, merchant_id, password, name='default', rate_limit=None,
+        pool_maxsize=None):
+        self.name = name
         self.merchant_id = merchant_id
         self.password = password
+        self.pool_maxsize = pool_maxsize
+        self.rate_limiter = RateLimiter(rate_limit) if rate_limit else None
+
+    def __getitem__(self, key):
+        if key not in ('merchant_id', 'password'):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def throttle(self):
+        """
+        Wait until another request can be sent within the rate limit
+        """
+        if self.rate_limiter is not None:
+            self.rate_limiter.wait()
+
+    def __repr__(self):
+        return '<Merchant %s (%s)>' % (self.name, self.merchant_id)
+
+
+class RateLimiter(object):
+    """
+    A token bucket allowing `rate` calls per second, in bursts of up to
+    `rate` calls. Safe to share between threads.
+    """
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.tokens = self.rate
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.rate,
+                    self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+def estimate_count(queryset, threshold=10000):
+    """
+    Count the rows in a queryset. On PostgreSQL, if the query planner thinks
+    there are more than `threshold` rows, its estimate is returned instead of
+    doing an exact (and slow) `COUNT(*)`. Other databases always get an exact
+    count.
+    """
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+
+    sql, params = queryset.query.sql_with_params()
+    cursor = connection.cursor()
+    cursor.execute('EXPLAIN ' + sql, params)
+    match = re.search(r' rows=(\d+) ', cursor.fetchone()[0])
+
+    if match is None or int(match.group(1)) < threshold:
+        return queryset.count()
+    return int(match.group(1))
+
+@contextmanager
+def atomic(using=None):
+    """
+    Run a block as a unit. Outside a transaction, it is committed when the
+    block finishes, or rolled back if it raises, like `commit_on_success`.
+    Inside a transaction the caller manages, it runs in a savepoint instead,
+    and the outer transaction is left for the caller to commit.
+    """
+    if not db_transaction.is_managed(using=using):
+        with db_transaction.commit_on_success(using=using):
+            yield
+        return
 
+    sid = db_transaction.savepoint(using=using)
+    try:
+        yield
+    except Exception:
+        db_transaction.savepoint_rollback(sid, using=using)
+        raise
+    db_transaction.savepoint_commit(sid, using=using)
 
 def remove_sensitive_info(xml):
     for cc_info in xml.findall('Payment/TxnList/Txn/CreditCardInfo'):
@@ -25,6 +131,77 @@ def remove_sensitive_info(xml):
 
     return xml
 
+def redact_request(request):
+    """
+    Get a copy of a request or response with all the sensitive information
+    removed, as a string. The XML can be an <ElementTree.Element>, a byte
+    string as made by <securepay.encoder>, or response text, and is not
+    modified.
+    """
+    if isinstance(request, ELEMENT_CLASS):
+        request = ElementTree.tostring(request)
+    elif not isinstance(request, bytes):
+        request = request.encode('utf-8')
+    xml = remove_sensitive_info(ElementTree.fromstring(request))
+    return ElementTree.tostring(xml).decode('ascii')
+
+class RedactedXML(object):
+    """
+    Wraps a request or response for logging. It is only serialised, with the
+    sensitive information removed unless `censor` is false, when the log
+    record is actually formatted, and only once no matter how many handlers
+    format it. The wrapped XML is never modified. Text that is not XML is
+    logged as is.
+    """
+    def __init__(self, xml, censor=None):
+        self.xml = xml
+        self.censor = censor
+        self._text = None
+
+    def render(self):
+        censor = self.censor
+        if censor is None:
+            # Do not obfuscate things in debug mode
+            censor = not settings.DEBUG
+
+        xml = self.xml
+        if censor:
+            try:
+                return redact_request(xml)
+            except SyntaxError:
+                pass
+        elif isinstance(xml, ELEMENT_CLASS):
+            xml = ElementTree.tostring(xml)
+
+        if isinstance(xml, bytes):
+            return xml.decode('utf-8', 'replace')
+        return xml
+
+    def __unicode__(self):
+        if self._text is None:
+            self._text = self.render()
+        return self._text
+
+    def __str__(self):
+        text = self.__unicode__()
+        if not isinstance(text, str):
+            # Python 2
+            text = text.encode('utf-8')
+        return text
+
+def compress_text(text):
+    """
+    Compress some text for storage in a text column
+    """
+    compressed = zlib.compress(text.encode('utf-8'))
+    return base64.b64encode(compressed).decode('ascii')
+
+def decompress_text(data):
+    """
+    Reverse <compress_text>
+    """
+    return zlib.decompress(base64.b64decode(data)).decode('utf-8')
+
 def remove_text_if_exists(root, child_name):
     if root is None:
         return
@@ -43,20 +220,18 @@ sample_credit_card_data = {
 
 
 class SecurePayFilter(Filter):
+    """
+    Makes sure no XML elements are logged with sensitive information in them.
+    <securepay.client> already logs <RedactedXML>, so this is only needed for
+    elements logged elsewhere. Elements are wrapped in a <RedactedXML>, so
+    nothing is serialised until a handler formats the record.
+    """
     def filter(self, record):
-        # Do not obfuscate things in debug mode
-        censor = not settings.DEBUG
-
-        # Escape the message and its args, if any of them are XML
-        record.msg = self.filter_value(record.msg, censor)
-        record.args = tuple(self.filter_value(x, censor)
-            for x in record.args)
+        record.msg = self.filter_value(record.msg)
+        record.args = tuple(self.filter_value(x) for x in record.args)
         return True
 
-    def filter_value(self, value, censor):
+    def filter_value(self, value):
         if not isinstance(value, ELEMENT_CLASS):
             return value
-
-        if censor:
-            remove_sensitive_info(value)
-        return ElementTree.tostring(value)
+        return RedactedXML(value)
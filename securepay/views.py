@@ -1 +1,52 @@
-# Create your views here.
+import datetime
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import HttpResponseBadRequest
+
+from securepay import export
+from securepay.models import ArchivedTransaction, Transaction, _day_start
+
+#: Query string parameters <export_transactions> filters on
+FILTERS = ['status', 'txn_type', 'merchant', 'purchase_order_no', 'txn_id']
+
+
+@staff_member_required
+def export_transactions(request):
+    """
+    Stream transactions as CSV or JSON lines. See <securepay.export>.
+
+    Query string parameters:
+        format - `csv` (the default) or `jsonl`.
+        columns - Comma separated fields to export.
+        since, until - Only export transactions created on or between these
+            days, as YYYY-MM-DD.
+        archived - Export archived transactions instead, if present.
+        status, txn_type, merchant, purchase_order_no, txn_id - Only export
+            transactions with these values.
+    """
+    model = ArchivedTransaction if 'archived' in request.GET else Transaction
+    queryset = model.objects.all()
+    try:
+        if request.GET.get('since'):
+            queryset = queryset.filter(
+                created__gte=_day_start(_parse_date(request.GET['since'])))
+        if request.GET.get('until'):
+            until = _parse_date(request.GET['until']) \
+                + datetime.timedelta(days=1)
+            queryset = queryset.filter(created__lt=_day_start(until))
+        for name in FILTERS:
+            if request.GET.get(name):
+                queryset = queryset.filter(**{name: request.GET[name]})
+
+        columns = None
+        if request.GET.get('columns'):
+            columns = [column.strip()
+                for column in request.GET['columns'].split(',')]
+
+        return export.export_response(queryset,
+            request.GET.get('format', 'csv'), columns)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e), content_type='text/plain')
+
+def _parse_date(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
@@ -17,11 +17,14 @@ setup(
     packages=find_packages(),
     install_requires=[
         'Django>=1.4.1',
-        'requests>=0.13.0',
+        'requests>=2.4.0',
+        'futures; python_version<"3"',
         'django-admin-extensions>=0.1.1',
         'django-picklefield==0.2.1',
     ],
-    package_data={},
+    package_data={
+        'securepay': ['templates/securepay/admin/*.html'],
+    },
     classifiers=[
         'Environment :: Web Environment',
         'Intended Audience :: Developers',